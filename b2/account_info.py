@@ -11,9 +11,11 @@
 import collections
 import json
 import os
+import socket
 import sqlite3
 import stat
 import threading
+import time
 from abc import (ABCMeta, abstractmethod)
 
 import six
@@ -128,6 +130,13 @@ class AbstractAccountInfo(object):
         the bucket.
         """
 
+    def discard_bucket_upload_url(self, bucket_id, upload_auth_token):
+        """
+        Forgets an upload URL that was taken from the pool, and won't
+        be put back because uploading to it failed.  Pools that remove
+        URLs when they are taken have nothing to do.
+        """
+
     @abstractmethod
     def put_large_file_upload_url(self, file_id, upload_url, upload_auth_token):
         pass
@@ -140,13 +149,43 @@ class AbstractAccountInfo(object):
     def clear_large_file_upload_urls(self, file_id):
         pass
 
+    def discard_large_file_upload_url(self, file_id, upload_auth_token):
+        """
+        Like discard_bucket_upload_url(), for part upload URLs.
+        """
+
 
 class SqliteAccountInfo(AbstractAccountInfo):
     """
     Stores account information in an sqlite database, which is
     used to manage concurrent access to the data.
+
+    Upload URLs for buckets are kept in the database too, so that
+    processes running at the same time can share them.  Upload URLs
+    for the parts of a large file are only used by the process that
+    is uploading it, once per part, so they are kept in memory, where
+    taking and putting them back doesn't cost a database transaction
+    each.  Taking a bucket URL leases it to this process,
+    and putting it back ends the lease, so the same URL is never in
+    use by two uploads at once.  A lease that isn't ended within
+    UPLOAD_URL_LEASE_SECONDS is assumed to belong to a process that
+    died, and the URL goes back in the pool.  URLs are dropped after
+    UPLOAD_URL_LIFETIME_SECONDS, a bit before the service expires them.
     """
 
+    # The version of the tables, which is kept in sqlite's user_version.
+    # Older versions of b2 don't look at it, and ignore the tables they
+    # don't know about.
+    SCHEMA_VERSION = 2
+
+    UPLOAD_URL_LEASE_SECONDS = 3600
+    UPLOAD_URL_LIFETIME_SECONDS = 23 * 3600
+
+    ACCOUNT_COLUMNS = (
+        'account_id', 'application_key', 'account_auth_token', 'api_url', 'download_url',
+        'minimum_part_size', 'realm'
+    )
+
     def __init__(self, file_name=None):
         self.thread_local = threading.local()
         user_account_info_path = file_name or os.environ.get(
@@ -156,12 +195,20 @@ class SqliteAccountInfo(AbstractAccountInfo):
         self._validate_database()
         with self._get_connection() as conn:
             self._create_tables(conn)
+        self._use_write_ahead_log()
 
-        self._large_file_uploads = collections.defaultdict(
-            list
-        )  # We don't keep large file upload URLs across a reload
+        # Bumped whenever this object changes the account row, so that
+        # every thread's copy of it gets re-read.
+        self._account_generation = 0
 
-        # this lock controls access to self._large_file_uploads
+        # When each URL leased by this process was first pooled, by
+        # upload auth token, so that it keeps its age when put back.
+        self._leased_created_millis = {}
+
+        self._large_file_upload_urls = collections.defaultdict(list)
+
+        # this lock controls access to self._account_generation,
+        # self._leased_created_millis and self._large_file_upload_urls
         self._lock = threading.Lock()
 
     def _validate_database(self):
@@ -227,6 +274,18 @@ class SqliteAccountInfo(AbstractAccountInfo):
     def _connect(self):
         return sqlite3.connect(self.filename, isolation_level='EXCLUSIVE')
 
+    def _use_write_ahead_log(self):
+        """
+        Switches the database to write-ahead logging, so that reading
+        doesn't wait for writers in other threads and processes.  The
+        setting is stored in the file.  Some file systems (like network
+        shares) can't do it, and the database stays as it was.
+        """
+        try:
+            self._get_connection().execute('PRAGMA journal_mode=WAL;')
+        except sqlite3.DatabaseError:
+            pass
+
     def _create_database(self):
         """
         Makes sure that the database is created and sets the file permissions.
@@ -267,43 +326,83 @@ class SqliteAccountInfo(AbstractAccountInfo):
            );
         """
         )
-        conn.execute(
+        if self.SCHEMA_VERSION <= self._get_schema_version(conn):
+            return
+        # Another process may be upgrading too, so check again once
+        # the database is locked.
+        conn.execute('BEGIN EXCLUSIVE;')
+        schema_version = self._get_schema_version(conn)
+        if schema_version < 1:
+            # Older versions of b2 keep upload URLs, without leases, in
+            # bucket_upload_url.  That table is left alone for them.
+            conn.execute(
+                """
+               CREATE TABLE IF NOT EXISTS
+               upload_url (
+                   pool TEXT NOT NULL,
+                   upload_url TEXT NOT NULL,
+                   upload_auth_token TEXT NOT NULL UNIQUE,
+                   created_millis INTEGER NOT NULL,
+                   lease_owner TEXT,
+                   lease_expires_millis INTEGER
+               );
             """
-           CREATE TABLE IF NOT EXISTS
-           bucket_upload_url (
-               bucket_id TEXT NOT NULL,
-               upload_url TEXT NOT NULL,
-               upload_auth_token TEXT NOT NULL
-           );
-        """
-        )
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS upload_url_pool ON upload_url (pool);')
+        if schema_version < 2:
+            # Changed every time the account row is written.  Older
+            # versions of b2 leave it NULL.
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(account);')]
+            if 'generation' not in columns:
+                conn.execute('ALTER TABLE account ADD COLUMN generation INTEGER;')
+        conn.execute('PRAGMA user_version = %d;' % (self.SCHEMA_VERSION,))
+
+    def _get_schema_version(self, conn):
+        return conn.execute('PRAGMA user_version;').fetchone()[0]
 
     def clear(self):
         with self._get_connection() as conn:
             conn.execute('DELETE FROM account;')
             conn.execute('DELETE FROM bucket;')
-            conn.execute('DELETE FROM bucket_upload_url;')
+            conn.execute('DELETE FROM upload_url;')
+        with self._lock:
+            self._large_file_upload_urls = collections.defaultdict(list)
+        self._account_changed()
 
     def set_auth_data(
         self, account_id, account_auth_token, api_url, download_url, minimum_part_size,
         application_key, realm
     ):
         with self._get_connection() as conn:
+            # Upload auth tokens don't depend on the account auth token, so
+            # the pooled upload URLs are still good after authorizing the
+            # same account again.  Other processes may be using them.
+            old_account = conn.execute('SELECT account_id, generation FROM account;').fetchone()
+            # The row may have been deleted by clear(), and a reader can
+            # still have a copy of it, so a new generation starts from the
+            # clock rather than from 1.
+            generation = self._now_millis()
+            if old_account is not None and old_account[1] is not None:
+                generation = max(generation, old_account[1] + 1)
+            if old_account is None or old_account[0] != account_id:
+                conn.execute('DELETE FROM upload_url;')
+                with self._lock:
+                    self._large_file_upload_urls = collections.defaultdict(list)
             conn.execute('DELETE FROM account;')
             conn.execute('DELETE FROM bucket;')
-            conn.execute('DELETE FROM bucket_upload_url;')
             insert_statement = """
                 INSERT INTO account
-                (account_id, application_key, account_auth_token, api_url, download_url, minimum_part_size, realm)
-                values (?, ?, ?, ?, ?, ?, ?);
+                (account_id, application_key, account_auth_token, api_url, download_url, minimum_part_size, realm, generation)
+                values (?, ?, ?, ?, ?, ?, ?, ?);
             """
 
             conn.execute(
                 insert_statement, (
                     account_id, application_key, account_auth_token, api_url, download_url,
-                    minimum_part_size, realm
+                    minimum_part_size, realm, generation
                 )
             )
+        self._account_changed()
 
     def get_application_key(self):
         return self._get_account_info_or_raise('application_key')
@@ -328,12 +427,53 @@ class SqliteAccountInfo(AbstractAccountInfo):
 
     def _get_account_info_or_raise(self, column_name):
         try:
-            with self._get_connection() as conn:
-                cursor = conn.execute('SELECT %s FROM account;' % (column_name,))
-                value = cursor.fetchone()[0]
-                return value
+            row = self._get_account_row()
         except Exception as e:
             raise MissingAccountData(str(e))
+        if row is None:
+            raise MissingAccountData(column_name)
+        return row[column_name]
+
+    def _get_account_row(self):
+        """
+        Returns the account row as a dict, or None if there isn't one.
+
+        The row changes only when the account is authorized again, but
+        it is read for every API call, so each thread keeps a copy.
+        Nothing is read while sqlite's data_version says that no other
+        connection (another thread or process) has written to the
+        database, and this object hasn't changed the row.  Other writes,
+        like leasing upload URLs, are common, so after one the row's
+        generation is checked, and the copy is only read again if the
+        generation has changed.  A row written by an older version of
+        b2 has no generation, and is always read again.
+        """
+        conn = self._get_connection()
+        local = self.thread_local
+        key = (self._account_generation, conn.execute('PRAGMA data_version;').fetchone()[0])
+        if getattr(local, 'account_row_key', None) != key:
+            generation_row = conn.execute('SELECT generation FROM account;').fetchone()
+            if generation_row is None:
+                local.account_row = None
+                local.account_row_generation = None
+            elif (
+                generation_row[0] is None or
+                generation_row[0] != getattr(local, 'account_row_generation', None)
+            ):
+                cursor = conn.execute(
+                    'SELECT %s FROM account;' % (', '.join(self.ACCOUNT_COLUMNS),)
+                )
+                values = cursor.fetchone()
+                local.account_row = None if values is None else dict(
+                    zip(self.ACCOUNT_COLUMNS, values)
+                )
+                local.account_row_generation = generation_row[0]
+            local.account_row_key = key
+        return local.account_row
+
+    def _account_changed(self):
+        with self._lock:
+            self._account_generation += 1
 
     def refresh_entire_bucket_name_cache(self, name_id_iterable):
         with self._get_connection() as conn:
@@ -367,48 +507,282 @@ class SqliteAccountInfo(AbstractAccountInfo):
             return None
 
     def put_bucket_upload_url(self, bucket_id, upload_url, upload_auth_token):
+        self._put_upload_url(self._bucket_pool(bucket_id), upload_url, upload_auth_token)
+
+    def clear_bucket_upload_data(self, bucket_id):
+        self._clear_upload_urls(self._bucket_pool(bucket_id))
+
+    def take_bucket_upload_url(self, bucket_id):
+        return self._take_upload_url(self._bucket_pool(bucket_id))
+
+    def discard_bucket_upload_url(self, bucket_id, upload_auth_token):
+        self._discard_upload_url(upload_auth_token)
+
+    def put_large_file_upload_url(self, file_id, upload_url, upload_auth_token):
+        with self._lock:
+            self._large_file_upload_urls[file_id].append((upload_url, upload_auth_token))
+
+    def take_large_file_upload_url(self, file_id):
+        with self._lock:
+            url_list = self._large_file_upload_urls.get(file_id)
+            if not url_list:
+                return (None, None)
+            return url_list.pop()
+
+    def clear_large_file_upload_urls(self, file_id):
+        with self._lock:
+            self._large_file_upload_urls.pop(file_id, None)
+
+    def _bucket_pool(self, bucket_id):
+        return 'bucket:' + bucket_id
+
+    def _lease_owner(self):
+        # looked up each time, in case the process has forked
+        return '%s:%d' % (socket.gethostname(), os.getpid())
+
+    def _now_millis(self):
+        return int(round(time.time() * 1000))
+
+    def _put_upload_url(self, pool, upload_url, upload_auth_token):
+        """
+        Ends this process's lease on the URL, or adds the URL to the
+        pool if it is new.  If the lease ran out and another process
+        has the URL now, leaves it alone.
+
+        A URL that was taken from the pool keeps the time it was first
+        pooled, so using it doesn't extend its lifetime.  If it has
+        been dropped from the pool in the meantime because it is too
+        old, it isn't put back.
+        """
+        now_millis = self._now_millis()
+        with self._lock:
+            created_millis = self._leased_created_millis.pop(upload_auth_token, now_millis)
+        if created_millis < now_millis - self.UPLOAD_URL_LIFETIME_SECONDS * 1000:
+            self._discard_upload_url(upload_auth_token)
+            return
+        with self._get_connection() as conn:
+            cursor = conn.execute(
+                'UPDATE upload_url SET lease_owner = NULL, lease_expires_millis = NULL '
+                'WHERE upload_auth_token = ? AND lease_owner = ?;',
+                (upload_auth_token, self._lease_owner())
+            )
+            if cursor.rowcount == 0:
+                conn.execute(
+                    'INSERT OR IGNORE INTO upload_url '
+                    '(pool, upload_url, upload_auth_token, created_millis) VALUES (?, ?, ?, ?);',
+                    (pool, upload_url, upload_auth_token, created_millis)
+                )
+
+    def _take_upload_url(self, pool):
+        """
+        Leases a URL from the pool.  Everything happens in one
+        exclusive transaction, started by the DELETE, so two
+        processes can't lease the same URL.
+        """
+        now_millis = self._now_millis()
+        with self._get_connection() as conn:
+            conn.execute(
+                'DELETE FROM upload_url WHERE created_millis < ?;',
+                (now_millis - self.UPLOAD_URL_LIFETIME_SECONDS * 1000,)
+            )
+            row = conn.execute(
+                'SELECT rowid, upload_url, upload_auth_token, created_millis FROM upload_url '
+                'WHERE pool = ? AND (lease_owner IS NULL OR lease_expires_millis < ?) LIMIT 1;',
+                (pool, now_millis)
+            ).fetchone()
+            if row is None:
+                return (None, None)
+            (rowid, upload_url, upload_auth_token, created_millis) = row
+            conn.execute(
+                'UPDATE upload_url SET lease_owner = ?, lease_expires_millis = ? WHERE rowid = ?;',
+                (
+                    self._lease_owner(), now_millis + self.UPLOAD_URL_LEASE_SECONDS * 1000,
+                    rowid
+                )
+            )
+        with self._lock:
+            self._leased_created_millis[upload_auth_token] = created_millis
+        return (upload_url, upload_auth_token)
+
+    def _discard_upload_url(self, upload_auth_token):
+        with self._lock:
+            self._leased_created_millis.pop(upload_auth_token, None)
         with self._get_connection() as conn:
             conn.execute(
-                'INSERT INTO bucket_upload_url (bucket_id, upload_url, upload_auth_token) values (?, ?, ?);',
-                (bucket_id, upload_url, upload_auth_token)
+                'DELETE FROM upload_url WHERE upload_auth_token = ?;', (upload_auth_token,)
             )
 
-    def clear_bucket_upload_data(self, bucket_id):
+    def _clear_upload_urls(self, pool):
         with self._get_connection() as conn:
-            conn.execute('DELETE FROM bucket_upload_url WHERE bucket_id = ?;', (bucket_id,))
+            conn.execute('DELETE FROM upload_url WHERE pool = ?;', (pool,))
+
+
+class InMemoryAccountInfo(AbstractAccountInfo):
+    """
+    Keeps account information in memory, so that API calls don't
+    touch the file system.  Meant for programs that use B2Api as a
+    library, especially where the file system is read-only.
+
+    The account and the bucket names can be saved to a file with
+    save_snapshot(), and read back with load_snapshot(), so that a
+    program can start without authorizing again.  Upload URLs are
+    not saved.
+
+    This class is THREAD SAFE.
+    """
+
+    SNAPSHOT_ACCOUNT_KEYS = (
+        'account_id', 'application_key', 'account_auth_token', 'api_url', 'download_url',
+        'minimum_part_size', 'realm'
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._account = None
+        self._bucket_ids_by_name = {}
+        self._bucket_upload_urls = collections.defaultdict(list)
+        self._large_file_upload_urls = collections.defaultdict(list)
+
+    def clear(self):
+        with self._lock:
+            self._account = None
+            self._bucket_ids_by_name = {}
+            self._bucket_upload_urls = collections.defaultdict(list)
+            self._large_file_upload_urls = collections.defaultdict(list)
+
+    def set_auth_data(
+        self, account_id, account_auth_token, api_url, download_url, minimum_part_size,
+        application_key, realm
+    ):
+        with self._lock:
+            if self._account is None or self._account['account_id'] != account_id:
+                # Upload URLs stay good when the same account is authorized again.
+                self._bucket_upload_urls = collections.defaultdict(list)
+                self._large_file_upload_urls = collections.defaultdict(list)
+            self._account = dict(
+                account_id=account_id,
+                application_key=application_key,
+                account_auth_token=account_auth_token,
+                api_url=api_url,
+                download_url=download_url,
+                minimum_part_size=minimum_part_size,
+                realm=realm
+            )
+            self._bucket_ids_by_name = {}
+
+    def get_application_key(self):
+        return self._get_account_info_or_raise('application_key')
+
+    def get_account_id(self):
+        return self._get_account_info_or_raise('account_id')
+
+    def get_api_url(self):
+        return self._get_account_info_or_raise('api_url')
+
+    def get_account_auth_token(self):
+        return self._get_account_info_or_raise('account_auth_token')
+
+    def get_download_url(self):
+        return self._get_account_info_or_raise('download_url')
+
+    def get_realm(self):
+        return self._get_account_info_or_raise('realm')
+
+    def get_minimum_part_size(self):
+        return self._get_account_info_or_raise('minimum_part_size')
+
+    def _get_account_info_or_raise(self, key):
+        account = self._account
+        if account is None:
+            raise MissingAccountData(key)
+        return account[key]
+
+    def refresh_entire_bucket_name_cache(self, name_id_iterable):
+        with self._lock:
+            self._bucket_ids_by_name = dict(name_id_iterable)
+
+    def save_bucket(self, bucket):
+        with self._lock:
+            for (name, bucket_id) in list(six.iteritems(self._bucket_ids_by_name)):
+                if bucket_id == bucket.id_:
+                    del self._bucket_ids_by_name[name]
+            self._bucket_ids_by_name[bucket.name] = bucket.id_
+
+    def remove_bucket_name(self, bucket_name):
+        with self._lock:
+            self._bucket_ids_by_name.pop(bucket_name, None)
+
+    def get_bucket_id_or_none_from_bucket_name(self, bucket_name):
+        with self._lock:
+            return self._bucket_ids_by_name.get(bucket_name)
+
+    def put_bucket_upload_url(self, bucket_id, upload_url, upload_auth_token):
+        with self._lock:
+            self._bucket_upload_urls[bucket_id].append((upload_url, upload_auth_token))
 
     def take_bucket_upload_url(self, bucket_id):
-        try:
-            with self._get_connection() as conn:
-                cursor = conn.execute(
-                    'SELECT upload_url, upload_auth_token FROM bucket_upload_url WHERE bucket_id = ?;',
-                    (bucket_id,)
-                )
-                (upload_url, upload_auth_token) = cursor.fetchone()
-                conn.execute(
-                    'DELETE FROM bucket_upload_url WHERE upload_auth_token = ?;',
-                    (upload_auth_token,)
-                )
-                return (upload_url, upload_auth_token)
-        except:
-            return (None, None)
+        with self._lock:
+            return self._take_from(self._bucket_upload_urls, bucket_id)
+
+    def clear_bucket_upload_data(self, bucket_id):
+        with self._lock:
+            self._bucket_upload_urls.pop(bucket_id, None)
 
     def put_large_file_upload_url(self, file_id, upload_url, upload_auth_token):
         with self._lock:
-            self._large_file_uploads[file_id].append((upload_url, upload_auth_token))
+            self._large_file_upload_urls[file_id].append((upload_url, upload_auth_token))
 
     def take_large_file_upload_url(self, file_id):
         with self._lock:
-            url_list = self._large_file_uploads.get(file_id, [])
-            if len(url_list) == 0:
-                return (None, None)
-            else:
-                return url_list.pop()
+            return self._take_from(self._large_file_upload_urls, file_id)
 
     def clear_large_file_upload_urls(self, file_id):
         with self._lock:
-            if file_id in self._large_file_uploads:
-                del self._large_file_uploads[file_id]
+            self._large_file_upload_urls.pop(file_id, None)
+
+    def _take_from(self, pools, key):
+        url_list = pools.get(key)
+        if not url_list:
+            return (None, None)
+        return url_list.pop()
+
+    def save_snapshot(self, file_name):
+        """
+        Writes the account and the bucket names to a file that only
+        this user can read.  The file is replaced all at once, so a
+        reader never sees part of it.
+        """
+        with self._lock:
+            data = dict(account=self._account, buckets=self._bucket_ids_by_name)
+            content = json.dumps(data).encode('utf-8')
+        temp_file_name = file_name + '.tmp'
+        fd = os.open(
+            temp_file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IRUSR | stat.S_IWUSR
+        )
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        if os.name == 'nt' and os.path.exists(file_name):
+            os.unlink(file_name)  # rename won't replace a file on Windows
+        os.rename(temp_file_name, file_name)
+
+    def load_snapshot(self, file_name):
+        """
+        Replaces everything with what is in a file written by save_snapshot().
+        """
+        try:
+            with open(file_name, 'rb') as f:
+                data = json.loads(f.read().decode('utf-8'))
+            account = data['account']
+            if account is not None and not all(k in account for k in self.SNAPSHOT_ACCOUNT_KEYS):
+                raise ValueError('missing account data')
+            buckets = dict(data['buckets'])
+        except (ValueError, KeyError, TypeError):
+            raise CorruptAccountInfo(file_name)
+        with self._lock:
+            self._account = account
+            self._bucket_ids_by_name = buckets
+            self._bucket_upload_urls = collections.defaultdict(list)
+            self._large_file_upload_urls = collections.defaultdict(list)
 
 
 class StubAccountInfo(AbstractAccountInfo):
@@ -12,11 +12,18 @@ from .account_info import SqliteAccountInfo
 from .b2http import B2Http
 from .bucket import Bucket, BucketFactory
 from .cache import AuthInfoCache, DummyCache
+from .content_cache import CachingDownloadDest
+from .download_stream import (DEFAULT_PART_SIZE, DownloadStream, write_file_in_order)
 from .exception import MissingAccountData, NonExistentBucket
+from .file_info_cache import FileInfoCache
 from .file_version import FileVersionInfoFactory, FileIdAndName
 from .part import PartFactory
+from .progress import StallWatchdog
+from .random_access_file import B2RandomAccessFile
 from .raw_api import B2RawApi
+from .retry import RetryBudget, RetryPolicy
 from .session import B2Session
+from .upload_health import UploadHealthTracker
 
 try:
     import concurrent.futures as futures
@@ -52,36 +59,100 @@ class B2Api(object):
     such as auth tokens and upload URLs.
     """
 
-    def __init__(self, account_info=None, cache=None, raw_api=None, max_upload_workers=10):
+    def __init__(
+        self,
+        account_info=None,
+        cache=None,
+        raw_api=None,
+        max_upload_workers=10,
+        retry_policy=None,
+        stall_watchdog=None,
+        hedging_policy=None,
+        refresh_auth_after_seconds=None,
+        file_info_cache=None,
+        listing_index=None,
+        content_cache=None,
+        expect_continue_timeout=None,
+        concurrency_controller=None
+    ):
         """
         Initializes the API using the given account info.
-        :param account_info:
+        :param account_info: where to keep auth tokens and upload URLs; defaults to
+                             a SqliteAccountInfo.  Use an InMemoryAccountInfo to
+                             keep them off the disk.
         :param cache:
         :param raw_api:
+        :param retry_policy: the RetryPolicy for HTTP calls and uploads
+        :param stall_watchdog: the StallWatchdog that notices stalled transfers
+        :param hedging_policy: optional HedgingPolicy for slow calls that are safe to repeat
+        :param refresh_auth_after_seconds: when set, the auth token is replaced once it is
+                                           this old, before it can expire
+        :param file_info_cache: the FileInfoCache that remembers file versions; defaults to
+                                one kept in memory
+        :param listing_index: optional ListingIndex to keep up to date with the files
+                              uploaded, hidden and deleted
+        :param content_cache: optional ContentCache that downloads are served from
+                              when they can be, and kept in
+        :param expect_continue_timeout: when set, uploads are sent with "Expect: 100-continue"
+                                        (see B2Http); off by default
+        :param concurrency_controller: optional ConcurrencyController that limits the calls
+                                       in progress, and adapts the limits to how busy the
+                                       service is; set_thread_pool_size() sets its maximums.
+                                       A download holds its slot until its response is
+                                       closed, so don't keep more downloads open at once
+                                       than the limit.
         :return:
         """
-        self.raw_api = raw_api or B2RawApi(B2Http())
+        self.concurrency_controller = concurrency_controller
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.stall_watchdog = stall_watchdog or StallWatchdog()
+        self.hedging_policy = hedging_policy
+        self.raw_api = raw_api or B2RawApi(
+            B2Http(
+                concurrency_controller=self.concurrency_controller,
+                retry_policy=self.retry_policy,
+                hedging_policy=self.hedging_policy,
+                expect_continue_timeout=expect_continue_timeout
+            ),
+            stall_watchdog=self.stall_watchdog
+        )
         if account_info is None:
             account_info = SqliteAccountInfo()
             if cache is None:
                 cache = AuthInfoCache(account_info)
-        self.session = B2Session(self, self.raw_api)
+        self.session = B2Session(self, self.raw_api, refresh_auth_after_seconds)
         self.account_info = account_info
         if cache is None:
             cache = DummyCache()
         self.cache = cache
         self.upload_executor = None
         self.max_workers = 1
+        self.upload_health = UploadHealthTracker()
+        self.file_info_cache = file_info_cache or FileInfoCache()
+        self.listing_index = listing_index
+        self.content_cache = content_cache
 
     def set_thread_pool_size(self, max_workers):
         """
         Sets the size of the thread pool to use for uploads and downloads.
 
-        Must be called before any work starts, or the thread pool will get
-        the default size of 1.
+        Should be called before any work starts, or the thread pool will get
+        the default size of 1.  If the pool already exists and is smaller,
+        a bigger one replaces it; tasks already submitted finish in the
+        old one.
+
+        With a concurrency controller, this is also the most calls that
+        will be in progress at once.  The controller lowers the number
+        when the service says it is busy, and raises it back when it isn't.
         """
-        if self.upload_executor is not None:
-            raise Exception('thread pool already created')
+        if self.concurrency_controller is not None:
+            self.concurrency_controller.set_max_calls(max_workers, max_workers)
+        self.retry_policy.retry_budget.set_max_tokens(
+            max(RetryBudget.DEFAULT_MAX_TOKENS, RetryBudget.TOKENS_PER_WORKER * max_workers)
+        )
+        if self.upload_executor is not None and self.max_workers < max_workers:
+            self.upload_executor.shutdown(wait=False)
+            self.upload_executor = None
         self.max_workers = max_workers
 
     def get_thread_pool(self):
@@ -124,6 +195,7 @@ class B2Api(object):
             application_key,
             realm,
         )
+        self.session.auth_token_changed()
 
     def get_account_id(self):
         return self.account_info.get_account_id()
@@ -143,8 +215,44 @@ class B2Api(object):
         return bucket
 
     def download_file_by_id(self, file_id, download_dest):
+        if self.content_cache is not None:
+            response = self.content_cache.serve(file_id, download_dest)
+            if response is not None:
+                return response
+            download_dest = CachingDownloadDest(self.content_cache, download_dest)
         url_factory = self.account_info.get_download_url
-        self.session.download_file_by_id(file_id, download_dest, url_factory=url_factory)
+        response = self.session.download_file_by_id(
+            file_id, download_dest, url_factory=url_factory
+        )
+        self.remember_download(response)
+        return response
+
+    def stream_file_by_id(self, file_id, chunk_size=DownloadStream.DEFAULT_CHUNK_SIZE):
+        """
+        Starts downloading a file, and returns a DownloadStream that
+        hands over its contents as they arrive:
+
+            with api.stream_file_by_id(file_id) as stream:
+                for chunk in stream:
+                    ...
+
+        The content cache isn't used.
+        """
+        return self.session.stream_file_by_id(
+            file_id, chunk_size, url_factory=self.account_info.get_download_url
+        )
+
+    def cat_file_by_id(
+        self, file_id, output, part_size=DEFAULT_PART_SIZE, parts_in_flight=4
+    ):
+        """
+        Writes the contents of a file to a binary file-like object, like
+        standard output, in order, with several ranged downloads running
+        ahead of what has been written.  See write_file_in_order().
+
+        :return: the FileVersionInfo of the file
+        """
+        return write_file_in_order(self, file_id, output, part_size, parts_in_flight)
 
     def get_bucket_by_id(self, bucket_id):
         return Bucket(self, bucket_id)
@@ -209,16 +317,30 @@ class B2Api(object):
     # delete/cancel
     def cancel_large_file(self, file_id):
         response = self.session.cancel_large_file(file_id)
+        self._forget_file_version(file_id)
         return FileVersionInfoFactory.from_cancel_large_file_response(response)
 
     def delete_file_version(self, file_id, file_name):
         # filename argument is not first, because one day it may become optional
         response = self.session.delete_file_version(file_id, file_name)
+        self._forget_file_version(file_id)
         assert response['fileId'] == file_id
         assert response['fileName'] == file_name
         return FileIdAndName(file_id, file_name)
 
+    def _forget_file_version(self, file_id):
+        self.file_info_cache.remove(file_id)
+        if self.listing_index is not None:
+            self.listing_index.remove_file_version(file_id)
+
     # download
+    def open_file_by_id(self, file_id, **kwargs):
+        """
+        Returns a B2RandomAccessFile for reading parts of a file.  The
+        keyword arguments are passed on to it.
+        """
+        return B2RandomAccessFile(self, file_id, **kwargs)
+
     def get_download_url_for_fileid(self, file_id):
         url = url_for_api(self.account_info, 'b2_download_file_by_id')
         return '%s?fileId=%s' % (url, file_id)
@@ -226,4 +348,48 @@ class B2Api(object):
     # other
     def get_file_info(self, file_id):
         """ legacy interface which just returns whatever remote API returns """
-        return self.session.get_file_info(file_id)
+        response = self.session.get_file_info(file_id)
+        self.file_info_cache.put(FileVersionInfoFactory.from_api_response(response))
+        return response
+
+    def get_file_version_info(self, file_id):
+        """
+        Returns the FileVersionInfo for a file id, calling the service
+        only if the file info cache doesn't have it.
+        """
+        file_version_info = self.file_info_cache.get(file_id)
+        if file_version_info is None:
+            file_version_info = self._fetch_file_version_info(file_id)
+        return file_version_info
+
+    def get_file_version_infos(self, file_ids):
+        """
+        Returns a list with the FileVersionInfo for each of the file ids.
+        The ones that aren't in the file info cache are fetched at the
+        same time, in the thread pool.
+        """
+        file_ids = list(file_ids)
+        results = dict((file_id, self.file_info_cache.get(file_id)) for file_id in file_ids)
+        missing = [file_id for file_id in results if results[file_id] is None]
+        if missing:
+            thread_pool = self.get_thread_pool()
+            fetches = [
+                (file_id, thread_pool.submit(self._fetch_file_version_info, file_id))
+                for file_id in missing
+            ]
+            for (file_id, future) in fetches:
+                results[file_id] = future.result()
+        return [results[file_id] for file_id in file_ids]
+
+    def _fetch_file_version_info(self, file_id):
+        return FileVersionInfoFactory.from_api_response(self.get_file_info(file_id))
+
+    def remember_download(self, response):
+        """
+        Puts the file version described by the headers of a download in
+        the file info cache.
+        """
+        if response is not None:
+            self.file_info_cache.put(
+                FileVersionInfoFactory.from_api_response(response, force_action='upload')
+            )
@@ -10,16 +10,25 @@
 
 from __future__ import print_function
 
+import errno
 import json
+import os
+import re
+import select
 import socket
+import ssl
+import threading
+import time
 
 import requests
 import six
-import time
+from six.moves import http_client
+from six.moves.urllib.parse import urlsplit
 
+from .concurrency import DOWNLOAD, METADATA, UPLOAD
 from .exception import B2Error, BrokenPipe, ConnectionError, interpret_b2_error, UnknownError, UnknownHost
+from .retry import RetryPolicy, parse_retry_after
 from .version import USER_AGENT
-from six.moves import range
 
 
 def _print_exception(e, indent=''):
@@ -44,9 +53,11 @@ def _translate_errors(fcn, post_params=None):
         if response.status_code not in [200, 206]:
             # Decode the error object returned by the service
             error = json.loads(response.content.decode('utf-8'))
-            raise interpret_b2_error(
+            b2_error = interpret_b2_error(
                 int(error['status']), error['code'], error['message'], post_params
             )
+            b2_error.retry_after_seconds = parse_retry_after(response.headers.get('Retry-After'))
+            raise b2_error
         return response
 
     except B2Error:
@@ -76,39 +87,347 @@ def _translate_errors(fcn, post_params=None):
         raise UnknownError(repr(e))
 
 
-def _translate_and_retry(fcn, try_count, post_params=None):
+def _close_response(response):
+    response.close()
+
+
+def _translate_errors_and_report(fcn, post_params, slot, hedging_policy=None, operation=None):
+    """
+    Calls _translate_errors, and tells the concurrency slot, if
+    there is one, how it went.
+
+    If a hedging policy is given, it may make the call twice, taking
+    the first good response and closing the other.
     """
-    Try calling fcn try_count times, retrying only if
-    the exception is a retryable B2Error.
+    if hedging_policy is None:
+        try_once = lambda: _translate_errors(fcn, post_params)
+    else:
+        try_once = lambda: hedging_policy.call(
+            operation, lambda: _translate_errors(fcn, post_params), _close_response
+        )
+    if slot is None:
+        return try_once()
+    start_time = time.time()
+    try:
+        response = try_once()
+    except B2Error as e:
+        slot.report(e)
+        raise
+    slot.report(seconds=time.time() - start_time)
+    return response
+
+
+def _translate_and_retry(
+    fcn,
+    try_count,
+    post_params=None,
+    slot=None,
+    retry_policy=None,
+    operation='http',
+    hedging_policy=None
+):
+    """
+    Try calling fcn up to try_count times, retrying only if
+    the exception is a retryable B2Error.  The retry policy
+    decides how long to wait between tries, and may stop early.
+
+    The outcome of each try is reported to the concurrency slot, if
+    one is given.  The slot stays held while waiting to retry, so that
+    a busy service sees fewer calls.
+
+    Each try may be hedged by the hedging policy, if one is given.
     """
-    # For all but the last try, catch the exception.
-    wait_time = 1.0
-    for _ in range(try_count - 1):
+    retry_state = (retry_policy or _default_retry_policy).start(operation, try_count)
+    while True:
         try:
-            return _translate_errors(fcn, post_params)
+            response = _translate_errors_and_report(
+                fcn, post_params, slot, hedging_policy, operation
+            )
         except B2Error as e:
-            if not e.should_retry_http():
+            if not retry_state.failed(e, e.should_retry_http()):
                 raise
-            time.sleep(wait_time)
-            wait_time *= 1.5
+        else:
+            retry_state.succeeded()
+            return response
 
-    # If the last try gets an exception, it will be raised.
-    return _translate_errors(fcn, post_params)
+
+def _operation_name(url):
+    """
+    Returns the API name to record retries under, like 'b2_list_file_names',
+    or None for URLs that aren't API calls.
+    """
+    last_part = urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+    if last_part.startswith('b2_'):
+        return last_part
+    return None
+
+
+_default_retry_policy = RetryPolicy()
 
 
 class ResponseContextManager(object):
     """
-    Context manager that closes a requests.Response when done.
+    Context manager that closes a requests.Response when done,
+    and releases the concurrency slot it was fetched in.
     """
 
-    def __init__(self, response):
+    def __init__(self, response, slot=None):
         self.response = response
+        self.slot = slot
 
     def __enter__(self):
         return self.response
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.response.close()
+        try:
+            self.response.close()
+        finally:
+            if self.slot is not None:
+                self.slot.release()
+
+
+class _ReplayReader(object):
+    """
+    Wraps the buffered reader for a socket, giving back a status
+    line that has already been read before reading more.
+    """
+
+    def __init__(self, first_line, fp):
+        self.first_line = first_line
+        self.fp = fp
+
+    def readline(self, *args):
+        if self.first_line is not None:
+            (line, self.first_line) = (self.first_line, None)
+            return line
+        return self.fp.readline(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+
+class _ReaderSocket(object):
+    """
+    Stands in for a socket when making an HTTPResponse, so the
+    response reads from a reader we already have.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def makefile(self, *args, **kwargs):
+        return self.fp
+
+
+class _ContinueResponse(object):
+    """
+    The parts of a requests.Response that B2Http uses, for responses
+    fetched by ExpectContinuePoster.
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def close(self):
+        pass
+
+
+def shut_down_response(response):
+    """
+    Breaks the connection that a streamed response is being read
+    from, so that a thread waiting for more of it wakes up.  Called
+    from another thread, when a download stalls.
+    """
+    connection = getattr(getattr(response, 'raw', None), '_connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+            return
+        except socket.error:
+            pass
+    try:
+        response.close()
+    except Exception:
+        pass
+
+
+def _make_ssl_context():
+    """
+    Returns an SSL context that trusts the same CAs requests does,
+    including a bundle named by REQUESTS_CA_BUNDLE or CURL_CA_BUNDLE.
+    """
+    ca_bundle = os.environ.get('REQUESTS_CA_BUNDLE') or os.environ.get('CURL_CA_BUNDLE') or \
+        requests.certs.where()
+    if os.path.isdir(ca_bundle):
+        return ssl.create_default_context(capath=ca_bundle)
+    return ssl.create_default_context(cafile=ca_bundle)
+
+
+class ExpectContinuePoster(object):
+    """
+    Posts content with "Expect: 100-continue", so that a server that
+    is going to reject the request (like a busy storage pod returning
+    503) can say so before the body is sent.  The body is sent when
+    the server says "100 Continue", or when it has said nothing for
+    continue_timeout seconds.
+
+    The requests library can't do this, so this uses http.client
+    directly, keeping a connection open in each thread.  It verifies
+    certificates with the same CA bundle requests uses, but it can't
+    go through a proxy; use can_post() to check that the URL doesn't
+    need one, and post with requests when it does.
+
+    Only works on Python 3.
+
+    This class is THREAD SAFE.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    MAX_LINE_LENGTH = 65536
+    CONTINUE_STATUS_PATTERN = re.compile(six.b(r'^HTTP/\d\.\d 100\b'))
+
+    # Seconds to wait for the connection to open, and for each read
+    # and write after that.
+    CONNECT_TIMEOUT = 30
+    READ_TIMEOUT = 300
+
+    def __init__(self, continue_timeout):
+        self.continue_timeout = continue_timeout
+        self.local = threading.local()
+
+    def can_post(self, url):
+        """
+        Returns False if the environment says to use a proxy for the URL.
+        """
+        return not requests.utils.get_environ_proxies(url)
+
+    def post(self, url, headers, data):
+        """
+        :return: a response with status_code, headers, and content
+        """
+        parsed = urlsplit(url)
+        key = (parsed.scheme, parsed.netloc)
+        path = parsed.path + ('?' + parsed.query if parsed.query else '')
+        connection = self._get_connection(key)
+        stall_detector = getattr(data, 'stall_detector', None)
+        if stall_detector is not None:
+            stall_detector.add_abort_callback(lambda: self._shut_down(connection))
+        try:
+            (response, body_sent) = self._post(connection, path, headers, data)
+        except socket.error as e:
+            self._drop_connection(key)
+            if stall_detector is not None:
+                stall_detector.raise_if_stalled()
+            if e.errno in (errno.EPIPE, errno.ECONNRESET):
+                # The server stopped reading the body, which it does
+                # when it rejects an upload.
+                raise BrokenPipe()
+            raise ConnectionError(str(e))
+        except http_client.HTTPException as e:
+            self._drop_connection(key)
+            if stall_detector is not None:
+                stall_detector.raise_if_stalled()
+            raise ConnectionError(repr(e))
+        except:
+            self._drop_connection(key)
+            raise
+        if not body_sent:
+            # The server is still expecting the body we promised it.
+            self._drop_connection(key)
+        return response
+
+    def _post(self, connection, path, headers, data):
+        connection.putrequest('POST', path, skip_accept_encoding=True)
+        for (name, value) in six.iteritems(headers):
+            connection.putheader(name, value)
+        connection.putheader('Expect', '100-continue')
+        connection.endheaders()
+        connection.sock.settimeout(self.READ_TIMEOUT)
+
+        fp = connection.sock.makefile('rb')
+        status_line = self._wait_for_status(connection.sock, fp)
+        body_sent = False
+        if status_line is None or self.CONTINUE_STATUS_PATTERN.match(status_line):
+            self._send_body(connection, data)
+            body_sent = True
+            status_line = None
+
+        def make_response(sock, *args, **kwargs):
+            return http_client.HTTPResponse(
+                _ReaderSocket(_ReplayReader(status_line, fp)), *args, **kwargs
+            )
+
+        connection.response_class = make_response
+        response = connection.getresponse()
+        content = response.read()
+        return (_ContinueResponse(response.status, response.msg, content), body_sent)
+
+    def _wait_for_status(self, sock, fp):
+        """
+        Waits up to continue_timeout for the server to answer the
+        headers.  Returns the status line of the answer, or None if
+        there isn't one yet.  If the answer is "100 Continue", reads
+        the rest of it.
+        """
+        (readable, _, _) = select.select([sock], [], [], self.continue_timeout)
+        if not readable:
+            return None
+        status_line = fp.readline(self.MAX_LINE_LENGTH)
+        if not status_line:
+            raise http_client.BadStatusLine(repr(status_line))
+        if self.CONTINUE_STATUS_PATTERN.match(status_line):
+            # skip the headers of the interim response
+            while fp.readline(self.MAX_LINE_LENGTH).strip():
+                pass
+        return status_line
+
+    def _send_body(self, connection, data):
+        while True:
+            chunk = data.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+            connection.send(chunk)
+
+    def _shut_down(self, connection):
+        """
+        Breaks the connection of a stalled upload, so that the thread
+        waiting on it wakes up.  Called from another thread.
+        """
+        sock = connection.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def _get_connection(self, key):
+        """
+        Returns this thread's connection to the host.  Each thread keeps
+        just one connection open, because upload URLs, and so hosts,
+        change often.
+        """
+        if getattr(self.local, 'key', None) != key:
+            self._drop_connection(getattr(self.local, 'key', None))
+            (scheme, netloc) = key
+            if scheme == 'https':
+                self.local.connection = http_client.HTTPSConnection(
+                    netloc, timeout=self.CONNECT_TIMEOUT, context=_make_ssl_context()
+                )
+            else:
+                self.local.connection = http_client.HTTPConnection(
+                    netloc, timeout=self.CONNECT_TIMEOUT
+                )
+            self.local.key = key
+        return self.local.connection
+
+    def _drop_connection(self, key):
+        if key is not None and getattr(self.local, 'key', None) == key:
+            self.local.connection.close()
+            self.local.connection = None
+            self.local.key = None
 
 
 class B2Http(object):
@@ -132,14 +451,53 @@ class B2Http(object):
             ...
     """
 
-    def __init__(self, requests_module=None):
+    # A good number of seconds to wait for "100 Continue" before sending
+    # an upload anyway, for those who turn it on.
+    EXPECT_CONTINUE_TIMEOUT = 1.0
+
+    def __init__(
+        self,
+        requests_module=None,
+        concurrency_controller=None,
+        retry_policy=None,
+        expect_continue_timeout=None,
+        hedging_policy=None
+    ):
         """
         Initialize with a reference to the requests module, which makes
         it easy to mock for testing.
+
+        :param concurrency_controller: optional ConcurrencyController that
+                                       limits the number of calls in progress
+        :param retry_policy: the RetryPolicy that decides when to retry
+        :param expect_continue_timeout: when set, uploads are sent with "Expect:
+                                        100-continue", and wait this long for "100
+                                        Continue" before sending the body; uploads
+                                        that go through a proxy are sent without it
+        :param hedging_policy: optional HedgingPolicy that sends a second copy
+                               of slow calls that are safe to repeat
         """
         self.requests = requests_module or requests
-
-    def post_content_return_json(self, url, headers, data, try_count=1, post_params=None):
+        self.concurrency_controller = concurrency_controller
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.expect_continue_poster = None
+        if expect_continue_timeout is not None and six.PY3:
+            self.expect_continue_poster = ExpectContinuePoster(expect_continue_timeout)
+        self.hedging_policy = hedging_policy
+
+    def _get_hedging_policy(self, operation):
+        if self.hedging_policy is None or not self.hedging_policy.applies_to(operation):
+            return None
+        return self.hedging_policy
+
+    def _acquire_slot(self, kind):
+        if self.concurrency_controller is None:
+            return None
+        return self.concurrency_controller.get_limit(kind).acquire()
+
+    def post_content_return_json(
+        self, url, headers, data, try_count=1, post_params=None, call_kind=UPLOAD
+    ):
         """
         Use like this:
 
@@ -152,6 +510,7 @@ class B2Http(object):
         :param url: URL to call
         :param headers: Headers to send.
         :param data: bytes (Python 3) or str (Python 2), or a file-like object, to send
+        :param call_kind: which concurrency limit applies, UPLOAD or METADATA
         :return: a dict that is the decoded JSON
         """
         # Make the headers we'll send by adding User-Agent to what
@@ -159,22 +518,48 @@ class B2Http(object):
         headers = dict(headers)  # make copy before modifying
         headers['User-Agent'] = USER_AGENT
 
+        operation = _operation_name(url) or call_kind
+        hedging_policy = self._get_hedging_policy(operation)
+        content = None
+        if hedging_policy is not None:
+            # Two copies of the call may be sending at once, so they
+            # can't share the stream.
+            data.seek(0)
+            content = data.read()
+
         # Do the HTTP POST.  This may retry, so each post needs to
         # rewind the data back to the beginning.
         def do_post():
+            poster = self.expect_continue_poster
+            if call_kind == UPLOAD and poster is not None and poster.can_post(url):
+                body = data if content is None else six.BytesIO(content)
+                body.seek(0)
+                return poster.post(url, headers, body)
+            if content is not None:
+                return self.requests.post(url, headers=headers, data=content)
             data.seek(0)
             return self.requests.post(url, headers=headers, data=data)
 
-        response = _translate_and_retry(do_post, try_count, post_params)
-
-        # Decode the JSON that came back.  If we've gotten this far,
-        # we know we have a status of 200 OK.  In this case, the body
-        # of the response is always JSON, so we don't need to handle
-        # it being something else.
+        slot = self._acquire_slot(call_kind)
+        if slot is not None and call_kind == UPLOAD and 'Content-Length' in headers:
+            slot.byte_count = int(headers['Content-Length'])
         try:
-            return json.loads(response.content.decode('utf-8'))
+            response = _translate_and_retry(
+                do_post, try_count, post_params, slot, self.retry_policy, operation,
+                hedging_policy
+            )
+
+            # Decode the JSON that came back.  If we've gotten this far,
+            # we know we have a status of 200 OK.  In this case, the body
+            # of the response is always JSON, so we don't need to handle
+            # it being something else.
+            try:
+                return json.loads(response.content.decode('utf-8'))
+            finally:
+                response.close()
         finally:
-            response.close()
+            if slot is not None:
+                slot.release()
 
     def post_json_return_json(self, url, headers, params, try_count=1):
         """
@@ -192,7 +577,7 @@ class B2Http(object):
         :return: a dict that is the decoded JSON
         """
         data = six.BytesIO(six.b(json.dumps(params)))
-        return self.post_content_return_json(url, headers, data, try_count, params)
+        return self.post_content_return_json(url, headers, data, try_count, params, METADATA)
 
     def get_content(self, url, headers, try_count=1):
         """
@@ -224,8 +609,19 @@ class B2Http(object):
         def do_get():
             return self.requests.get(url, headers=headers, stream=True)
 
-        response = _translate_and_retry(do_get, try_count, None)
-        return ResponseContextManager(response)
+        # The slot is held until the content has been read.
+        operation = _operation_name(url) or DOWNLOAD
+        slot = self._acquire_slot(DOWNLOAD)
+        try:
+            response = _translate_and_retry(
+                do_get, try_count, None, slot, self.retry_policy, operation,
+                self._get_hedging_policy(operation)
+            )
+        except:
+            if slot is not None:
+                slot.release()
+            raise
+        return ResponseContextManager(response, slot)
 
 
 def test_http():
@@ -0,0 +1,338 @@
+######################################################################
+#
+# File: b2/bandwidth.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+from __future__ import division
+
+import io
+import os
+import threading
+import time
+
+from .utils import human2bytes, raise_if_shutting_down
+
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+DIRECTIONS = (UPLOAD, DOWNLOAD)
+
+UNLIMITED_WORDS = ('unlimited', 'none', 'off')
+
+
+def parse_rate(text):
+    """
+    Parses a bandwidth rate in bytes per second, like "500000",
+    "10MB" or "1.5MiB".
+
+    :param text: the rate, or "unlimited"
+    :return: the number of bytes per second, or None for no limit
+    """
+    text = text.strip()
+    if text.lower() in UNLIMITED_WORDS:
+        return None
+    if text.isdigit():
+        rate = int(text)
+    else:
+        rate = human2bytes(text)
+    if rate <= 0:
+        raise ValueError('bandwidth rate must be positive: %r' % (text,))
+    return rate
+
+
+def parse_time_of_day(text):
+    """
+    Parses a time of day like "09:30".
+
+    :return: minutes since midnight
+    """
+    parts = text.strip().split(':')
+    if len(parts) != 2 or not parts[0].isdigit() or not parts[1].isdigit():
+        raise ValueError('bad time of day: %r' % (text,))
+    (hours, minutes) = (int(parts[0]), int(parts[1]))
+    if 24 <= hours or 60 <= minutes:
+        raise ValueError('bad time of day: %r' % (text,))
+    return hours * 60 + minutes
+
+
+def parse_control_file(lines):
+    """
+    Parses the settings in a bandwidth control file.  Each line is
+    either a base rate for a direction, or a rate that applies
+    during a time-of-day window:
+
+        # comments and blank lines are ignored
+        upload = 10MB
+        download = unlimited
+        upload 09:00-18:00 = 1MB
+
+    Windows may wrap past midnight (22:00-06:00).  When windows
+    overlap, the first one listed wins.
+
+    :return: (base_rates, schedules), each a dict keyed by direction
+    """
+    base_rates = dict((direction, None) for direction in DIRECTIONS)
+    schedules = dict((direction, []) for direction in DIRECTIONS)
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        if '=' not in line:
+            raise ValueError('bad bandwidth setting: %r' % (line,))
+        (key, value) = line.split('=', 1)
+        key_parts = key.split()
+        direction = key_parts[0].lower() if key_parts else ''
+        if direction not in DIRECTIONS or 2 < len(key_parts):
+            raise ValueError('bad bandwidth setting: %r' % (line,))
+        rate = parse_rate(value)
+        if len(key_parts) == 1:
+            base_rates[direction] = rate
+        else:
+            window = key_parts[1].split('-')
+            if len(window) != 2:
+                raise ValueError('bad time window: %r' % (key_parts[1],))
+            start = parse_time_of_day(window[0])
+            end = parse_time_of_day(window[1])
+            schedules[direction].append((start, end, rate))
+    return (base_rates, schedules)
+
+
+def _in_window(minute_of_day, start, end):
+    if start <= end:
+        return start <= minute_of_day < end
+    else:
+        return start <= minute_of_day or minute_of_day < end
+
+
+class TokenBucket(object):
+    """
+    Limits the rate at which bytes go by, averaged over all of the
+    threads that use it.
+
+    Tokens accumulate at the rate, up to burst_seconds worth.  Each
+    call to consume() takes the tokens for its bytes right away,
+    going into debt if there aren't enough, and then sleeps until
+    the debt would be paid off.  So a thread never holds the lock
+    while it waits, and the total rate stays under the limit no
+    matter how many threads are transferring.
+
+    A rate of None means no limit.
+
+    This class is THREAD SAFE.
+    """
+
+    # Longest sleep between checks for the program shutting down.
+    MAX_SLEEP = 0.1
+
+    def __init__(self, rate=None, burst_seconds=1.0, clock=time.time, sleep=time.sleep):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = 0
+        self.last_time = clock()
+        self.lock = threading.Lock()
+
+    def get_rate(self):
+        return self.rate
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill(self.clock())
+            self.rate = rate
+            if rate is not None:
+                self.tokens = min(self.tokens, rate * self.burst_seconds)
+
+    def consume(self, byte_count):
+        """
+        Waits until byte_count bytes can go by without exceeding the rate.
+
+        :return: the number of seconds waited
+        """
+        if self.rate is None:
+            return 0
+        with self.lock:
+            rate = self.rate
+            if rate is None:
+                return 0
+            self._refill(self.clock())
+            self.tokens -= byte_count
+            wait_seconds = 0 if 0 <= self.tokens else -self.tokens / rate
+        self._wait(wait_seconds)
+        return wait_seconds
+
+    def _refill(self, now):
+        if self.rate is not None:
+            elapsed = max(0, now - self.last_time)
+            self.tokens = min(self.rate * self.burst_seconds, self.tokens + elapsed * self.rate)
+        self.last_time = now
+
+    def _wait(self, seconds):
+        while 0 < seconds:
+            raise_if_shutting_down()
+            chunk = min(seconds, self.MAX_SLEEP)
+            self.sleep(chunk)
+            seconds -= chunk
+
+
+class BandwidthLimiter(object):
+    """
+    Caps on the upload and download bandwidth used by all transfers
+    in the process.
+
+    Each direction has a base rate, and optionally a schedule of
+    time-of-day windows with their own rates.  Rates can be changed
+    at any time, either by calling set_rate() and set_schedule(),
+    or by pointing the limiter at a control file (see
+    parse_control_file) that is re-read whenever it changes.  The
+    file's modification time is checked at most once a second;
+    reload() re-reads it right away, and is safe to call from a
+    signal handler.
+
+    If a changed control file can't be parsed, the previous settings
+    stay in effect.
+
+    Each direction can also have a max rate, set with set_max_rate(),
+    that caps whatever the base rate, the schedule, or the control
+    file say.  The command-line limits are max rates, so a control
+    file can lower them, but not raise them.
+
+    This class is THREAD SAFE.
+    """
+
+    # Seconds between checks of the control file and the schedule.
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, clock=time.time, sleep=time.sleep, local_time=time.localtime):
+        self.clock = clock
+        self.local_time = local_time
+        self.buckets = dict(
+            (direction, TokenBucket(clock=clock, sleep=sleep)) for direction in DIRECTIONS
+        )
+        self.base_rates = dict((direction, None) for direction in DIRECTIONS)
+        self.max_rates = dict((direction, None) for direction in DIRECTIONS)
+        self.schedules = dict((direction, []) for direction in DIRECTIONS)
+        self.control_file = None
+        self.control_file_mtime = None
+        self.next_check_time = 0
+        self.lock = threading.RLock()
+
+    def get_rate(self, direction):
+        """
+        Returns the rate in effect right now, in bytes per second,
+        or None if there is no limit.
+        """
+        return self.buckets[direction].get_rate()
+
+    def set_rate(self, direction, rate):
+        with self.lock:
+            self.base_rates[direction] = rate
+            self._apply_rates()
+
+    def set_max_rate(self, direction, rate):
+        """
+        Sets a cap on the rate that no other setting goes above, or
+        removes it if rate is None.
+        """
+        with self.lock:
+            self.max_rates[direction] = rate
+            self._apply_rates()
+
+    def set_schedule(self, direction, windows):
+        """
+        :param windows: a list of (start_minute, end_minute, rate), where
+                        the minutes are counted from midnight, local time
+        """
+        with self.lock:
+            self.schedules[direction] = list(windows)
+            self._apply_rates()
+
+    def set_control_file(self, path):
+        """
+        Takes the settings from the given file, now and whenever it changes.
+
+        Raises ValueError or IOError if the file can't be read.
+        """
+        with self.lock:
+            self.control_file = path
+            self.reload()
+
+    def reload(self):
+        """
+        Re-reads the control file, if there is one.
+        """
+        with self.lock:
+            if self.control_file is None:
+                return
+            mtime = os.path.getmtime(self.control_file)
+            with io.open(self.control_file, 'r', encoding='utf-8') as f:
+                (base_rates, schedules) = parse_control_file(f)
+            self.control_file_mtime = mtime
+            self.base_rates = base_rates
+            self.schedules = schedules
+            self._apply_rates()
+
+    def throttle_upload(self, byte_count):
+        """
+        Waits until byte_count more bytes can be uploaded.
+
+        :return: the number of seconds waited
+        """
+        return self._throttle(UPLOAD, byte_count)
+
+    def throttle_download(self, byte_count):
+        """
+        Waits until byte_count more bytes can be downloaded.
+
+        :return: the number of seconds waited
+        """
+        return self._throttle(DOWNLOAD, byte_count)
+
+    def _throttle(self, direction, byte_count):
+        if self.next_check_time <= self.clock():
+            self._check()
+        return self.buckets[direction].consume(byte_count)
+
+    def _check(self):
+        with self.lock:
+            now = self.clock()
+            if now < self.next_check_time:
+                return
+            self.next_check_time = now + self.CHECK_INTERVAL
+            if self.control_file is not None:
+                try:
+                    if os.path.getmtime(self.control_file) != self.control_file_mtime:
+                        self.reload()
+                except (IOError, OSError, ValueError):
+                    pass  # keep the settings we have
+            self._apply_rates()
+
+    def _apply_rates(self):
+        local_time = self.local_time(self.clock())
+        minute_of_day = local_time.tm_hour * 60 + local_time.tm_min
+        for direction in DIRECTIONS:
+            rate = self.base_rates[direction]
+            for (start, end, window_rate) in self.schedules[direction]:
+                if _in_window(minute_of_day, start, end):
+                    rate = window_rate
+                    break
+            max_rate = self.max_rates[direction]
+            if max_rate is not None and (rate is None or max_rate < rate):
+                rate = max_rate
+            bucket = self.buckets[direction]
+            if bucket.get_rate() != rate:
+                bucket.set_rate(rate)
+
+
+_bandwidth_limiter = BandwidthLimiter()
+
+
+def get_bandwidth_limiter():
+    """
+    Returns the limiter shared by all transfers in this process.
+    """
+    return _bandwidth_limiter
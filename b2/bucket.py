@@ -8,22 +8,33 @@
 #
 ######################################################################
 
+import collections
 import six
 import threading
 import sys
 import tempfile
+import time
 import os
 import io
 
+from .bandwidth import get_bandwidth_limiter
+from .download_stream import (DEFAULT_PART_SIZE, DownloadStream)
 from .exception import (
-    AlreadyFailed, B2Error, MaxFileSizeExceeded, MaxPartsExceeded, MaxRetriesExceeded,
-    UnrecognizedBucketType
+    AlreadyFailed, B2Error, FileNotPresent, InvalidAuthToken, MaxFileSizeExceeded,
+    MaxPartsExceeded, MaxRetriesExceeded, UnrecognizedBucketType
 )
 from .file_version import FileVersionInfoFactory
-from .progress import DoNothingProgressListener, AbstractProgressListener, RangeOfInputStream, StreamWithProgress
+from .progress import (
+    AbstractProgressListener, DoNothingProgressListener, RangeOfInputStream, SampledProgressListener,
+    StreamWithProgress, get_progress_sampler
+)
 from .unfinished_large_file import UnfinishedLargeFile
 from .upload_source import UploadSourceBytes, UploadSourceLocalFile
-from .utils import b2_url_encode, choose_part_ranges, hex_sha1_of_stream, interruptible_get_result, validate_b2_file_name
+from .upload_url_warmer import UploadUrlWarmer
+from .utils import (
+    b2_url_encode, choose_part_ranges, interruptible_get_result, raise_if_shutting_down,
+    validate_b2_file_name
+)
 
 
 class LargeFileUploadState(object):
@@ -32,7 +43,10 @@ class LargeFileUploadState(object):
     from the tasks that upload each of the parts.
 
     The aggregated progress is passed on to a ProgressListener that
-    reports the progress for the file as a whole.
+    reports the progress for the file as a whole.  The part uploads
+    just record their progress in their own PartProgressReporter, and
+    the total is passed on when a part finishes, and by the
+    ProgressSampler while the upload is running.
 
     This class is THREAD SAFE.
     """
@@ -42,7 +56,9 @@ class LargeFileUploadState(object):
         self.error_message = None
         self.file_progress_listener = file_progress_listener
         self.part_number_to_part_state = {}
-        self.bytes_completed = 0
+        self.bytes_completed = 0  # bytes in parts that were uploaded before
+        self.part_progress_reporters = []
+        self.reported_bytes = 0
 
     def set_error(self, message):
         with self.lock:
@@ -52,10 +68,28 @@ class LargeFileUploadState(object):
         with self.lock:
             return self.error_message is not None
 
+    def get_error_message(self):
+        with self.lock:
+            return self.error_message
+
+    def add_part_progress_reporter(self, part_progress_reporter):
+        with self.lock:
+            self.part_progress_reporters.append(part_progress_reporter)
+
     def update_part_bytes(self, bytes_delta):
         with self.lock:
             self.bytes_completed += bytes_delta
-            self.file_progress_listener.bytes_completed(self.bytes_completed)
+            self._report()
+
+    def sample(self):
+        with self.lock:
+            self._report()
+
+    def _report(self):
+        total = self.bytes_completed + sum(r.byte_count for r in self.part_progress_reporters)
+        if self.reported_bytes < total:
+            self.reported_bytes = total
+            self.file_progress_listener.bytes_completed(total)
 
 
 class PartProgressReporter(AbstractProgressListener):
@@ -63,22 +97,23 @@ class PartProgressReporter(AbstractProgressListener):
     An adapter that listens to the progress of upload a part and
     gives the information to a LargeFileUploadState.
 
-    Accepts absolute bytes_completed from the uploader, and reports
-    deltas to the LargeFileUploadState.  The bytes_completed for the
-    part will drop back to 0 on a retry, which will result in a
-    negative delta.
+    Accepts absolute bytes_completed from the uploader, and just stores
+    it, without locking.  The LargeFileUploadState adds up the counts
+    from all of the parts when it reports.  The bytes_completed for the
+    part will drop back to 0 on a retry.
     """
 
     def __init__(self, large_file_upload_state):
         self.large_file_upload_state = large_file_upload_state
-        self.prev_byte_count = 0
+        self.byte_count = 0
+        large_file_upload_state.add_part_progress_reporter(self)
 
     def bytes_completed(self, byte_count):
-        self.large_file_upload_state.update_part_bytes(byte_count - self.prev_byte_count)
-        self.prev_byte_count = byte_count
+        raise_if_shutting_down()
+        self.byte_count = byte_count
 
     def close(self):
-        pass
+        self.large_file_upload_state.sample()
 
     def set_total_bytes(self, total_byte_count):
         pass
@@ -91,7 +126,12 @@ class Bucket(object):
 
     DEFAULT_CONTENT_TYPE = 'b2/x-auto'
     MAX_UPLOAD_ATTEMPTS = 5
+    # Upload retries go to a new upload URL, usually on another pod, so
+    # there's no point in waiting long for the old one to recover.
+    MAX_UPLOAD_RETRY_DELAY = 1.0
     MAX_LARGE_FILE_SIZE = 10 * 1000 * 1000 * 1000 * 1000  # 10 TB
+    LIST_PARTS_BATCH_SIZE = 1000  # the most that b2_list_parts will return
+    UPLOAD_URL_CANDIDATES = 3  # pooled upload URLs to compare when choosing one
 
     def __init__(self, api, id_, name=None, type_=None):
         self.api = api
@@ -99,6 +139,14 @@ class Bucket(object):
         self.name = name
         self.type_ = type_
 
+        # Index of unfinished large files, by file name, used to find
+        # uploads to resume.  Built on first use.
+        self._unfinished_files_by_name = None
+        self._unfinished_files_lock = threading.Lock()
+
+        # Keeps the pool of upload URLs filled, while one is running.
+        self.upload_url_warmer = None
+
     def get_id(self):
         return self.id_
 
@@ -107,19 +155,61 @@ class Bucket(object):
         return self.api.session.update_bucket(account_id, self.id_, type_)
 
     def cancel_large_file(self, file_id):
+        self._forget_unfinished_file(file_id)
         return self.api.cancel_large_file(file_id)
 
     def download_file_by_id(self, file_id, download_dest):
-        self.api.download_file_by_id(file_id, download_dest)
+        return self.api.download_file_by_id(file_id, download_dest)
 
     def download_file_by_name(self, file_name, download_dest):
+        if self.api.content_cache is not None:
+            # Finding the file id costs a listing call, but no download.
+            file_id = self._get_visible_file_id(file_name)
+            if file_id is not None:
+                return self.api.download_file_by_id(file_id, download_dest)
         account_info = self.api.account_info
-        self.api.session.download_file_by_name(
+        response = self.api.session.download_file_by_name(
             self.name,
             file_name,
             download_dest,
             url_factory=account_info.get_download_url
         )
+        self.api.remember_download(response)
+        return response
+
+    def stream_file_by_name(self, file_name, chunk_size=DownloadStream.DEFAULT_CHUNK_SIZE):
+        """
+        Like B2Api.stream_file_by_id(), for the file version a download
+        by name gets.
+        """
+        return self.api.session.stream_file_by_name(
+            self.name, file_name, chunk_size, url_factory=self.api.account_info.get_download_url
+        )
+
+    def cat_file_by_name(
+        self, file_name, output, part_size=DEFAULT_PART_SIZE, parts_in_flight=4
+    ):
+        """
+        Like B2Api.cat_file_by_id(), for the file version a download by
+        name gets.  Raises FileNotPresent if there isn't one.
+        """
+        file_id = self._get_visible_file_id(file_name)
+        if file_id is None:
+            raise FileNotPresent(file_name)
+        return self.api.cat_file_by_id(file_id, output, part_size, parts_in_flight)
+
+    def _get_visible_file_id(self, file_name):
+        """
+        Returns the id of the version of a file that a download by name
+        gets, or None if there isn't one.  The file info cache gets what
+        the listing says about it.
+        """
+        response = self.api.session.list_file_names(self.id_, file_name, 1)
+        for entry in response['files']:
+            if entry['fileName'] == file_name and entry['action'] == 'upload':
+                self.api.file_info_cache.put(FileVersionInfoFactory.from_api_response(entry))
+                return entry['fileId']
+        return None
 
     def list_parts(self, file_id, start_part_number=None, batch_size=None):
         return self.api.list_parts(file_id, start_part_number, batch_size)
@@ -176,8 +266,11 @@ class Bucket(object):
                 )
             else:
                 response = session.list_file_names(self.id_, start_file_name, fetch_count)
-            for entry in response['files']:
-                file_version_info = FileVersionInfoFactory.from_api_response(entry)
+            file_version_infos = [
+                FileVersionInfoFactory.from_api_response(entry) for entry in response['files']
+            ]
+            self.api.file_info_cache.put_many(file_version_infos)
+            for file_version_info in file_version_infos:
                 if not file_version_info.file_name.startswith(prefix):
                     # We're past the files we care about
                     return
@@ -243,9 +336,22 @@ class Bucket(object):
                 break
 
     def start_large_file(self, file_name, content_type, file_info):
-        return UnfinishedLargeFile(
+        unfinished_file = UnfinishedLargeFile(
             self.api.session.start_large_file(self.id_, file_name, content_type, file_info)
         )
+        with self._unfinished_files_lock:
+            if self._unfinished_files_by_name is not None:
+                self._unfinished_files_by_name[file_name].append(unfinished_file)
+        return unfinished_file
+
+    def _forget_unfinished_file(self, file_id):
+        """
+        Removes a large file that is no longer unfinished from the index.
+        """
+        with self._unfinished_files_lock:
+            if self._unfinished_files_by_name is not None:
+                for files in six.itervalues(self._unfinished_files_by_name):
+                    files[:] = [f for f in files if f.file_id != file_id]
 
     def upload_bytes(
         self,
@@ -357,8 +463,10 @@ class Bucket(object):
                 temp_file.seek(0)
             #Finish the large file
             response = self.api.session.finish_large_file(unfinished_file.file_id, part_sha1_array)
+            self._forget_unfinished_file(unfinished_file.file_id)
+            self.api.account_info.clear_large_file_upload_urls(unfinished_file.file_id)
             #TODO probably check final sha1 of file and sha1 array
-            return FileVersionInfoFactory.from_api_response(response)
+            return self._remember_file_version(response)
 
     def upload(
         self,
@@ -417,30 +525,53 @@ class Bucket(object):
         content_length = upload_source.get_content_length()
         sha1_sum = upload_source.get_content_sha1()
         exception_info_list = []
-        for _ in six.moves.xrange(self.MAX_UPLOAD_ATTEMPTS):
-            # refresh upload data in every attempt to work around a "busy storage pod"
-            upload_url, upload_auth_token = self._get_upload_data()
-
-            try:
-                with upload_source.open() as file:
-                    progress_listener.set_total_bytes(content_length)
-                    input_stream = StreamWithProgress(file, progress_listener)
-                    upload_response = self.api.raw_api.upload_file(
-                        upload_url, upload_auth_token, file_name, content_length, content_type,
-                        sha1_sum, file_info, input_stream
-                    )
-                    self.api.account_info.put_bucket_upload_url(
-                        self.id_, upload_url, upload_auth_token
-                    )
-                    return FileVersionInfoFactory.from_api_response(upload_response)
-
-            except B2Error as e:
-                if not e.should_retry_upload():
-                    raise
-                exception_info_list.append(e)
-                self.api.account_info.clear_bucket_upload_data(self.id_)
+        progress_listener = SampledProgressListener(progress_listener)
+        bandwidth_limiter = get_bandwidth_limiter()
+        retry_state = self.api.retry_policy.start(
+            'upload_file', self.MAX_UPLOAD_ATTEMPTS, self.MAX_UPLOAD_RETRY_DELAY
+        )
+        try:
+            while True:
+                # refresh upload data in every attempt to work around a "busy storage pod"
+                upload_url, upload_auth_token = self._get_upload_data()
+
+                try:
+                    with upload_source.open() as file, \
+                            self.api.stall_watchdog.start_transfer() as stall_detector:
+                        progress_listener.set_total_bytes(content_length)
+                        input_stream = StreamWithProgress(
+                            file,
+                            progress_listener,
+                            throttle=bandwidth_limiter.throttle_upload,
+                            stall_detector=stall_detector
+                        )
+                        start_time = time.time()
+                        upload_response = self.api.raw_api.upload_file(
+                            upload_url, upload_auth_token, file_name, content_length,
+                            content_type, sha1_sum, file_info, input_stream
+                        )
+                        self.api.upload_health.record_success(
+                            upload_url, content_length, time.time() - start_time
+                        )
+                        self.api.account_info.put_bucket_upload_url(
+                            self.id_, upload_url, upload_auth_token
+                        )
+                        retry_state.succeeded()
+                        return self._remember_file_version(upload_response)
+
+                except B2Error as e:
+                    if not e.should_retry_upload():
+                        retry_state.failed(e, False)
+                        raise
+                    exception_info_list.append(e)
+                    self._upload_url_failed(upload_url, upload_auth_token, e)
+                    if not retry_state.failed(e):
+                        break
 
-        raise MaxRetriesExceeded(self.MAX_UPLOAD_ATTEMPTS, exception_info_list)
+            raise MaxRetriesExceeded(len(exception_info_list), exception_info_list)
+        finally:
+            # the caller closes the listener it passed in
+            progress_listener.finish()
 
     def _upload_large_file(
         self, upload_source, file_name, content_type, file_info, progress_listener
@@ -483,48 +614,138 @@ class Bucket(object):
         # Collect the sha1 checksums of the parts as the uploads finish.
         # If any of them raised an exception, that same exception will
         # be raised here by result()
-        part_sha1_array = [interruptible_get_result(f)['contentSha1'] for f in part_futures]
+        get_progress_sampler().add(large_file_upload_state)
+        try:
+            part_sha1_array = [interruptible_get_result(f)['contentSha1'] for f in part_futures]
+        finally:
+            get_progress_sampler().remove(large_file_upload_state)
 
         # Finish the large file
         response = self.api.session.finish_large_file(file_id, part_sha1_array)
-        return FileVersionInfoFactory.from_api_response(response)
+        self._forget_unfinished_file(file_id)
+        self.api.account_info.clear_large_file_upload_urls(file_id)
+        return self._remember_file_version(response)
 
-    def _find_unfinished_file(self, upload_source, file_name, file_info, part_ranges):
+    def _find_unfinished_file(
+        self, upload_source, file_name, file_info, part_ranges, stop_at_first_mismatch=True
+    ):
         """
         Find an unfinished file which may be used to resume a large file upload. The
         file is found using the filename and comparing the uploaded parts against
         the local file.
-        """
-        for file_ in self.list_unfinished_large_files():
-            if file_.file_name == file_name and file_.file_info == file_info:
-                files_match = True
-                finished_parts = {}
-                for part in self.list_parts(file_.file_id):
-                    # Compare part sizes
-                    offset, part_length = part_ranges[part.part_number - 1]
-                    if part_length != part.content_length:
-                        files_match = False
-                        break
 
-                    # Compare hash
-                    with upload_source.open() as f:
-                        f.seek(offset)
-                        sha1_sum = hex_sha1_of_stream(f, part_length)
-                    if sha1_sum != part.content_sha1:
-                        files_match = False
-                        break
+        Candidates are looked up by name in an index of the unfinished files in
+        the bucket, and the hashes of their parts are checked in the thread pool.
 
-                    # Save part
-                    finished_parts[part.part_number] = part
+        :param stop_at_first_mismatch: when True, the part checks still pending for a
+                                       candidate are cancelled as soon as one part does
+                                       not match.
+        """
+        for file_ in self._unfinished_files_with_name(file_name):
+            if file_.file_info != file_info:
+                continue
+            if not self._is_still_unfinished(file_):
+                self._forget_unfinished_file(file_.file_id)
+                continue
+            finished_parts = self._match_uploaded_parts(
+                file_, upload_source, part_ranges, stop_at_first_mismatch
+            )
 
-                # Skip not matching files or unfinished files with no uploaded parts
-                if not files_match or not finished_parts:
-                    continue
+            # Skip not matching files or unfinished files with no uploaded parts
+            if not finished_parts:
+                continue
 
-                # Return first matched file
-                return file_, finished_parts
+            # Return first matched file, taking it out of the index so that
+            # no other upload tries to resume it
+            self._forget_unfinished_file(file_.file_id)
+            return file_, finished_parts
         return None, {}
 
+    def _unfinished_files_with_name(self, file_name):
+        """
+        Returns the unfinished large files with the given name.
+
+        The index of unfinished files is built with one pass over the list of
+        unfinished files the first time it is needed, and then kept up to date
+        by the large files started, finished, and canceled through this object.
+        A file started by another process after that is not found, and the
+        upload just starts a new one; files found are checked before use by
+        _is_still_unfinished().
+        """
+        with self._unfinished_files_lock:
+            if self._unfinished_files_by_name is None:
+                by_name = collections.defaultdict(list)
+                for file_ in self.list_unfinished_large_files():
+                    by_name[file_.file_name].append(file_)
+                self._unfinished_files_by_name = by_name
+            return list(self._unfinished_files_by_name.get(file_name, []))
+
+    def _is_still_unfinished(self, file_):
+        """
+        Checks with the service that a file from the index of unfinished files
+        is still unfinished.  The index is kept by this object only, and another
+        process may have finished or canceled the file since it was built.
+        """
+        batch = self.api.session.list_unfinished_large_files(self.id_, file_.file_id, 1)
+        return any(file_dict['fileId'] == file_.file_id for file_dict in batch['files'])
+
+    def _match_uploaded_parts(self, file_, upload_source, part_ranges, stop_at_first_mismatch):
+        """
+        Compares the parts already uploaded for an unfinished file with the
+        local data.
+
+        Returns a dict mapping part number to Part for all of the uploaded parts,
+        or None if any of them does not match.
+        """
+        # Compare part sizes first, because that does not need any I/O
+        parts = list(self.list_parts(file_.file_id, batch_size=self.LIST_PARTS_BATCH_SIZE))
+        for part in parts:
+            if len(part_ranges) < part.part_number:
+                return None
+            if part_ranges[part.part_number - 1][1] != part.content_length:
+                return None
+
+        # Compare hashes, in parallel.  When stopping at the first mismatch,
+        # checks that haven't started by then are skipped.
+        mismatch = threading.Event() if stop_at_first_mismatch else None
+        thread_pool = self.api.get_thread_pool()
+        match_futures = [
+            thread_pool.submit(
+                self._part_matches, upload_source, part_ranges[part.part_number - 1], part,
+                mismatch
+            ) for part in parts
+        ]
+        files_match = True
+        for match_future in match_futures:
+            if files_match or not stop_at_first_mismatch:
+                if not interruptible_get_result(match_future):
+                    files_match = False
+            else:
+                match_future.cancel()
+        if not files_match:
+            return None
+
+        return dict((part.part_number, part) for part in parts)
+
+    def _part_matches(self, upload_source, part_range, part, mismatch):
+        """
+        Returns True if the local data in the range has the hash of the uploaded part.
+
+        :param mismatch: None, or an Event that is set when a part does not match;
+                         once it is set, the hash isn't computed, and False is returned
+        """
+        if mismatch is not None and mismatch.is_set():
+            return False
+        if self._hex_sha1_of_range(upload_source, part_range) == part.content_sha1:
+            return True
+        if mismatch is not None:
+            mismatch.set()
+        return False
+
+    def _hex_sha1_of_range(self, upload_source, part_range):
+        offset, content_length = part_range
+        return upload_source.get_range_sha1(offset, content_length)
+
     def _upload_part(
         self,
         file_id,
@@ -545,16 +766,17 @@ class Bucket(object):
 
         # Compute the SHA1 of the part
         offset, content_length = part_range
-        with upload_source.open() as f:
-            f.seek(offset)
-            sha1_sum = hex_sha1_of_stream(f, content_length)
+        sha1_sum = self._hex_sha1_of_range(upload_source, part_range)
 
         # Set up a progress listener
         part_progress_listener = PartProgressReporter(large_file_upload_state)
 
         # Retry the upload as needed
         exception_list = []
-        for i in six.moves.xrange(self.MAX_UPLOAD_ATTEMPTS):
+        retry_state = self.api.retry_policy.start(
+            'upload_part', self.MAX_UPLOAD_ATTEMPTS, self.MAX_UPLOAD_RETRY_DELAY
+        )
+        while True:
             # refresh upload data in every attempt to work around a "busy storage pod"
             upload_url, upload_auth_token = self._get_upload_part_data(file_id)
 
@@ -564,28 +786,43 @@ class Bucket(object):
                 raise AlreadyFailed(large_file_upload_state.get_error_message())
 
             try:
-                with upload_source.open() as file:
+                with upload_source.open() as file, \
+                        self.api.stall_watchdog.start_transfer() as stall_detector:
                     file.seek(offset)
                     range_stream = RangeOfInputStream(file, offset, content_length)
-                    input_stream = StreamWithProgress(range_stream, part_progress_listener)
+                    input_stream = StreamWithProgress(
+                        range_stream,
+                        part_progress_listener,
+                        throttle=get_bandwidth_limiter().throttle_upload,
+                        stall_detector=stall_detector
+                    )
+                    start_time = time.time()
                     response = self.api.raw_api.upload_part(
                         upload_url, upload_auth_token, part_number, content_length, sha1_sum,
                         input_stream
                     )
                     assert sha1_sum == response['contentSha1']
+                    self.api.upload_health.record_success(
+                        upload_url, content_length, time.time() - start_time
+                    )
                     self.api.account_info.put_large_file_upload_url(
                         file_id, upload_url, upload_auth_token
                     )
+                    part_progress_listener.close()
+                    retry_state.succeeded()
                     return response
 
             except B2Error as e:
                 if not e.should_retry_upload():
+                    retry_state.failed(e, False)
                     raise
                 exception_list.append(e)
-                self.api.account_info.clear_bucket_upload_data(self.id_)
+                self._upload_url_failed(upload_url, upload_auth_token, e, file_id)
+                if not retry_state.failed(e):
+                    break
 
         large_file_upload_state.set_error(str(exception_list[-1]))
-        raise MaxRetriesExceeded(self.MAX_UPLOAD_ATTEMPTS, exception_list)
+        raise MaxRetriesExceeded(len(exception_list), exception_list)
 
     def _get_upload_data(self):
         """
@@ -593,26 +830,123 @@ class Bucket(object):
         returns it.
         """
         account_info = self.api.account_info
-        upload_url, upload_auth_token = account_info.take_bucket_upload_url(self.id_)
-        if None not in (upload_url, upload_auth_token):
-            return upload_url, upload_auth_token
+        pooled = self._choose_upload_url(
+            lambda: account_info.take_bucket_upload_url(self.id_),
+            lambda url, token: account_info.put_bucket_upload_url(self.id_, url, token),
+            lambda token: account_info.discard_bucket_upload_url(self.id_, token),
+        )
+        if pooled is not None:
+            return pooled
 
         response = self.api.session.get_upload_url(self.id_)
         return response['uploadUrl'], response['authorizationToken']
 
+    def start_upload_url_warmer(self, count, wait=False):
+        """
+        Starts fetching count upload URLs in the background, and
+        fetching more to replace the ones thrown away as uploads run.
+        Call before starting a batch of uploads, with count set to the
+        number of uploads that will run at once.
+
+        :param wait: when True, returns after the first count URLs are in the pool
+        :return: the UploadUrlWarmer; call stop_upload_url_warmer() when the uploads are done
+        """
+        warmer = UploadUrlWarmer(self._fetch_upload_url_into_pool, count)
+        self.upload_url_warmer = warmer
+        warmer.warm_up(wait)
+        return warmer
+
+    def stop_upload_url_warmer(self):
+        warmer = self.upload_url_warmer
+        if warmer is not None:
+            self.upload_url_warmer = None
+            warmer.stop()
+
+    def _fetch_upload_url_into_pool(self):
+        response = self.api.session.get_upload_url(self.id_)
+        self.api.account_info.put_bucket_upload_url(
+            self.id_, response['uploadUrl'], response['authorizationToken']
+        )
+
     def _get_upload_part_data(self, file_id):
         """
         Makes sure that we have an upload URL and auth token for the given bucket and
         returns it.
         """
         account_info = self.api.account_info
-        upload_url, upload_auth_token = account_info.take_large_file_upload_url(file_id)
-        if None not in (upload_url, upload_auth_token):
-            return upload_url, upload_auth_token
+        pooled = self._choose_upload_url(
+            lambda: account_info.take_large_file_upload_url(file_id),
+            lambda url, token: account_info.put_large_file_upload_url(file_id, url, token),
+            lambda token: account_info.discard_large_file_upload_url(file_id, token),
+        )
+        if pooled is not None:
+            return pooled
 
         response = self.api.session.get_upload_part_url(file_id)
         return (response['uploadUrl'], response['authorizationToken'])
 
+    def _choose_upload_url(self, take, put_back, discard):
+        """
+        Takes upload URLs from a pool, throwing away the ones for
+        unhealthy pods.  When there is more than one pod to choose from,
+        looks at a few URLs, keeps the one for the fastest pod, and puts
+        the others back.
+
+        :param take: function that takes (upload_url, upload_auth_token) from the pool
+        :param put_back: function that returns an upload_url and upload_auth_token to the pool
+        :param discard: function that drops an upload_auth_token from the pool for good
+        :return: (upload_url, upload_auth_token), or None if the pool has none that are healthy
+        """
+        health = self.api.upload_health
+        max_candidates = self.UPLOAD_URL_CANDIDATES if 1 < health.pod_count() else 1
+        candidates = []
+        while len(candidates) < max_candidates:
+            (upload_url, upload_auth_token) = take()
+            if None in (upload_url, upload_auth_token):
+                break
+            if health.is_healthy(upload_url):
+                candidates.append((upload_url, upload_auth_token))
+            else:
+                discard(upload_auth_token)
+        if not candidates:
+            return None
+        best_url = health.choose_best([upload_url for (upload_url, _) in candidates])
+        result = None
+        for (upload_url, upload_auth_token) in candidates:
+            if result is None and upload_url == best_url:
+                result = (upload_url, upload_auth_token)
+            else:
+                put_back(upload_url, upload_auth_token)
+        return result
+
+    def _upload_url_failed(self, upload_url, upload_auth_token, error, file_id=None):
+        """
+        Called after an upload to the URL fails in a way that a new
+        upload URL might fix.  The URL itself is dropped from the pool.
+        Other URLs for the same pod are dropped when they are taken, if
+        the pod is unhealthy.  An expired auth token means all of the
+        pooled URLs are probably stale.
+        """
+        account_info = self.api.account_info
+        if file_id is None:
+            account_info.discard_bucket_upload_url(self.id_, upload_auth_token)
+        else:
+            account_info.discard_large_file_upload_url(file_id, upload_auth_token)
+        warmer = self.upload_url_warmer
+        if isinstance(error, InvalidAuthToken):
+            if file_id is not None:
+                account_info.clear_large_file_upload_urls(file_id)
+            empty_pool = lambda: account_info.clear_bucket_upload_data(self.id_)
+            if warmer is not None:
+                # The threads that fail at the same time join one refill.
+                warmer.refill(empty_pool)
+            else:
+                empty_pool()
+        else:
+            self.api.upload_health.record_failure(upload_url)
+            if warmer is not None and file_id is None:
+                warmer.top_up()
+
     def get_download_url(self, filename):
         return "%s/file/%s/%s" % (
             self.api.account_info.get_download_url(),
@@ -622,7 +956,14 @@ class Bucket(object):
 
     def hide_file(self, file_name):
         response = self.api.session.hide_file(self.id_, file_name)
-        return FileVersionInfoFactory.from_api_response(response)
+        return self._remember_file_version(response)
+
+    def _remember_file_version(self, response):
+        file_version_info = FileVersionInfoFactory.from_api_response(response)
+        self.api.file_info_cache.put(file_version_info)
+        if self.api.listing_index is not None:
+            self.api.listing_index.add_file_version(self.id_, file_version_info)
+        return file_version_info
 
     def as_dict(self):  # TODO: refactor with other as_dict()
         result = {'accountId': self.api.account_info.get_account_id(), 'bucketId': self.id_,}
@@ -0,0 +1,269 @@
+######################################################################
+#
+# File: b2/concurrency.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+from __future__ import division
+
+import threading
+
+from .exception import ServiceError, TooManyRequests
+from .utils import raise_if_shutting_down
+
+# Kinds of calls, which are limited separately
+METADATA = 'metadata'
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+CALL_KINDS = (METADATA, UPLOAD, DOWNLOAD)
+
+
+def is_overload_error(error):
+    """
+    Returns True if the error means that the service wants us to back
+    off: 503 Service Unavailable (busy storage pod), or 429 Too Many
+    Requests.
+    """
+    return isinstance(error, (ServiceError, TooManyRequests))
+
+
+class ConcurrencySlot(object):
+    """
+    Permission to make one call, from an AdaptiveConcurrencyLimit.
+
+    The outcome of each try of the call is reported with report(),
+    and the slot is given back with release(), or by using it as a
+    context manager.
+
+    For a call that sends data, the caller sets byte_count to how many
+    bytes each try sends, so that the limit can see the throughput.
+    """
+
+    def __init__(self, concurrency_limit, generation, saturated, in_flight):
+        self.concurrency_limit = concurrency_limit
+        self.generation = generation
+        self.saturated = saturated
+        self.in_flight = in_flight  # calls in progress, counting this one, when acquired
+        self.byte_count = None
+        self.released = False
+
+    def report(self, error=None, seconds=None):
+        """
+        Reports the outcome of one try.
+
+        :param error: the exception the try raised, or None if it worked
+        :param seconds: how long a try that worked took
+        """
+        if error is None:
+            self.concurrency_limit._on_success(self, seconds)
+        elif is_overload_error(error):
+            self.concurrency_limit._on_overload(self)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.concurrency_limit._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class AdaptiveConcurrencyLimit(object):
+    """
+    Limits the number of calls in progress, adjusting the limit with
+    AIMD (additive increase, multiplicative decrease), the way TCP
+    finds the bandwidth of a link.
+
+    When the service says it is overloaded, the limit is cut by
+    decrease_factor.  The calls that were already in progress when the
+    limit was cut may also fail, but they don't cut it again.  Each
+    successful call raises the limit by 1/limit, so it grows by about
+    one for each round of calls, up to max_limit.  The limit only
+    grows when the calls are using all of it; a limit that isn't
+    being reached says nothing about what the service can handle.
+
+    Calls that report how many bytes they sent also steer the limit
+    by throughput.  The total throughput is estimated as the bytes per
+    second of each call times the calls in progress, smoothed with an
+    exponentially weighted moving average.  The limit where the total
+    last grew by at least throughput_gain is remembered.  Once the
+    limit is throughput_probe_calls past that without the total
+    growing, the added calls are only sharing the same bandwidth, and
+    the limit goes back to where the total last grew.  The remembered
+    best fades by throughput_decay with each sample, so that a change
+    in the network is noticed.  Calls that send less than
+    min_throughput_bytes are left out: they take about a round trip,
+    however fast the link is.
+
+    This class is THREAD SAFE.
+    """
+
+    # Seconds between checks for the program shutting down while waiting.
+    WAIT_INTERVAL = 0.1
+
+    def __init__(
+        self,
+        max_limit,
+        initial_limit=None,
+        min_limit=1,
+        decrease_factor=0.5,
+        min_throughput_bytes=1000000,
+        throughput_weight=0.3,
+        throughput_gain=0.1,
+        throughput_probe_calls=2,
+        throughput_decay=0.9999
+    ):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease_factor = decrease_factor
+        self.min_throughput_bytes = min_throughput_bytes
+        self.throughput_weight = throughput_weight
+        self.throughput_gain = throughput_gain
+        self.throughput_probe_calls = throughput_probe_calls
+        self.throughput_decay = throughput_decay
+        self.limit = float(initial_limit or max_limit)
+        self.in_flight = 0
+        self.generation = 0
+        self.success_count = 0
+        self.overload_count = 0
+        self.total_throughput = None  # bytes per second, moving average
+        self.best_throughput = None
+        self.best_throughput_limit = None
+        self.condition = threading.Condition()
+
+    def get_limit(self):
+        """
+        Returns the number of calls allowed at once right now.
+        """
+        return max(self.min_limit, int(self.limit))
+
+    def set_max_limit(self, max_limit):
+        """
+        Changes the most calls allowed at once.  When the limit hasn't
+        been cut for an overload, or had grown back to the old maximum,
+        it moves straight to the new one, so asking for more threads
+        gives more calls right away.
+        """
+        with self.condition:
+            if self.overload_count == 0 or self.max_limit <= self.limit:
+                self.limit = float(max_limit)
+            else:
+                self.limit = min(self.limit, max_limit)
+            self.max_limit = max_limit
+            self.condition.notify_all()
+
+    def acquire(self):
+        """
+        Waits until another call is allowed.
+
+        :return: a ConcurrencySlot, which must be released.
+        """
+        with self.condition:
+            while self.get_limit() <= self.in_flight:
+                raise_if_shutting_down()
+                self.condition.wait(self.WAIT_INTERVAL)
+            self.in_flight += 1
+            saturated = self.get_limit() <= self.in_flight
+            return ConcurrencySlot(self, self.generation, saturated, self.in_flight)
+
+    def get_stats(self):
+        with self.condition:
+            return dict(
+                limit=self.get_limit(),
+                in_flight=self.in_flight,
+                successes=self.success_count,
+                overloads=self.overload_count
+            )
+
+    def _on_success(self, slot, seconds):
+        with self.condition:
+            self.success_count += 1
+            if (
+                seconds is not None and slot.byte_count is not None and
+                self.min_throughput_bytes <= slot.byte_count
+            ):
+                if self._on_throughput(slot.byte_count * slot.in_flight / max(seconds, 1e-6)):
+                    return
+            if slot.saturated and self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self.condition.notify()
+
+    def _on_throughput(self, total_throughput):
+        """
+        Takes in one estimate of the total throughput.  Returns True
+        if the limit was lowered because more calls weren't faster.
+        """
+        if self.total_throughput is None:
+            self.total_throughput = total_throughput
+        else:
+            self.total_throughput = (
+                self.throughput_weight * total_throughput +
+                (1 - self.throughput_weight) * self.total_throughput
+            )
+        if (
+            self.best_throughput is None or
+            self.best_throughput * (1 + self.throughput_gain) < self.total_throughput
+        ):
+            self.best_throughput = self.total_throughput
+            self.best_throughput_limit = self.get_limit()
+            return False
+        self.best_throughput *= self.throughput_decay
+        if self.best_throughput_limit + self.throughput_probe_calls <= self.get_limit():
+            self.limit = float(max(self.min_limit, self.best_throughput_limit))
+            return True
+        return False
+
+    def _on_overload(self, slot):
+        with self.condition:
+            self.overload_count += 1
+            if slot.generation == self.generation:
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self.generation += 1
+
+    def _release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+
+class ConcurrencyController(object):
+    """
+    Holds a separate AdaptiveConcurrencyLimit for each kind of call:
+    metadata calls (listing, getting upload URLs, etc.), uploads,
+    and downloads.  The service can be busy with one kind while
+    happily accepting the others.
+    """
+
+    def __init__(self, max_data_calls=10, max_metadata_calls=10):
+        self.limits = {
+            METADATA: AdaptiveConcurrencyLimit(max_metadata_calls),
+            UPLOAD: AdaptiveConcurrencyLimit(max_data_calls),
+            DOWNLOAD: AdaptiveConcurrencyLimit(max_data_calls),
+        }
+
+    def get_limit(self, kind):
+        return self.limits[kind]
+
+    def set_max_calls(self, max_data_calls, max_metadata_calls=None):
+        """
+        Sets the most calls that will be made at once.  The limits
+        adapt below this.
+        """
+        self.limits[UPLOAD].set_max_limit(max_data_calls)
+        self.limits[DOWNLOAD].set_max_limit(max_data_calls)
+        if max_metadata_calls is not None:
+            self.limits[METADATA].set_max_limit(max_metadata_calls)
+
+    def get_stats(self):
+        """
+        Returns a dict from kind of call to a dict with the current
+        limit, calls in progress, and counts of successes and overloads.
+        """
+        return dict((kind, self.limits[kind].get_stats()) for kind in CALL_KINDS)
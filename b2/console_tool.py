@@ -11,6 +11,7 @@
 from __future__ import absolute_import, print_function
 
 import getpass
+import io
 import json
 import os
 import signal
@@ -22,13 +23,19 @@ import six
 from .account_info import (SqliteAccountInfo, test_upload_url_concurrency)
 from .api import (B2Api)
 from .b2http import (test_http)
+from .bandwidth import (DOWNLOAD, UPLOAD, get_bandwidth_limiter, parse_rate)
 from .cache import (AuthInfoCache)
+from .concurrency import (ConcurrencyController)
 from .download_dest import (DownloadDestLocalFile)
+from .download_stream import (DEFAULT_PART_SIZE)
 from .exception import (B2Error, BadFileInfo, MissingAccountData)
 from .file_version import (FileVersionInfo)
+from .hedging import (HedgingPolicy)
+from .listing_index import (ListingIndex, literal_prefix)
 from .parse_args import parse_arg_list
 from .progress import (make_progress_listener)
 from .raw_api import (test_raw_api)
+from .session import B2Session
 from .sync import parse_sync_folder, sync_folders
 from .utils import (current_time_millis, set_shutting_down, human2bytes)
 from .version import (VERSION)
@@ -49,6 +56,13 @@ def keyboard_interrupt_handler(signum, frame):
     raise KeyboardInterrupt()
 
 
+def bandwidth_reload_handler(signum, frame):
+    try:
+        get_bandwidth_limiter().reload()
+    except (IOError, OSError, ValueError):
+        pass  # keep the limits we have
+
+
 def mixed_case_to_underscores(s):
     return s[0].lower() + ''.join(c if c.islower() else '_' + c.lower() for c in s[1:])
 
@@ -125,6 +139,17 @@ class Command(object):
             arg_parser=self.ARG_PARSER
         )
 
+    def _get_listing_index(self, bucket, folder_name, offline):
+        """
+        Returns the ListingIndex to answer a query from.  Unless offline
+        is set, the folder is listed again first; when no index was
+        configured, into one that is thrown away afterwards.
+        """
+        listing_index = self.api.listing_index or ListingIndex(':memory:')
+        if not offline:
+            listing_index.refresh(bucket, folder_name)
+        return listing_index
+
     def _print(self, *args, **kwargs):
         try:
             print(*args, file=self.stdout, **kwargs)
@@ -228,6 +253,43 @@ class CancelLargeFile(Command):
         return 0
 
 
+class Cat(Command):
+    """
+    b2 cat [--threads N] [--partSize <partSize>] <bucketName> <fileName>
+
+        Writes the contents of a file to standard output, so it can be
+        piped to another program without a local copy.
+
+        The file is fetched in parts of partSize bytes (8MiB by default),
+        given with units, like 16MiB.  While one part is written, the
+        next ones are fetched in parallel: as many as '--threads'
+        says, 4 by default.  They are held in memory until they can be
+        written, so memory use is about threads times partSize.
+
+        The sha1 checksum is only checked after all of the output has
+        been written.  If it doesn't match, the command fails, but the
+        program reading the output has already seen all of it, so check
+        the exit status before trusting what it got.  Large files
+        uploaded without a 'large_file_sha1' in their file info have no
+        checksum, and nothing is checked.
+    """
+
+    OPTION_ARGS = ['threads', 'partSize']
+    REQUIRED = ['bucketName', 'b2FileName']
+    ARG_PARSER = {'threads': int}
+
+    def run(self, args):
+        part_size = DEFAULT_PART_SIZE
+        if args.partSize:
+            part_size = human2bytes(args.partSize)
+        bucket = self.api.get_bucket_by_name(args.bucketName)
+        # Bytes go to the binary stream under sys.stdout in Python 3.
+        output = getattr(self.stdout, 'buffer', self.stdout)
+        bucket.cat_file_by_name(args.b2FileName, output, part_size, args.threads or 4)
+        output.flush()
+        return 0
+
+
 class ClearAccount(Command):
     """
     b2 clear_account
@@ -327,6 +389,68 @@ class DownloadFileByName(Command):
         return 0
 
 
+class Du(Command):
+    """
+    b2 du [--versions] [--offline] <bucketName> [<folderName>]
+
+        Prints the number of files in a folder and all of its
+        sub-folders, and the total of their sizes.  With --versions,
+        every version of each file is counted, not just the most
+        recent one.
+
+        With --offline, the answer comes from the listing index
+        without asking the service.  See 'b2 update_index'.
+    """
+
+    OPTION_FLAGS = ['versions', 'offline']
+
+    REQUIRED = ['bucketName']
+
+    OPTIONAL = ['folderName']
+
+    def run(self, args):
+        folder_name = args.folderName or ''
+        bucket = self.api.get_bucket_by_name(args.bucketName)
+        listing_index = self._get_listing_index(bucket, folder_name, args.offline)
+        (file_count, total_bytes) = listing_index.du(bucket.id_, folder_name, args.versions)
+        self._print('Files:', file_count)
+        self._print('Bytes:', total_bytes)
+        return 0
+
+
+class Find(Command):
+    """
+    b2 find [--long] [--versions] [--offline] <bucketName> <pattern>
+
+        Lists the files whose names match a pattern, where "*" matches
+        anything (including "/"), "?" matches one character, and
+        "[abc]" matches one of the characters listed.  For example:
+
+            b2 find my-bucket 'photos/*.jpg'
+
+        The --long and --versions options are the same as for 'b2 ls'.
+
+        With --offline, the answer comes from the listing index
+        without asking the service.  See 'b2 update_index'.
+    """
+
+    OPTION_FLAGS = ['long', 'versions', 'offline']
+
+    REQUIRED = ['bucketName', 'pattern']
+
+    def run(self, args):
+        bucket = self.api.get_bucket_by_name(args.bucketName)
+        literal = literal_prefix(args.pattern)
+        folder_name = literal[:literal.rfind('/') + 1]
+        listing_index = self._get_listing_index(bucket, folder_name, args.offline)
+        for file_version_info in listing_index.find(bucket.id_, args.pattern, args.versions):
+            if args.long:
+                self._print(file_version_info.format_ls_entry())
+            else:
+                self._print(file_version_info.file_name)
+        return 0
+
+
 class GetFileInfo(Command):
     """
     b2 get_file_info <fileId>
@@ -485,7 +609,7 @@ class ListUnfinishedLargeFiles(Command):
 
 class Ls(Command):
     """
-    b2 ls [--long] [--versions] <bucketName> [<folderName>]
+    b2 ls [--long] [--versions] [--offline] <bucketName> [<folderName>]
 
         Using the file naming convention that "/" separates folder
         names from their contents, returns a list of the files
@@ -500,9 +624,12 @@ class Ls(Command):
 
         The --version option shows all of versions of each file, not
         just the most recent.
+
+        With --offline, the list comes from the listing index
+        without asking the service.  See 'b2 update_index'.
     """
 
-    OPTION_FLAGS = ['long', 'versions']
+    OPTION_FLAGS = ['long', 'versions', 'offline']
 
     REQUIRED = ['bucketName']
 
@@ -517,7 +644,13 @@ class Ls(Command):
                 prefix += '/'
 
         bucket = self.api.get_bucket_by_name(args.bucketName)
-        for file_version_info, folder_name in bucket.ls(prefix, args.versions):
+        if args.offline:
+            listing = self._get_listing_index(bucket, prefix, True).ls(
+                bucket.id_, prefix, args.versions
+            )
+        else:
+            listing = bucket.ls(prefix, args.versions)
+        for file_version_info, folder_name in listing:
             if not args.long:
                 self._print(folder_name or file_version_info.file_name)
             elif folder_name is not None:
@@ -546,7 +679,10 @@ class MakeUrl(Command):
 class Sync(Command):
     """
     b2 sync [--delete] [--keepDays N] [--skipNewer] [--replaceNewer] \\
-            [--threads N] [--noProgress] <source> <destination>
+            [--threads N] [--noProgress] [--logFile <file>] [--summaryOnly] \\
+            [--uploadLimit <rate>] [--downloadLimit <rate>] \\
+            [--bandwidthFile <file>] [--indexMaxAge <seconds>] \\
+            [--alsoTo <destination>]* <source> <destination>
 
         Copies multiple files from source to destination.  Optionally
         deletes or hides destination files that the source does not have.
@@ -554,15 +690,22 @@ class Sync(Command):
         Work is done in parallel in multiple threads.  The default
         number of threads is 10.  Progress is displayed on the
         console unless '--noProgress' is specified.  A list of
-        actions taken is always printed.
+        actions taken is always printed, unless '--logFile' is given,
+        which writes the list to that file instead.  For syncs with
+        very many files, '--summaryOnly' prints just the totals and
+        rates at the end, with no progress display.  Errors are always
+        printed.
 
         Files are considered to be the same if they have the same name
         and modification time.  A future enhancement may add the ability
         to compare the SHA1 checksum of the files.
 
-        One of the paths must be a local file path, and the other must be
-        a B2 bucket path. Use "b2://<bucketName>/<prefix>" for B2 paths, e.g.
-        "b2://my-bucket-name/a/path/prefix/".
+        One of the paths must be a B2 bucket path, and the other can be
+        a local file path or another B2 bucket path. Use
+        "b2://<bucketName>/<prefix>" for B2 paths, e.g.
+        "b2://my-bucket-name/a/path/prefix/".  When both are B2 paths,
+        files are uploaded straight from downloads of them, without
+        using local disk.
 
         When a destination file is present that is not in the source, the
         default is to leave it there.  Specifying --delete means to delete
@@ -580,6 +723,31 @@ class Sync(Command):
         those files will just be skipped.  With --replaceNewer set, the
         old file from the source will replace the newer one in the destination.
 
+        Bandwidth can be capped with '--uploadLimit' and '--downloadLimit',
+        in bytes per second, for example 10MB or 500KiB.  The caps apply to
+        all threads together.  With '--bandwidthFile', the caps are read
+        from a file, which is re-read whenever it changes, or when the
+        process gets SIGHUP.  The file has lines like:
+
+            upload = 10MB
+            download = unlimited
+            upload 09:00-18:00 = 1MB
+
+        where the last line sets a different cap during working hours.
+        The file can only lower the caps given with '--uploadLimit' and
+        '--downloadLimit', never raise them.
+
+        With '--indexMaxAge', the B2 folder is listed from the listing
+        index (see 'b2 update_index'), after listing it again if the
+        index is older than the given number of seconds.
+
+        A local folder can be synced to more than one B2 folder at once,
+        by giving each of the others with '--alsoTo b2://...'.  The
+        buckets are compared separately, but each file is read and its
+        checksums computed only once, and then uploaded to every bucket
+        that needs it at the same time.  An upload failing for one
+        bucket doesn't stop the others.
+
         To make the destination exactly match the source, use:
             b2 sync --delete --replaceNewer ... ...
 
@@ -589,28 +757,67 @@ class Sync(Command):
 
     """
 
-    OPTION_FLAGS = ['delete', 'noProgress', 'skipNewer', 'replaceNewer']
-    OPTION_ARGS = ['keepDays', 'threads']
+    OPTION_FLAGS = ['delete', 'noProgress', 'skipNewer', 'replaceNewer', 'summaryOnly']
+    OPTION_ARGS = [
+        'keepDays', 'threads', 'logFile', 'uploadLimit', 'downloadLimit', 'bandwidthFile',
+        'indexMaxAge'
+    ]
+    LIST_ARGS = ['alsoTo']
     REQUIRED = ['source', 'destination']
-    ARG_PARSER = {'keepDays': float, 'threads': int}
+    ARG_PARSER = {
+        'keepDays': float,
+        'threads': int,
+        'uploadLimit': parse_rate,
+        'downloadLimit': parse_rate,
+        'indexMaxAge': float
+    }
 
     def run(self, args):
         max_workers = args.threads or 10
         self.console_tool.api.set_thread_pool_size(max_workers)
-        source = parse_sync_folder(args.source, self.console_tool.api)
-        destination = parse_sync_folder(args.destination, self.console_tool.api)
-        sync_folders(
-            source_folder=source,
-            dest_folder=destination,
-            args=args,
-            now_millis=current_time_millis(
-            ),
-            stdout=self.stdout,
-            no_progress=args.noProgress,
-            max_workers=max_workers
+        # A long sync shouldn't have transfers fail when the auth token expires.
+        self.console_tool.api.session.set_refresh_after_seconds(
+            B2Session.DEFAULT_REFRESH_AFTER_SECONDS
         )
+        self._set_bandwidth_limits(args)
+        source = parse_sync_folder(args.source, self.console_tool.api, args.indexMaxAge)
+        destination = parse_sync_folder(args.destination, self.console_tool.api, args.indexMaxAge)
+        extra_destinations = [
+            parse_sync_folder(name, self.console_tool.api, args.indexMaxAge)
+            for name in args.alsoTo
+        ]
+        log_file = None
+        if args.logFile is not None:
+            log_file = io.open(args.logFile, 'w', encoding='utf-8')
+        try:
+            sync_folders(
+                source_folder=source,
+                dest_folder=destination,
+                args=args,
+                now_millis=current_time_millis(),
+                stdout=self.stdout,
+                no_progress=args.noProgress,
+                max_workers=max_workers,
+                log_file=log_file,
+                summary_only=args.summaryOnly,
+                extra_dest_folders=extra_destinations
+            )
+        finally:
+            if log_file is not None:
+                log_file.close()
         return 0
 
+    def _set_bandwidth_limits(self, args):
+        limiter = get_bandwidth_limiter()
+        if args.uploadLimit is not None:
+            limiter.set_max_rate(UPLOAD, args.uploadLimit)
+        if args.downloadLimit is not None:
+            limiter.set_max_rate(DOWNLOAD, args.downloadLimit)
+        if args.bandwidthFile is not None:
+            limiter.set_control_file(args.bandwidthFile)
+            if hasattr(signal, 'SIGHUP'):
+                signal.signal(signal.SIGHUP, bandwidth_reload_handler)
+
 
 class TestHttp(Command):
     """
@@ -671,6 +878,34 @@ class UpdateBucket(Command):
         return 0
 
 
+class UpdateIndex(Command):
+    """
+    b2 update_index <bucketName> [<folderName>]
+
+        Lists all versions of the files in a folder and all of its
+        sub-folders, and stores them in the listing index, so that
+        'ls', 'find' and 'du' can use them with --offline, and sync
+        can use them with --indexMaxAge.
+
+        The listing index is kept only when the B2_LISTING_INDEX
+        environment variable names the file to keep it in.  Files
+        uploaded, hidden and deleted with this tool are added to it
+        or removed from it as that happens.
+    """
+
+    REQUIRED = ['bucketName']
+
+    OPTIONAL = ['folderName']
+
+    def run(self, args):
+        if self.api.listing_index is None:
+            self._print_stderr('ERROR: set B2_LISTING_INDEX to the file to keep the index in')
+            return 1
+        bucket = self.api.get_bucket_by_name(args.bucketName)
+        self.api.listing_index.refresh(bucket, args.folderName or '')
+        return 0
+
+
 class UploadFile(Command):
     """
     b2 upload_file [--sha1 <sha1sum>] [--contentType <contentType>] [--info <key>=<value>]* \\
@@ -848,6 +1083,9 @@ class ConsoleTool(object):
         self._print_stderr('')
         self._print_stderr('For more details on one command: b2 help <command>')
         self._print_stderr('')
+        self._print_stderr('Set B2_HEDGING=1 to send a second copy of listing, file info and')
+        self._print_stderr('download calls that are slower than usual to get their first byte.')
+        self._print_stderr('')
         return 1
 
     def _print_download_info(self, download_dest):
@@ -878,7 +1116,19 @@ def decode_sys_argv():
 
 def main():
     info = SqliteAccountInfo()
-    b2_api = B2Api(info, AuthInfoCache(info))
+    listing_index = None
+    if os.environ.get('B2_LISTING_INDEX'):
+        listing_index = ListingIndex(os.path.expanduser(os.environ['B2_LISTING_INDEX']))
+    hedging_policy = None
+    if os.environ.get('B2_HEDGING'):
+        hedging_policy = HedgingPolicy()
+    b2_api = B2Api(
+        info,
+        AuthInfoCache(info),
+        listing_index=listing_index,
+        concurrency_controller=ConcurrencyController(),
+        hedging_policy=hedging_policy
+    )
     ct = ConsoleTool(b2_api=b2_api, stdout=sys.stdout, stderr=sys.stderr)
     decoded_argv = decode_sys_argv()
     exit_status = ct.run_command(decoded_argv)
@@ -0,0 +1,411 @@
+######################################################################
+#
+# File: b2/content_cache.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import collections
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+import uuid
+
+from .download_dest import AbstractDownloadDestination
+
+DATA_SUFFIX = '.data'
+INFO_SUFFIX = '.json'
+TEMP_PREFIX = 'tmp-'
+
+# A temporary file this old was left by a process that died, not one
+# that is still writing it.
+STALE_TEMP_SECONDS = 24 * 3600
+
+
+class CachedFile(object):
+    """
+    A file in a ContentCache: where its contents are, and what the
+    headers said when it was downloaded.
+    """
+
+    def __init__(
+        self, data_path, file_id, file_name, content_length, content_type, content_sha1,
+        file_info, mod_time_millis
+    ):
+        self.data_path = data_path
+        self.file_id = file_id
+        self.file_name = file_name
+        self.content_length = content_length
+        self.content_type = content_type
+        self.content_sha1 = content_sha1
+        self.file_info = file_info
+        self.mod_time_millis = mod_time_millis
+
+    def open_args(self):
+        """
+        Returns the arguments for AbstractDownloadDestination.open().
+        """
+        return (
+            self.file_id, self.file_name, self.content_length, self.content_type,
+            self.content_sha1, self.file_info, self.mod_time_millis
+        )
+
+    def as_download_result(self):
+        """
+        Returns what a download of the file returns.
+        """
+        return dict(
+            fileId=self.file_id,
+            fileName=self.file_name,
+            contentType=self.content_type,
+            contentLength=self.content_length,
+            contentSha1=self.content_sha1,
+            fileInfo=self.file_info
+        )
+
+    def as_info_dict(self):
+        return dict(
+            fileId=self.file_id,
+            fileName=self.file_name,
+            contentLength=self.content_length,
+            contentType=self.content_type,
+            contentSha1=self.content_sha1,
+            fileInfo=self.file_info,
+            modTimeMillis=self.mod_time_millis
+        )
+
+    @classmethod
+    def from_info_dict(cls, data_path, info):
+        return cls(
+            data_path, info['fileId'], info['fileName'], info['contentLength'],
+            info['contentType'], info['contentSha1'], info['fileInfo'], info['modTimeMillis']
+        )
+
+
+class ContentCache(object):
+    """
+    Keeps the contents of downloaded files in a local directory, so
+    that downloading the same file id again doesn't use the network.
+    The contents of a file id never change, so the copies never need
+    to be checked.
+
+    When the files add up to more than max_bytes, the least recently
+    used ones are removed.  Files bigger than max_bytes aren't kept.
+
+    Each file is stored as two files named after the file id: the
+    contents, and the details from the download headers.  The time
+    the details file was last modified is when the file was last
+    used, so the order is remembered by later runs.  Both are
+    written under temporary names and then renamed, so that other
+    processes sharing the directory never see part of a file; each
+    process only counts the bytes it knows about, though, so the
+    directory can grow past max_bytes while several share it.
+
+    serve() puts a cached file into a local destination by cloning it,
+    where the file system can, or else by copying it.  With
+    allow_hard_links, it makes a hard link instead of a copy; the
+    downloaded file is then the cache's own copy, and must be treated
+    as read-only: changing it, or its mode or times, changes what
+    later hits are served.  The stored contents are read-only, to
+    make that harder to do by accident.
+
+    This class is THREAD SAFE.
+    """
+
+    def __init__(self, directory, max_bytes, allow_hard_links=False):
+        """
+        :param directory: where to keep the files; created if it doesn't exist
+        :param max_bytes: the most bytes of file contents to keep
+        :param allow_hard_links: when True, local destinations that can't be cloned
+                                 are hard links to the cache, which must not be changed
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.allow_hard_links = allow_hard_links
+        self.lock = threading.Lock()
+        self.sizes = collections.OrderedDict()  # file id to size, least recently used first
+        self.total_bytes = 0
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+        self.linked_count = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._scan()
+
+    def get(self, file_id):
+        """
+        Returns the CachedFile for a file id, or None if it's not in the cache.
+        """
+        cached_file = self._read_info(file_id)
+        with self.lock:
+            if cached_file is None:
+                self.miss_count += 1
+                self._forget(file_id)
+                return None
+            self.hit_count += 1
+            self._touch(file_id, cached_file.content_length)
+        try:
+            os.utime(self._info_path(file_id), None)
+        except OSError:
+            pass  # evicted by another process; the copy being used is still fine
+        return cached_file
+
+    def serve(self, file_id, download_dest):
+        """
+        Puts a cached file in the download destination, by cloning or
+        linking it when the destination is a local file, and by copying
+        it otherwise.
+
+        :return: the same dict a download returns, or None if the file isn't cached
+        """
+        cached_file = self.get(file_id)
+        if cached_file is None:
+            return None
+        method = download_dest.link_from_local_file(
+            cached_file.data_path, *cached_file.open_args(), allow_hard_link=self.allow_hard_links
+        )
+        if method is None:
+            try:
+                with open(cached_file.data_path, 'rb') as source:
+                    with download_dest.open(*cached_file.open_args()) as output:
+                        shutil.copyfileobj(source, output)
+            except IOError:
+                # Another process evicted it between get() and here.
+                with self.lock:
+                    self.hit_count -= 1
+                    self.miss_count += 1
+                    self._forget(file_id)
+                return None
+        else:
+            with self.lock:
+                self.linked_count += 1
+        return cached_file.as_download_result()
+
+    def store(self, cached_file, temp_data_path):
+        """
+        Adds a file whose contents have been written to temp_data_path,
+        which must be in the cache directory, and makes room for it.
+        """
+        data_path = self._data_path(cached_file.file_id)
+        info_path = self._info_path(cached_file.file_id)
+        mod_time = cached_file.mod_time_millis / 1000.0
+        os.utime(temp_data_path, (mod_time, mod_time))
+        os.chmod(temp_data_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        self._replace(temp_data_path, data_path)
+        temp_info_path = self.make_temp_path()
+        with open(temp_info_path, 'w') as f:
+            json.dump(cached_file.as_info_dict(), f)
+        self._replace(temp_info_path, info_path)
+        with self.lock:
+            self._touch(cached_file.file_id, cached_file.content_length)
+            evicted = self._choose_evictions()
+        for file_id in evicted:
+            self._remove_files(file_id)
+
+    def make_temp_path(self):
+        """
+        Returns a new file name in the cache directory for writing a file
+        before it is stored.
+        """
+        return os.path.join(self.directory, TEMP_PREFIX + uuid.uuid4().hex)
+
+    def will_keep(self, content_length):
+        return content_length <= self.max_bytes
+
+    def get_stats(self):
+        with self.lock:
+            return dict(
+                hits=self.hit_count,
+                misses=self.miss_count,
+                evictions=self.eviction_count,
+                linked=self.linked_count,
+                entries=len(self.sizes),
+                bytes=self.total_bytes
+            )
+
+    def _scan(self):
+        """
+        Finds the files already in the directory, oldest used first, and
+        removes any left half-written by a process that died.
+        """
+        found = []
+        stale_time = time.time() - STALE_TEMP_SECONDS
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(TEMP_PREFIX):
+                try:
+                    if os.path.getmtime(path) < stale_time:
+                        self._unlink(path)
+                except OSError:
+                    pass  # just renamed by the process writing it
+            elif name.endswith(INFO_SUFFIX):
+                try:
+                    with open(path) as f:
+                        info = json.load(f)
+                    found.append((os.path.getmtime(path), info['fileId'], info['contentLength']))
+                except (IOError, OSError, ValueError, KeyError):
+                    self._unlink(path)
+        for (_, file_id, content_length) in sorted(found):
+            self._touch(file_id, content_length)
+        for file_id in self._choose_evictions():
+            self._remove_files(file_id)
+
+    def _read_info(self, file_id):
+        try:
+            with open(self._info_path(file_id)) as f:
+                info = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        data_path = self._data_path(file_id)
+        if not os.path.exists(data_path):
+            return None
+        return CachedFile.from_info_dict(data_path, info)
+
+    def _touch(self, file_id, content_length):
+        self._forget(file_id)
+        self.sizes[file_id] = content_length
+        self.total_bytes += content_length
+
+    def _forget(self, file_id):
+        if file_id in self.sizes:
+            self.total_bytes -= self.sizes.pop(file_id)
+
+    def _choose_evictions(self):
+        evicted = []
+        while self.max_bytes < self.total_bytes:
+            (file_id, content_length) = self.sizes.popitem(last=False)
+            self.total_bytes -= content_length
+            evicted.append(file_id)
+        self.eviction_count += len(evicted)
+        return evicted
+
+    def _remove_files(self, file_id):
+        self._unlink(self._info_path(file_id))
+        self._unlink(self._data_path(file_id))
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            # Windows won't remove read-only files.  Elsewhere, the mode is
+            # left alone, because a hard link handed out by serve() shares it.
+            try:
+                os.chmod(path, stat.S_IWUSR | stat.S_IRUSR)
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _replace(self, temp_path, path):
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # Windows won't rename over a file.
+            self._unlink(path)
+            os.rename(temp_path, path)
+
+    def _base_path(self, file_id):
+        return os.path.join(self.directory, hashlib.sha1(file_id.encode('utf-8')).hexdigest())
+
+    def _data_path(self, file_id):
+        return self._base_path(file_id) + DATA_SUFFIX
+
+    def _info_path(self, file_id):
+        return self._base_path(file_id) + INFO_SUFFIX
+
+
+class _CachingWriter(object):
+    """
+    Context manager that writes to the file opened by a download
+    destination and to a new file in the content cache at the same
+    time.  The cache file is stored only if the download finishes
+    without an error.  Trouble writing the cache file doesn't stop
+    the download.
+    """
+
+    def __init__(self, content_cache, cached_file, dest_context):
+        self.content_cache = content_cache
+        self.cached_file = cached_file
+        self.dest_context = dest_context
+        self.temp_path = None
+        self.cache_file = None
+
+    def __enter__(self):
+        self.output = self.dest_context.__enter__()
+        try:
+            self.temp_path = self.content_cache.make_temp_path()
+            self.cache_file = open(self.temp_path, 'wb')
+        except IOError:
+            self._abandon()
+        return self
+
+    def write(self, data):
+        self.output.write(data)
+        if self.cache_file is not None:
+            try:
+                self.cache_file.write(data)
+            except IOError:
+                self._abandon()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        result = self.dest_context.__exit__(exc_type, exc_val, exc_tb)
+        if self.cache_file is not None:
+            try:
+                self.cache_file.close()
+                if exc_type is None:
+                    self.content_cache.store(self.cached_file, self.temp_path)
+                    self.temp_path = None
+            except (IOError, OSError):
+                pass
+            finally:
+                self._abandon()
+        return result
+
+    def _abandon(self):
+        if self.cache_file is not None:
+            self.cache_file.close()
+            self.cache_file = None
+        if self.temp_path is not None:
+            self.content_cache._unlink(self.temp_path)
+            self.temp_path = None
+
+
+class CachingDownloadDest(AbstractDownloadDestination):
+    """
+    Wraps a download destination so that the file downloaded into it
+    is also put in a ContentCache.
+    """
+
+    def __init__(self, content_cache, download_dest):
+        self.content_cache = content_cache
+        self.download_dest = download_dest
+
+    def open(
+        self, file_id, file_name, content_length, content_type, content_sha1, file_info,
+        mod_time_millis
+    ):
+        dest_context = self.download_dest.open(
+            file_id, file_name, content_length, content_type, content_sha1, file_info,
+            mod_time_millis
+        )
+        if not self.content_cache.will_keep(content_length):
+            return dest_context
+        cached_file = CachedFile(
+            None, file_id, file_name, content_length, content_type, content_sha1, file_info,
+            mod_time_millis
+        )
+        return _CachingWriter(self.content_cache, cached_file, dest_context)
+
+    def abandon(self):
+        self.download_dest.abandon()
+
+    def __getattr__(self, name):
+        # file_id, file_name, etc., as set by the wrapped destination
+        return getattr(self.download_dest, name)
@@ -8,12 +8,16 @@
 #
 ######################################################################
 
+import mmap
 import os
+import tempfile
 from abc import (ABCMeta, abstractmethod)
 
 import six
 
-from .progress import (StreamWithProgress)
+from .exception import TransferStalled
+from .progress import (SampledProgressListener, StreamWithProgress)
+from .utils import clone_or_link_file
 
 
 @six.add_metaclass(ABCMeta)
@@ -39,6 +43,29 @@ class AbstractDownloadDestination(object):
         :return: None
         """
 
+    def link_from_local_file(
+        self, local_path, file_id, file_name, content_length, content_type, content_sha1,
+        file_info, mod_time_millis, allow_hard_link=False
+    ):
+        """
+        Makes the destination hold the contents of a local file that is
+        already on disk, without reading it, if the destination can.
+        Takes the same file details as open().
+
+        :param allow_hard_link: when True, the destination may be made a hard link
+                                to the file, if it can't be cloned; the caller must
+                                then treat both as read-only
+
+        :return: 'clone' or 'link' if it was done, None if open() must be used
+        """
+        return None
+
+    def abandon(self):
+        """
+        Called when a download that stalled won't be tried again, to
+        release anything that open() left open for the next try.
+        """
+
 
 class OpenLocalFileForWriting(object):
     """
@@ -47,7 +74,8 @@ class OpenLocalFileForWriting(object):
     time when it's done.
 
     Takes care of opening/closing the file, and closing the
-    progress listener.
+    progress listener.  After a stall, the listener is left open,
+    because the download is tried again with the same one.
     """
 
     def __init__(self, local_path_name, progress_listener, mod_time_millis):
@@ -60,7 +88,10 @@ class OpenLocalFileForWriting(object):
         return StreamWithProgress(self.file.__enter__(), self.progress_listener)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.progress_listener.close()
+        if exc_type is not None and issubclass(exc_type, TransferStalled):
+            self.progress_listener.finish()
+        else:
+            self.progress_listener.close()
         result = self.file.__exit__(exc_type, exc_val, exc_tb)
         mod_time = self.mod_time_millis / 1000.0
 
@@ -79,7 +110,7 @@ class DownloadDestLocalFile(AbstractDownloadDestination):
 
     def __init__(self, local_file_path, progress_listener):
         self.local_file_path = local_file_path
-        self.progress_listener = progress_listener
+        self.progress_listener = SampledProgressListener(progress_listener)
 
     def open(
         self, file_id, file_name, content_length, content_type, content_sha1, file_info,
@@ -98,6 +129,31 @@ class DownloadDestLocalFile(AbstractDownloadDestination):
             self.local_file_path, self.progress_listener, mod_time_millis
         )
 
+    def link_from_local_file(
+        self, local_path, file_id, file_name, content_length, content_type, content_sha1,
+        file_info, mod_time_millis, allow_hard_link=False
+    ):
+        method = clone_or_link_file(local_path, self.local_file_path, allow_hard_link)
+        if method is None:
+            return None
+        self.file_id = file_id
+        self.file_name = file_name
+        self.content_length = content_length
+        self.content_type = content_type
+        self.content_sha1 = content_sha1
+        self.file_info = file_info
+        if method == 'clone':
+            # A hard link shares its times with the source, which are left alone.
+            mod_time = mod_time_millis / 1000.0
+            os.utime(self.local_file_path, (mod_time, mod_time))
+        self.progress_listener.set_total_bytes(content_length)
+        self.progress_listener.bytes_completed(content_length)
+        self.progress_listener.close()
+        return method
+
+    def abandon(self):
+        self.progress_listener.close()
+
 
 class BytesCapture(six.BytesIO):
     """
@@ -114,11 +170,85 @@ class BytesCapture(six.BytesIO):
         pass
 
 
+class BytesPreallocated(object):
+    """
+    A file-like object for writing a known number of bytes into a
+    buffer made at the start, instead of one that keeps growing and
+    being copied, like BytesIO does.
+
+    The buffer is a bytearray, or a memory map for big ones.  Like
+    BytesCapture, it keeps the data when it is closed, and it has
+    the same getvalue() and getbuffer() methods as BytesIO.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        try:
+            self.view = memoryview(buffer)
+        except TypeError:
+            self.view = buffer  # mmap objects don't have the buffer interface in Python 2
+        self.position = 0
+
+    def write(self, data):
+        end = self.position + len(data)
+        if len(self.buffer) < end:
+            raise IOError('writing past the end of a %d byte buffer' % (len(self.buffer),))
+        self.view[self.position:end] = data
+        self.position = end
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def getbuffer(self):
+        """
+        Returns the bytes written so far, without copying them.
+        """
+        return self.view[:self.position]
+
+    def getvalue(self):
+        """
+        Returns a copy of the bytes written so far.
+        """
+        data = self.getbuffer()
+        if isinstance(data, memoryview):
+            return data.tobytes()
+        return data
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
 class DownloadDestBytes(AbstractDownloadDestination):
     """
     Stores a downloaded file into bytes in memory.
+
+    The content length is known when the download starts, so the
+    bytes are written straight into a buffer of exactly that size.
+    Files of mmap_threshold bytes or more go into a memory map
+    instead of a bytearray, so the operating system can page them
+    out; it maps a temporary file in mmap_dir if that is given, and
+    memory backed by swap otherwise.
+
+    After the download, bytes_io.getbuffer() has the contents
+    without copying them, and bytes_io.getvalue() has them as bytes.
     """
 
+    DEFAULT_MMAP_THRESHOLD = 64 * 1024 * 1024
+
+    def __init__(self, mmap_threshold=DEFAULT_MMAP_THRESHOLD, mmap_dir=None):
+        self.mmap_threshold = mmap_threshold
+        self.mmap_dir = mmap_dir
+
     def open(
         self, file_id, file_name, content_length, content_type, content_sha1, file_info,
         mod_time_millis
@@ -130,5 +260,15 @@ class DownloadDestBytes(AbstractDownloadDestination):
         self.content_sha1 = content_sha1
         self.file_info = file_info
         self.mod_time_millis = mod_time_millis
-        self.bytes_io = BytesCapture()
+        self.bytes_io = BytesPreallocated(self._make_buffer(content_length))
         return self.bytes_io
+
+    def _make_buffer(self, size):
+        if size == 0 or size < self.mmap_threshold:
+            return bytearray(size)
+        if self.mmap_dir is None:
+            return mmap.mmap(-1, size)
+        # The map keeps the file's contents after the file is closed and removed.
+        with tempfile.TemporaryFile(dir=self.mmap_dir) as f:
+            f.truncate(size)
+            return mmap.mmap(f.fileno(), size)
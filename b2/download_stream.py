@@ -0,0 +1,243 @@
+######################################################################
+#
+# File: b2/download_stream.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import collections
+import hashlib
+
+import six
+
+from .bandwidth import get_bandwidth_limiter
+from .b2http import shut_down_response
+from .exception import (ChecksumMismatch, TruncatedOutput)
+
+try:
+    import concurrent.futures as futures
+except:
+    import futures
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+class DownloadHeaders(object):
+    """
+    The details of a file, from the headers of a download response.
+    """
+
+    def __init__(self, headers):
+        self.file_id = headers['x-bz-file-id']
+        self.file_name = headers['x-bz-file-name']
+        self.content_type = headers['content-type']
+        self.content_length = int(headers['content-length'])
+        self.content_sha1 = headers['x-bz-content-sha1']
+        self.file_info = dict(
+            (k[10:], headers[k]) for k in headers if k.startswith('x-bz-info-')
+        )
+        self.upload_timestamp = int(headers['x-bz-upload-timestamp'])
+        if 'src_last_modified_millis' in self.file_info:
+            self.mod_time_millis = int(self.file_info['src_last_modified_millis'])
+        else:
+            self.mod_time_millis = self.upload_timestamp
+
+    def check_download(self, bytes_read, digest):
+        """
+        Raises an error if the bytes downloaded aren't all of the file.
+
+        :param bytes_read: how many bytes were downloaded
+        :param digest: the sha1 hash object that the bytes were fed to
+        """
+        if bytes_read != self.content_length:
+            raise TruncatedOutput(bytes_read, self.content_length)
+        if self.content_sha1 != 'none' and digest.hexdigest() != self.content_sha1:
+            raise ChecksumMismatch(
+                checksum_type='sha1', expected=self.content_sha1, actual=digest.hexdigest()
+            )
+
+    def as_download_result(self):
+        return dict(
+            fileId=self.file_id,
+            fileName=self.file_name,
+            contentType=self.content_type,
+            contentLength=self.content_length,
+            contentSha1=self.content_sha1,
+            fileInfo=self.file_info,
+            uploadTimestamp=self.upload_timestamp
+        )
+
+
+class DownloadStream(object):
+    """
+    A download whose contents are handed over as they arrive, instead
+    of being written to a download destination.  Use like this:
+
+        with api.stream_file_by_id(file_id) as stream:
+            print(stream.file_name, stream.content_length)
+            for chunk in stream:
+                process(chunk)
+
+    Each chunk is a memoryview of bytes that were just read from the
+    network.  Nothing more is read until the loop asks for the next
+    one, so a slow consumer slows the download down instead of
+    having data pile up in memory; the time spent waiting for the
+    consumer doesn't count against the stall watchdog.
+
+    The length and sha1 checksum are checked after the last chunk:
+    the loop raises TruncatedOutput or ChecksumMismatch then, so the
+    consumer must not treat its output as good until the loop ends.
+
+    The details of the file (file_id, file_name, content_length,
+    content_type, content_sha1, file_info, mod_time_millis and
+    upload_timestamp) are attributes, as soon as the context is
+    entered.
+    """
+
+    DEFAULT_CHUNK_SIZE = 65536
+
+    def __init__(self, response_context, stall_watchdog=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        :param response_context: the context manager returned by B2Http.get_content()
+        :param stall_watchdog: optional StallWatchdog for the download
+        :param chunk_size: the most bytes in a chunk
+        """
+        self.response_context = response_context
+        self.stall_watchdog = stall_watchdog
+        self.chunk_size = chunk_size
+        self.response = None
+        self.headers = None
+        self.bytes_read = 0
+        self.started = False
+
+    def __enter__(self):
+        self.response = self.response_context.__enter__()
+        try:
+            self.headers = DownloadHeaders(self.response.headers)
+        except:
+            self.response_context.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self.response_context.__exit__(exc_type, exc_val, exc_tb)
+
+    def __getattr__(self, name):
+        # the file details
+        if self.headers is None:
+            raise AttributeError(name)
+        return getattr(self.headers, name)
+
+    def __iter__(self):
+        return self.iter_chunks()
+
+    def iter_chunks(self):
+        """
+        Yields the contents in memoryview chunks.  Can only be done once.
+        """
+        assert self.response is not None, 'use DownloadStream in a with statement'
+        assert not self.started, 'a DownloadStream can only be read once'
+        self.started = True
+        digest = hashlib.sha1()
+        bandwidth_limiter = get_bandwidth_limiter()
+        stall_detector = None
+        if self.stall_watchdog is not None:
+            response = self.response
+            stall_detector = self.stall_watchdog.start_transfer()
+            stall_detector.add_abort_callback(lambda: shut_down_response(response))
+            stall_detector.start()
+        try:
+            for data in self.response.iter_content(chunk_size=self.chunk_size):
+                waited = bandwidth_limiter.throttle_download(len(data))
+                if stall_detector is not None:
+                    stall_detector.add_idle_time(waited)
+                    stall_detector.bytes_transferred(len(data))
+                    stall_detector.pause()
+                digest.update(data)
+                self.bytes_read += len(data)
+                yield memoryview(data)
+                if stall_detector is not None:
+                    stall_detector.resume()
+        except Exception:
+            if stall_detector is not None:
+                stall_detector.raise_if_stalled()
+            raise
+        finally:
+            if stall_detector is not None:
+                stall_detector.finish()
+        if stall_detector is not None:
+            stall_detector.raise_if_stalled()
+        self.headers.check_download(self.bytes_read, digest)
+
+
+def write_file_in_order(
+    api, file_id, output, part_size=DEFAULT_PART_SIZE, parts_in_flight=4, file_version_info=None
+):
+    """
+    Writes the contents of a file to a binary file-like object, in
+    order, while the parts after the one being written are fetched
+    with ranged downloads, parts_in_flight of them at a time.
+
+    At most parts_in_flight + 1 parts are held in memory: the one
+    being written and the ones being fetched.  When the output is
+    slower than the network, no more parts are fetched until there
+    is room.
+
+    Each part is checked to be as long as the range asked for, and
+    TruncatedOutput raised before writing it if it isn't.  The sha1
+    checksum of what was written is only checked at the end, after
+    everything has been written, and ChecksumMismatch raised if it's
+    wrong.  There is nothing to check when the content_sha1 is 'none'
+    and there is no large_file_sha1 in the file info.
+
+    :param file_version_info: the FileVersionInfo of the file, if it is known;
+                              otherwise it comes from B2Api.get_file_version_info()
+    :return: the FileVersionInfo of the file
+    """
+    if file_version_info is None:
+        file_version_info = api.get_file_version_info(file_id)
+    size = file_version_info.size
+    expected_sha1 = file_version_info.content_sha1
+    if expected_sha1 == 'none':
+        expected_sha1 = file_version_info.file_info.get('large_file_sha1')
+    ranges = iter(
+        [(start, min(start + part_size, size) - 1) for start in six.moves.range(0, size, part_size)]
+    )
+
+    def fetch(start, end):
+        return api.session.download_file_range_by_id(
+            file_id, start, end, url_factory=api.account_info.get_download_url
+        )
+
+    def fetch_next_part():
+        next_range = next(ranges, None)
+        if next_range is not None:
+            (start, end) = next_range
+            pending.append((executor.submit(fetch, start, end), end - start + 1))
+
+    digest = hashlib.sha1()
+    executor = futures.ThreadPoolExecutor(max_workers=parts_in_flight)
+    pending = collections.deque()  # (future, expected length) for the parts, in order
+    try:
+        for _ in six.moves.range(parts_in_flight):
+            fetch_next_part()
+        while pending:
+            (future, expected_length) = pending.popleft()
+            data = future.result()
+            if len(data) != expected_length:
+                raise TruncatedOutput(len(data), expected_length)
+            fetch_next_part()
+            digest.update(data)
+            output.write(data)
+    finally:
+        for (future, _) in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+    if expected_sha1 is not None and digest.hexdigest() != expected_sha1:
+        raise ChecksumMismatch(
+            checksum_type='sha1', expected=expected_sha1, actual=digest.hexdigest()
+        )
+    return file_version_info
@@ -10,6 +10,10 @@
 
 
 class B2Error(Exception):
+    # Seconds to wait before retrying, from the Retry-After header
+    # of the response, if the service sent one.
+    retry_after_seconds = None
+
     def should_retry_http(self):
         """
         Returns true if this is an error that can cause an HTTP
@@ -151,6 +155,14 @@ class InvalidAuthToken(B2Error):
         return True
 
 
+class InvalidRange(B2Error):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return 'Range not satisfiable: %s' % (self.message,)
+
+
 class MaxFileSizeExceeded(B2Error):
     def __init__(self, size, max_allowed_size):
         self.size = size
@@ -216,6 +228,15 @@ class PartSha1Mismatch(B2Error):
         return 'Part number %s has wrong SHA1' % (self.key,)
 
 
+class PrefixNotIndexed(B2Error):
+    def __init__(self, bucket_id, prefix):
+        self.bucket_id = bucket_id
+        self.prefix = prefix
+
+    def __str__(self):
+        return 'Not in the listing index: bucket %s, prefix "%s"' % (self.bucket_id, self.prefix)
+
+
 class ServiceError(B2Error):
     """
     Used for HTTP status codes 500 through 599.
@@ -247,6 +268,23 @@ class TooManyRequests(B2Error):
         return True
 
 
+class TransferStalled(B2Error):
+    def __init__(self, bytes_per_second, seconds):
+        self.bytes_per_second = bytes_per_second
+        self.seconds = seconds
+
+    def __str__(self):
+        return 'transfer stalled: %d bytes/s over the last %d seconds' % (
+            self.bytes_per_second, self.seconds
+        )
+
+    def should_retry_http(self):
+        return True
+
+    def should_retry_upload(self):
+        return True
+
+
 class TruncatedOutput(B2Error):
     def __init__(self, bytes_read, file_size):
         self.bytes_read = bytes_read
@@ -297,6 +335,8 @@ def interpret_b2_error(status, code, message, post_params=None):
         return InvalidAuthToken(message, code)
     elif status == 403 and code == "storage_cap_exceeded":
         return StorageCapExceeded()
+    elif status == 416:
+        return InvalidRange(message)
     elif status == 429:
         return TooManyRequests()
     elif 500 <= status and status < 600:
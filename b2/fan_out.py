@@ -0,0 +1,111 @@
+######################################################################
+#
+# File: b2/fan_out.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import threading
+
+from .upload_source import AbstractUploadSource
+from .utils import interruptible_get_result
+
+try:
+    import concurrent.futures as futures
+except:
+    import futures
+
+
+class SharedUploadSource(AbstractUploadSource):
+    """
+    Wraps an upload source that is being uploaded to several places
+    at once.  The checksum of the whole file, and of each part, is
+    computed by the first upload that needs it; the others wait for
+    it instead of reading and hashing the data again.
+
+    Opening is passed through.  For a local file, use an
+    UploadSourceLocalFile with use_mmap set, so that all of the
+    uploads read the same mapping, and the disk is read once; the
+    caller closes it when the uploads are done.
+
+    This class is THREAD SAFE.
+    """
+
+    def __init__(self, upload_source):
+        self.upload_source = upload_source
+        self.lock = threading.Lock()
+        self.content_sha1 = None
+        self.range_locks = {}  # (offset, length) to the lock held while hashing it
+        self.range_sha1s = {}  # (offset, length) to its checksum
+
+    def get_content_length(self):
+        return self.upload_source.get_content_length()
+
+    def get_content_sha1(self):
+        with self.lock:
+            if self.content_sha1 is None:
+                self.content_sha1 = self.upload_source.get_content_sha1()
+            return self.content_sha1
+
+    def get_range_sha1(self, offset, length):
+        key = (offset, length)
+        with self.lock:
+            range_lock = self.range_locks.setdefault(key, threading.Lock())
+        with range_lock:
+            if key not in self.range_sha1s:
+                self.range_sha1s[key] = self.upload_source.get_range_sha1(offset, length)
+            return self.range_sha1s[key]
+
+    def open(self):
+        return self.upload_source.open()
+
+
+def upload_to_buckets(
+    destinations,
+    upload_source,
+    content_type=None,
+    file_info=None,
+    progress_listeners=None,
+    executor=None
+):
+    """
+    Uploads the same data to several buckets at the same time.  The
+    buckets can be in different accounts, because each one uses its
+    own B2Api.  The checksums are computed once, for all of them.
+
+    One upload failing doesn't stop the others.
+
+    :param destinations: a list of (bucket, file_name)
+    :param upload_source: the data to upload; wrapped in a SharedUploadSource
+    :param progress_listeners: optional list with a progress listener for each destination
+    :param executor: the thread pool to run the uploads in, which must have a
+                     thread for each destination that runs at once; when None,
+                     a pool is made for this call
+    :return: a list with, for each destination, the FileVersionInfo of the new
+             file, or the exception that stopped its upload
+    """
+    shared_source = SharedUploadSource(upload_source)
+    progress_listeners = progress_listeners or [None] * len(destinations)
+    own_executor = executor is None
+    if own_executor:
+        executor = futures.ThreadPoolExecutor(max_workers=len(destinations))
+    try:
+        upload_futures = [
+            executor.submit(
+                bucket.upload, shared_source, file_name, content_type, file_info,
+                progress_listener
+            ) for ((bucket, file_name), progress_listener) in zip(destinations, progress_listeners)
+        ]
+        results = []
+        for future in upload_futures:
+            try:
+                results.append(interruptible_get_result(future))
+            except Exception as e:
+                results.append(e)
+        return results
+    finally:
+        if own_executor:
+            executor.shutdown()
@@ -0,0 +1,183 @@
+######################################################################
+#
+# File: b2/file_info_cache.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import collections
+import json
+import sqlite3
+import threading
+
+from .file_version import FileVersionInfo
+
+# Listings show unfinished large files with this action.  They become
+# a different version when they are finished, so they aren't cached.
+UNFINISHED_ACTION = 'start'
+
+
+class FileInfoCache(object):
+    """
+    Remembers the FileVersionInfo for file ids.
+
+    A file version never changes once it exists, so what is known
+    about a file id is good until the version is deleted.  The cache
+    is filled from listings, uploads and downloads, so that looking up
+    a file seen earlier doesn't need to call the service.
+
+    The max_entries most recently used entries are kept in memory.
+    If db_path is given, every entry is also stored in an sqlite
+    database there, so that they are remembered by later runs.
+
+    This class is THREAD SAFE.
+    """
+
+    def __init__(self, max_entries=10000, db_path=None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.entries = collections.OrderedDict()
+        self.hit_count = 0
+        self.miss_count = 0
+        self.lock = threading.Lock()
+        self.thread_local = threading.local()
+        if db_path is not None:
+            with self._get_connection() as conn:
+                conn.execute(
+                    """
+                   CREATE TABLE IF NOT EXISTS
+                   file_version (
+                       file_id TEXT NOT NULL PRIMARY KEY,
+                       file_name TEXT NOT NULL,
+                       size INTEGER,
+                       content_type TEXT,
+                       content_sha1 TEXT,
+                       file_info TEXT NOT NULL,
+                       upload_timestamp INTEGER,
+                       action TEXT
+                   );
+                """
+                )
+
+    def get(self, file_id):
+        """
+        Returns the FileVersionInfo for the file id, or None if it isn't known.
+        """
+        with self.lock:
+            file_version_info = self.entries.get(file_id)
+            if file_version_info is not None:
+                self._touch(file_id, file_version_info)
+                self.hit_count += 1
+                return file_version_info
+        file_version_info = self._load(file_id)
+        with self.lock:
+            if file_version_info is None:
+                self.miss_count += 1
+            else:
+                self.hit_count += 1
+                self._touch(file_id, file_version_info)
+        return file_version_info
+
+    def put(self, file_version_info):
+        """
+        Remembers a file version.  Unfinished large files are ignored.
+        """
+        self.put_many([file_version_info])
+
+    def put_many(self, file_version_infos):
+        """
+        Remembers several file versions, like a page of a listing,
+        storing them in one database transaction.  Unfinished large
+        files are ignored.
+        """
+        file_version_infos = [
+            file_version_info for file_version_info in file_version_infos
+            if file_version_info.action != UNFINISHED_ACTION
+        ]
+        if not file_version_infos:
+            return
+        with self.lock:
+            for file_version_info in file_version_infos:
+                self._touch(file_version_info.id_, file_version_info)
+        self._store(file_version_infos)
+
+    def remove(self, file_id):
+        """
+        Forgets a file version that has been deleted.
+        """
+        with self.lock:
+            self.entries.pop(file_id, None)
+        if self.db_path is not None:
+            with self._get_connection() as conn:
+                conn.execute('DELETE FROM file_version WHERE file_id = ?;', (file_id,))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.db_path is not None:
+            with self._get_connection() as conn:
+                conn.execute('DELETE FROM file_version;')
+
+    def get_stats(self):
+        with self.lock:
+            return dict(entries=len(self.entries), hits=self.hit_count, misses=self.miss_count)
+
+    def _touch(self, file_id, file_version_info):
+        self.entries.pop(file_id, None)
+        self.entries[file_id] = file_version_info
+        while self.max_entries < len(self.entries):
+            self.entries.popitem(last=False)
+
+    def _load(self, file_id):
+        if self.db_path is None:
+            return None
+        cursor = self._get_connection().execute(
+            """
+            SELECT file_name, size, content_type, content_sha1, file_info, upload_timestamp, action
+            FROM file_version WHERE file_id = ?;
+            """, (file_id,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        (file_name, size, content_type, content_sha1, file_info, upload_timestamp, action) = row
+        return FileVersionInfo(
+            file_id, file_name, size, content_type, content_sha1, json.loads(file_info),
+            upload_timestamp, action
+        )
+
+    def _store(self, file_version_infos):
+        if self.db_path is None:
+            return
+        with self._get_connection() as conn:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO file_version
+                (file_id, file_name, size, content_type, content_sha1, file_info, upload_timestamp, action)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+                """, [
+                    (
+                        file_version_info.id_,
+                        file_version_info.file_name,
+                        file_version_info.size,
+                        file_version_info.content_type,
+                        file_version_info.content_sha1,
+                        json.dumps(file_version_info.file_info),
+                        file_version_info.upload_timestamp,
+                        file_version_info.action,
+                    ) for file_version_info in file_version_infos
+                ]
+            )
+
+    def _get_connection(self):
+        """
+        Connections to sqlite cannot be shared across threads.
+        """
+        try:
+            return self.thread_local.connection
+        except AttributeError:
+            self.thread_local.connection = sqlite3.connect(self.db_path)
+            return self.thread_local.connection
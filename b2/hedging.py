@@ -0,0 +1,278 @@
+######################################################################
+#
+# File: b2/hedging.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+from __future__ import division
+
+import bisect
+import threading
+import time
+
+import six
+from six.moves import queue
+
+try:
+    import concurrent.futures as futures
+except:
+    import futures
+
+# Calls that can safely be sent twice.
+HEDGED_OPERATIONS = ('b2_list_file_names', 'b2_get_file_info', 'b2_download_file_by_id')
+
+
+class LatencyHistogram(object):
+    """
+    Counts latencies in buckets that grow by 25% each, from one
+    millisecond to a few minutes, so percentiles are accurate to
+    within 25%.
+
+    Not thread safe; HedgingPolicy locks around it.
+    """
+
+    BUCKET_COUNT = 60
+    BOUNDS = [0.001 * 1.25 ** i for i in six.moves.range(BUCKET_COUNT)]
+
+    def __init__(self):
+        self.counts = [0] * (self.BUCKET_COUNT + 1)
+        self.total = 0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.total += 1
+
+    def percentile(self, fraction):
+        """
+        Returns the upper bound of the bucket holding the given
+        fraction of the latencies, or None if there are none.
+        """
+        if self.total == 0:
+            return None
+        needed = fraction * self.total
+        seen = 0
+        for (i, count) in enumerate(self.counts):
+            seen += count
+            if needed <= seen:
+                break
+        return self.BOUNDS[min(i, self.BUCKET_COUNT - 1)]
+
+    def as_list(self):
+        """
+        Returns a list of (upper_bound_seconds, count) for the buckets
+        that have anything in them.  The last bucket's bound is None.
+        """
+        bounds = self.BOUNDS + [None]
+        return [(bounds[i], count) for (i, count) in enumerate(self.counts) if count]
+
+
+class OperationStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.histogram = LatencyHistogram()
+
+    def as_dict(self):
+        return dict(
+            calls=self.calls,
+            hedges=self.hedges,
+            hedge_wins=self.hedge_wins,
+            hedge_rate=self.hedges / self.calls if self.calls else 0,
+            win_rate=self.hedge_wins / self.hedges if self.hedges else 0,
+            p50=self.histogram.percentile(0.5),
+            p95=self.histogram.percentile(0.95),
+            latency_histogram=self.histogram.as_list()
+        )
+
+
+class HedgingPolicy(object):
+    """
+    Sends a second copy of a call that is taking longer than usual,
+    and takes whichever answers first.  One slow server then doesn't
+    set the latency of the whole job.
+
+    Only the time to the first byte is hedged: a call is done when
+    the response headers are in, so a download whose body is slow
+    to arrive is not helped.
+
+    "Longer than usual" is the given percentile of the latencies seen
+    so far for the operation; no call is hedged until there have been
+    min_samples of them.  Only the operations listed, which must be
+    idempotent, are hedged.  The answer that loses is passed to the
+    discard function given to call(), so it can be closed.
+
+    The copies run in a pool of max_threads threads.  When all of
+    them are busy, calls are made without hedging, in the thread
+    that makes them, rather than waiting for a thread.
+
+    This class is THREAD SAFE.
+    """
+
+    def __init__(
+        self,
+        operations=HEDGED_OPERATIONS,
+        percentile=0.95,
+        min_samples=20,
+        min_delay=0.01,
+        max_threads=10,
+        clock=time.time
+    ):
+        self.operations = frozenset(operations)
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.clock = clock
+        self.stats = {}
+        self.lock = threading.Lock()
+        # One for each copy running, so that copies never wait in the pool's queue.
+        self.thread_slots = threading.BoundedSemaphore(max_threads)
+        self.executor = futures.ThreadPoolExecutor(max_workers=max_threads)
+
+    def applies_to(self, operation):
+        return operation in self.operations
+
+    def get_hedge_delay(self, operation):
+        """
+        Returns how long to wait before hedging a call, or None if
+        it's too soon to tell.
+        """
+        with self.lock:
+            stats = self.stats.get(operation)
+            if stats is None or stats.histogram.total < max(1, self.min_samples):
+                return None
+            return max(self.min_delay, stats.histogram.percentile(self.percentile))
+
+    def get_stats(self):
+        """
+        Returns a dict from operation name to a dict with the number
+        of calls, hedges sent, and hedges that answered first, the rates
+        of those, and the latencies seen.
+        """
+        with self.lock:
+            return dict((op, stats.as_dict()) for (op, stats) in six.iteritems(self.stats))
+
+    def call(self, operation, fcn, discard=None):
+        """
+        Calls fcn, hedging it if the operation is one that gets hedged.
+        If both copies fail, raises the error from the last one.
+
+        :param operation: the name of the operation, like 'b2_get_file_info'
+        :param fcn: a function with no arguments that makes the call
+        :param discard: optional function called with the result that wasn't used
+        """
+        if not self.applies_to(operation):
+            return fcn()
+        delay = self.get_hedge_delay(operation)
+        with self.lock:
+            self._get_stats(operation).calls += 1
+        if delay is None:
+            return self._timed(operation, fcn)
+        return _HedgedCall(self, operation, fcn, discard).run(delay)
+
+    def _timed(self, operation, fcn):
+        start_time = self.clock()
+        result = fcn()
+        self._record_latency(operation, self.clock() - start_time)
+        return result
+
+    def _record_latency(self, operation, seconds):
+        with self.lock:
+            self._get_stats(operation).histogram.record(seconds)
+
+    def _record_hedge_sent(self, operation):
+        with self.lock:
+            self._get_stats(operation).hedges += 1
+
+    def _record_hedge_won(self, operation):
+        with self.lock:
+            self._get_stats(operation).hedge_wins += 1
+
+    def _get_stats(self, operation):
+        stats = self.stats.get(operation)
+        if stats is None:
+            stats = self.stats[operation] = OperationStats()
+        return stats
+
+
+class _HedgedCall(object):
+    """
+    One call, sent once and maybe a second time, each copy in a
+    thread from the policy's pool.  The copies put their outcomes in
+    a queue until the winner is picked; after that, they discard them.
+    """
+
+    def __init__(self, policy, operation, fcn, discard):
+        self.policy = policy
+        self.operation = operation
+        self.fcn = fcn
+        self.discard = discard
+        self.outcomes = queue.Queue()
+        self.decided = False
+        self.lock = threading.Lock()
+
+    def run(self, delay):
+        if not self._start(0):
+            return self.policy._timed(self.operation, self.fcn)
+        try:
+            (index, result, error) = self.outcomes.get(timeout=delay)
+        except queue.Empty:
+            hedged = self._start(1)
+            if hedged:
+                self.policy._record_hedge_sent(self.operation)
+            (index, result, error) = self.outcomes.get()
+            if error is not None and hedged:
+                (index, result, error) = self.outcomes.get()
+        self._decide()
+        if error is not None:
+            raise error
+        if index == 1:
+            self.policy._record_hedge_won(self.operation)
+        return result
+
+    def _start(self, index):
+        """
+        Starts a copy, if there's a free thread for it.
+
+        :return: True if it was started
+        """
+        if not self.policy.thread_slots.acquire(False):
+            return False
+        try:
+            self.policy.executor.submit(self._run_copy, index)
+        except:
+            self.policy.thread_slots.release()
+            raise
+        return True
+
+    def _run_copy(self, index):
+        try:
+            result = self.policy._timed(self.operation, self.fcn)
+            outcome = (index, result, None)
+        except Exception as e:
+            outcome = (index, None, e)
+        finally:
+            self.policy.thread_slots.release()
+        with self.lock:
+            if not self.decided:
+                self.outcomes.put(outcome)
+                return
+        self._discard(outcome)
+
+    def _decide(self):
+        with self.lock:
+            self.decided = True
+        while True:
+            try:
+                self._discard(self.outcomes.get_nowait())
+            except queue.Empty:
+                break
+
+    def _discard(self, outcome):
+        (_, result, error) = outcome
+        if error is None and self.discard is not None:
+            self.discard(result)
@@ -0,0 +1,355 @@
+######################################################################
+#
+# File: b2/listing_index.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import fnmatch
+import itertools
+import json
+import sqlite3
+import threading
+import time
+
+from .exception import PrefixNotIndexed
+from .file_version import FileVersionInfo
+
+# The characters that start a wildcard in a find() pattern.
+WILDCARD_CHARACTERS = '*?['
+
+INSERT_FILE_VERSION = """
+    INSERT OR REPLACE INTO file_version
+    (file_id, bucket_id, file_name, size, content_type, content_sha1, file_info,
+     upload_timestamp, action, indexed_millis)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+
+def folder_prefix(folder_name):
+    """
+    Returns the prefix that the names of the files in a folder start
+    with, the same way Bucket.ls() does.
+    """
+    if folder_name != '' and not folder_name.endswith('/'):
+        return folder_name + '/'
+    return folder_name
+
+
+def literal_prefix(pattern):
+    """
+    Returns the part of a find() pattern before the first wildcard.
+    """
+    for (i, c) in enumerate(pattern):
+        if c in WILDCARD_CHARACTERS:
+            return pattern[:i]
+    return pattern
+
+
+class ListingIndex(object):
+    """
+    A local copy of the b2_list_file_versions results for the folders
+    of buckets that have been indexed, kept in an sqlite database.
+
+    refresh() lists a folder and replaces what the index has for it.
+    Uploads, hides and deletes done through B2Api update the index as
+    they happen, so it stays right between refreshes, except for
+    changes made by other clients.  The queries (ls, find and du)
+    answer from the index alone, and raise PrefixNotIndexed when the
+    names asked about are not in a folder that has been indexed.
+
+    B2 has no way to ask what changed since a listing, so a refresh
+    always lists the whole folder.  Folders are refreshed separately,
+    so a busy folder can be refreshed more often than the rest of
+    the bucket.
+
+    This class is THREAD SAFE.
+    """
+
+    # How many file versions are read or written at a time.
+    PAGE_SIZE = 1000
+
+    def __init__(self, db_path, clock=time.time):
+        """
+        :param db_path: the sqlite database file, or ':memory:' for an index
+                        that lasts only as long as this object
+        """
+        self.db_path = db_path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.connection as conn:
+            self._create_tables(conn)
+
+    def _create_tables(self, conn):
+        conn.execute(
+            """
+           CREATE TABLE IF NOT EXISTS
+           indexed_prefix (
+               bucket_id TEXT NOT NULL,
+               prefix TEXT NOT NULL,
+               refreshed_millis INTEGER NOT NULL
+           );
+        """
+        )
+        conn.execute(
+            """
+           CREATE TABLE IF NOT EXISTS
+           file_version (
+               file_id TEXT NOT NULL PRIMARY KEY,
+               bucket_id TEXT NOT NULL,
+               file_name TEXT NOT NULL,
+               size INTEGER,
+               content_type TEXT,
+               content_sha1 TEXT,
+               file_info TEXT NOT NULL,
+               upload_timestamp INTEGER,
+               action TEXT NOT NULL,
+               indexed_millis INTEGER NOT NULL
+           );
+        """
+        )
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS file_version_name ON file_version (bucket_id, file_name);'
+        )
+
+    # updating
+
+    def refresh(self, bucket, folder_name=''):
+        """
+        Lists all versions of the files in a folder of the bucket, and
+        replaces what the index has for that folder.
+
+        The listing is stored PAGE_SIZE versions at a time, as it
+        arrives, so a big folder is never all in memory.  Versions that
+        are gone are removed once the listing is done.  Until then,
+        queries may see them alongside the new ones.
+        """
+        prefix = folder_prefix(folder_name)
+        start_millis = self._now_millis()
+        rows = (
+            self._make_row(bucket.id_, file_version_info, start_millis)
+            for (file_version_info, _) in bucket.ls(
+                prefix, show_versions=True, recursive=True, fetch_count=1000
+            )
+        )
+        while True:
+            page = list(itertools.islice(rows, self.PAGE_SIZE))
+            if not page:
+                break
+            with self.lock:
+                with self.connection as conn:
+                    conn.executemany(INSERT_FILE_VERSION, page)
+        with self.lock:
+            with self.connection as conn:
+                # Everything listed was just stamped with start_millis.  Versions
+                # added by our own uploads since the listing started are kept.
+                conn.execute(
+                    """
+                    DELETE FROM file_version
+                    WHERE bucket_id = ? AND substr(file_name, 1, ?) = ? AND indexed_millis < ?;
+                    """, (bucket.id_, len(prefix), prefix, start_millis)
+                )
+                # A folder's refresh covers the folders in it.
+                conn.execute(
+                    'DELETE FROM indexed_prefix WHERE bucket_id = ? AND substr(prefix, 1, ?) = ?;',
+                    (bucket.id_, len(prefix), prefix)
+                )
+                conn.execute(
+                    'INSERT INTO indexed_prefix VALUES (?, ?, ?);',
+                    (bucket.id_, prefix, start_millis)
+                )
+
+    def refresh_if_stale(self, bucket, folder_name, max_age_seconds):
+        """
+        Refreshes a folder unless it was refreshed in the last max_age_seconds.
+        """
+        if not self.is_indexed(bucket.id_, folder_prefix(folder_name), max_age_seconds):
+            self.refresh(bucket, folder_name)
+
+    def add_file_version(self, bucket_id, file_version_info):
+        """
+        Records a file version that was just uploaded or hidden.
+        """
+        with self.lock:
+            with self.connection as conn:
+                conn.execute(
+                    INSERT_FILE_VERSION,
+                    self._make_row(bucket_id, file_version_info, self._now_millis())
+                )
+
+    def remove_file_version(self, file_id):
+        """
+        Forgets a file version that was just deleted.
+        """
+        with self.lock:
+            with self.connection as conn:
+                conn.execute('DELETE FROM file_version WHERE file_id = ?;', (file_id,))
+
+    def clear(self):
+        with self.lock:
+            with self.connection as conn:
+                conn.execute('DELETE FROM file_version;')
+                conn.execute('DELETE FROM indexed_prefix;')
+
+    # queries
+
+    def is_indexed(self, bucket_id, name_prefix, max_age_seconds=None):
+        """
+        Is there a folder in the index that holds all of the file names
+        starting with name_prefix?
+
+        :param max_age_seconds: when set, only folders refreshed in that many seconds count
+        """
+        min_millis = None
+        if max_age_seconds is not None:
+            min_millis = self._now_millis() - int(max_age_seconds * 1000)
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT prefix, refreshed_millis FROM indexed_prefix WHERE bucket_id = ?;',
+                (bucket_id,)
+            ).fetchall()
+        return any(
+            name_prefix.startswith(prefix) and (min_millis is None or min_millis <= refreshed)
+            for (prefix, refreshed) in rows
+        )
+
+    def file_versions(self, bucket_id, name_prefix='', show_versions=False):
+        """
+        Returns an iterator of FileVersionInfo for the files whose names
+        start with name_prefix, in the order b2_list_file_versions uses.
+
+        The rows are read PAGE_SIZE at a time, so a big folder is never
+        all in memory, and the index isn't locked while the caller
+        handles them.
+
+        :param show_versions: when False, there is one entry for each file that
+                              b2_list_file_names would show: the newest version,
+                              if it is an upload
+        """
+        if not self.is_indexed(bucket_id, name_prefix):
+            raise PrefixNotIndexed(bucket_id, name_prefix)
+        return self._iter_file_versions(bucket_id, name_prefix, show_versions)
+
+    def _iter_file_versions(self, bucket_id, name_prefix, show_versions):
+        previous_name = None
+        for (file_id, file_name, size, content_type, content_sha1, file_info, upload_timestamp,
+             action) in self._iter_rows(bucket_id, name_prefix):
+            if not show_versions:
+                is_newest = file_name != previous_name
+                previous_name = file_name
+                if not is_newest or action != 'upload':
+                    continue
+            yield FileVersionInfo(
+                file_id, file_name, size, content_type, content_sha1, json.loads(file_info),
+                upload_timestamp, action
+            )
+
+    def _iter_rows(self, bucket_id, name_prefix):
+        """
+        Yields the rows for the names starting with name_prefix, in
+        order, reading a page at a time.  Each page starts after the
+        last row of the one before, so rows added or removed in between
+        don't make it skip or repeat any.
+        """
+        select = """
+            SELECT file_id, file_name, size, content_type, content_sha1, file_info,
+                   upload_timestamp, action
+            FROM file_version
+            WHERE bucket_id = ? AND file_name >= ? AND substr(file_name, 1, ?) = ? %s
+            ORDER BY file_name, coalesce(upload_timestamp, -1) DESC, file_id
+            LIMIT ?;
+        """
+        after_row = """
+            AND (file_name > ? OR (file_name = ? AND (
+                coalesce(upload_timestamp, -1) < ? OR
+                (coalesce(upload_timestamp, -1) = ? AND file_id > ?))))
+        """
+        with self.lock:
+            page = self.connection.execute(
+                select % ('',),
+                (bucket_id, name_prefix, len(name_prefix), name_prefix, self.PAGE_SIZE)
+            ).fetchall()
+        while page:
+            for row in page:
+                yield row
+            if len(page) < self.PAGE_SIZE:
+                return
+            (file_id, file_name, _, _, _, _, upload_timestamp, _) = page[-1]
+            timestamp = -1 if upload_timestamp is None else upload_timestamp
+            with self.lock:
+                page = self.connection.execute(
+                    select % (after_row,), (
+                        bucket_id, file_name, len(name_prefix), name_prefix, file_name,
+                        file_name, timestamp, timestamp, file_id, self.PAGE_SIZE
+                    )
+                ).fetchall()
+
+    def ls(self, bucket_id, folder_to_list='', show_versions=False, recursive=False):
+        """
+        Yields the same (file_version_info, folder_name) pairs that
+        Bucket.ls() does, from the index.
+        """
+        prefix = folder_prefix(folder_to_list)
+        current_dir = None
+        for file_version_info in self.file_versions(bucket_id, prefix, show_versions):
+            after_prefix = file_version_info.file_name[len(prefix):]
+            if '/' not in after_prefix or recursive:
+                yield file_version_info, None
+                current_dir = None
+            else:
+                folder_with_slash = after_prefix.split('/')[0] + '/'
+                if folder_with_slash != current_dir:
+                    yield file_version_info, prefix + folder_with_slash
+                    current_dir = folder_with_slash
+
+    def find(self, bucket_id, pattern, show_versions=False):
+        """
+        Returns a list of FileVersionInfo for the files whose whole names
+        match a shell-style pattern, like "photos/*.jpg".  The "*"
+        wildcard matches "/" too.
+        """
+        return [
+            file_version_info
+            for file_version_info in self.file_versions(
+                bucket_id, literal_prefix(pattern), show_versions
+            ) if fnmatch.fnmatchcase(file_version_info.file_name, pattern)
+        ]
+
+    def du(self, bucket_id, folder_name='', show_versions=False):
+        """
+        Adds up the files in a folder and all of its sub-folders.
+
+        :param show_versions: when True, counts every version that was uploaded,
+                              not just the files b2_list_file_names would show
+        :return: (file_count, total_bytes)
+        """
+        file_count = 0
+        total_bytes = 0
+        for file_version_info in self.file_versions(
+            bucket_id, folder_prefix(folder_name), show_versions
+        ):
+            if file_version_info.action == 'upload':
+                file_count += 1
+                total_bytes += file_version_info.size or 0
+        return (file_count, total_bytes)
+
+    def _now_millis(self):
+        return int(round(self.clock() * 1000))
+
+    def _make_row(self, bucket_id, file_version_info, indexed_millis):
+        return (
+            file_version_info.id_,
+            bucket_id,
+            file_version_info.file_name,
+            file_version_info.size,
+            file_version_info.content_type,
+            file_version_info.content_sha1,
+            json.dumps(file_version_info.file_info),
+            file_version_info.upload_timestamp,
+            file_version_info.action or 'upload',
+            indexed_millis,
+        )
@@ -8,10 +8,15 @@
 #
 ######################################################################
 
+from __future__ import division
+
 from abc import ABCMeta, abstractmethod
+import collections
 import six
+import threading
 import time
 
+from .exception import TransferStalled
 from .utils import raise_if_shutting_down
 
 try:
@@ -146,6 +151,233 @@ def make_progress_listener(description, quiet):
         return SimpleProgressListener(description)
 
 
+class ProgressSampler(object):
+    """
+    Runs one background thread that periodically calls sample() on each
+    of the objects registered with it.
+
+    This lets the threads transferring data record their progress in
+    plain counters, without locking, and leaves the (possibly slow and
+    lock-protected) reporting to this one thread.
+
+    This class is THREAD SAFE.
+    """
+
+    # Seconds between samples
+    INTERVAL = 0.1
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.sampled = set()
+        self.thread = None
+
+    def add(self, sampled):
+        with self.lock:
+            self.sampled.add(sampled)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def remove(self, sampled):
+        with self.lock:
+            self.sampled.discard(sampled)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                to_sample = list(self.sampled)
+            for sampled in to_sample:
+                try:
+                    sampled.sample()
+                except (Exception, KeyboardInterrupt):
+                    # The transferring thread will see the same problem
+                    # when it finishes, so there's nothing to do here.
+                    pass
+
+
+_progress_sampler = ProgressSampler()
+
+
+def get_progress_sampler():
+    """
+    Returns the ProgressSampler shared by all transfers in this process.
+    """
+    return _progress_sampler
+
+
+class SampledProgressListener(AbstractProgressListener):
+    """
+    Wraps a progress listener.  The byte counts reported to this object
+    are just stored, and the ProgressSampler passes the latest one on to
+    the wrapped listener at a fixed interval, so the cost of progress
+    reporting doesn't depend on the number of blocks transferred.
+
+    Progress passed on is never less than what was reported before: when
+    an upload is retried, the wrapped listener won't see the count drop
+    back to 0.
+    """
+
+    def __init__(self, progress_listener, sampler=None):
+        self.progress_listener = progress_listener
+        self.sampler = sampler or get_progress_sampler()
+        self.lock = threading.Lock()  # held while reporting to the wrapped listener
+        self.byte_count = 0
+        self.reported_byte_count = 0
+
+    def set_total_bytes(self, total_byte_count):
+        self.progress_listener.set_total_bytes(total_byte_count)
+        self.sampler.add(self)
+
+    def bytes_completed(self, byte_count):
+        raise_if_shutting_down()
+        self.byte_count = byte_count
+
+    def sample(self):
+        with self.lock:
+            byte_count = self.byte_count
+            if self.reported_byte_count < byte_count:
+                self.reported_byte_count = byte_count
+                self.progress_listener.bytes_completed(byte_count)
+
+    def finish(self):
+        """
+        Stops sampling and reports the final byte count, but does not
+        close the wrapped listener.
+        """
+        self.sampler.remove(self)
+        self.sample()
+
+    def close(self):
+        self.finish()
+        self.progress_listener.close()
+
+
+class StallWatchdog(object):
+    """
+    Settings for noticing transfers that have stalled, and the maker
+    of a StallDetector for each transfer.
+
+    A transfer has stalled when it has moved fewer than
+    min_bytes_per_second, on average, over the last grace_seconds.
+    """
+
+    def __init__(self, min_bytes_per_second=10000, grace_seconds=60, sampler=None):
+        self.min_bytes_per_second = min_bytes_per_second
+        self.grace_seconds = grace_seconds
+        self.sampler = sampler or get_progress_sampler()
+
+    def start_transfer(self):
+        """
+        Returns a StallDetector for a new transfer.  Its finish() method
+        must be called when the transfer is done, or it can be used as
+        a context manager.
+        """
+        return StallDetector(self.min_bytes_per_second, self.grace_seconds, self.sampler)
+
+
+class StallDetector(object):
+    """
+    Watches the throughput of one transfer.  The transferring thread
+    reports bytes as they go by, and the ProgressSampler thread checks
+    the rate.  When the transfer has stalled, the detector calls the
+    abort callbacks, which can close the connection to get the
+    transferring thread unstuck, and the next report of bytes raises
+    TransferStalled.
+
+    Watching starts with start(), or else when the first bytes go by,
+    so time spent waiting to start doesn't count.  A download should
+    call start() once the headers have arrived, so that a body that
+    never sends a byte is caught too.  Time reported with
+    add_idle_time(), like waiting for a bandwidth limit, or time
+    between pause() and resume(), like waiting for a slow consumer,
+    doesn't count either.
+    """
+
+    def __init__(self, min_bytes_per_second, grace_seconds, sampler, clock=time.time):
+        self.min_bytes_per_second = min_bytes_per_second
+        self.grace_seconds = grace_seconds
+        self.sampler = sampler
+        self.clock = clock
+        self.byte_count = 0
+        self.idle_seconds = 0.0
+        self.history = None  # (active time, byte_count), about one a second
+        self.paused_at = None
+        self.stalled_error = None
+        self.abort_callbacks = []
+
+    def add_abort_callback(self, callback):
+        self.abort_callbacks.append(callback)
+
+    def start(self):
+        """
+        Starts watching, if the first bytes haven't already.
+        """
+        if self.history is None:
+            self.history = collections.deque([(self._active_time(), self.byte_count)])
+            self.sampler.add(self)
+
+    def bytes_transferred(self, delta):
+        self.start()
+        self.byte_count += delta
+        self.raise_if_stalled()
+
+    def add_idle_time(self, seconds):
+        self.idle_seconds += seconds
+
+    def pause(self):
+        self.paused_at = self.clock()
+
+    def resume(self):
+        paused_at = self.paused_at
+        if paused_at is not None:
+            self.idle_seconds += self.clock() - paused_at
+            self.paused_at = None
+
+    def raise_if_stalled(self):
+        if self.stalled_error is not None:
+            raise self.stalled_error
+
+    def is_stalled(self):
+        return self.stalled_error is not None
+
+    def sample(self):
+        if self.stalled_error is not None or self.history is None:
+            return
+        now = self._active_time()
+        byte_count = self.byte_count
+        history = self.history
+        if history[-1][0] + 1 <= now:
+            history.append((now, byte_count))
+        # keep the newest sample that is at least grace_seconds old
+        while 2 <= len(history) and history[1][0] <= now - self.grace_seconds:
+            history.popleft()
+        (then, then_byte_count) = history[0]
+        if self.grace_seconds <= now - then:
+            rate = (byte_count - then_byte_count) / (now - then)
+            if rate < self.min_bytes_per_second:
+                self.stalled_error = TransferStalled(rate, now - then)
+                for callback in self.abort_callbacks:
+                    callback()
+
+    def finish(self):
+        self.sampler.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finish()
+
+    def _active_time(self):
+        paused_at = self.paused_at
+        if paused_at is not None:
+            return paused_at - self.idle_seconds
+        return self.clock() - self.idle_seconds
+
+
 class RangeOfInputStream(object):
     """
     Wraps a file-like object (read only) and reads the selected
@@ -157,6 +389,10 @@ class RangeOfInputStream(object):
         self.offset = offset
         self.remaining = length
 
+        # Streams over memory-mapped files can tell the OS what is coming
+        if hasattr(stream, 'advise_range'):
+            stream.advise_range(offset, length)
+
     def __enter__(self):
         self.stream.__enter__()
         return self
@@ -183,12 +419,16 @@ class StreamWithProgress(object):
     as data is read and written.
     """
 
-    def __init__(self, stream, progress_listener, offset=0):
+    def __init__(self, stream, progress_listener, offset=0, throttle=None, stall_detector=None):
         """
 
         :param stream: the stream to read from or write to
         :param progress_listener: the listener that we tell about progress
         :param offset: the starting byte offset in the file
+        :param throttle: optional function called with the size of each
+                         read or write, which waits if bandwidth is limited,
+                         and returns the number of seconds it waited
+        :param stall_detector: optional StallDetector watching the transfer
         :return: None
         """
         assert progress_listener is not None
@@ -196,6 +436,8 @@ class StreamWithProgress(object):
         self.progress_listener = progress_listener
         self.bytes_completed = 0
         self.offset = offset
+        self.throttle = throttle
+        self.stall_detector = stall_detector
 
     def __enter__(self):
         return self
@@ -217,5 +459,11 @@ class StreamWithProgress(object):
         self._update(len(data))
 
     def _update(self, delta):
+        if self.throttle is not None:
+            waited = self.throttle(delta)
+            if self.stall_detector is not None:
+                self.stall_detector.add_idle_time(waited)
+        if self.stall_detector is not None:
+            self.stall_detector.bytes_transferred(delta)
         self.bytes_completed += delta
         self.progress_listener.bytes_completed(self.bytes_completed + self.offset)
@@ -0,0 +1,241 @@
+######################################################################
+#
+# File: b2/random_access_file.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import collections
+import io
+import threading
+
+import six
+
+from .exception import B2Error
+
+try:
+    import concurrent.futures as futures
+except:
+    import futures
+
+
+class B2RandomAccessFile(io.RawIOBase):
+    """
+    A read-only, seekable file object for a file in B2, which fetches
+    just the parts that are read, with ranged downloads.
+
+    The file is read in blocks of block_size bytes, and the most
+    recently used max_cached_blocks of them are kept, so reading
+    nearby again doesn't go back to the service.  A read that needs
+    several blocks gets all of the missing ones in one request.
+
+    When reads follow one another through the file, the next
+    readahead_blocks blocks are fetched in the background, in
+    parallel, before they are asked for.  Reads that jump around
+    don't cause any readahead.
+
+    The size comes from B2Api.get_file_version_info(), which doesn't
+    call the service when the file was listed, uploaded or looked up
+    before; pass it in if it is known some other way.  After that,
+    reading the last few KB of a huge file is one request.
+
+    Reading is not thread safe, like other file objects.
+    """
+
+    DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+    def __init__(
+        self,
+        api,
+        file_id,
+        size=None,
+        block_size=DEFAULT_BLOCK_SIZE,
+        max_cached_blocks=64,
+        readahead_blocks=4
+    ):
+        io.RawIOBase.__init__(self)
+        self.api = api
+        self.file_id = file_id
+        if size is None:
+            size = api.get_file_version_info(file_id).size
+        self.size = size
+        self.block_size = block_size
+        # Room for the blocks being read ahead, too.
+        self.max_cached_blocks = max(max_cached_blocks, readahead_blocks + 1)
+        self.readahead_blocks = readahead_blocks
+        self.position = 0
+        self.last_block_read = None
+        self.blocks = collections.OrderedDict()  # block number to bytes, least recently used first
+        self.pending = {}  # block number to the future that is fetching it
+        self.lock = threading.Lock()
+        self.executor = None
+        if 0 < readahead_blocks:
+            self.executor = futures.ThreadPoolExecutor(max_workers=readahead_blocks)
+        self.request_count = 0
+        self.bytes_fetched = 0
+        self.block_hit_count = 0
+        self.block_miss_count = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError('invalid whence: %r' % (whence,))
+        if position < 0:
+            raise ValueError('negative seek position %d' % (position,))
+        self.position = position
+        return position
+
+    def readinto(self, buffer):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        count = min(len(buffer), self.size - self.position)
+        if count <= 0:
+            return 0
+        buffer[:count] = self._read(self.position, count)
+        self.position += count
+        return count
+
+    def readall(self):
+        return self.read(max(0, self.size - self.position))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        with self.lock:
+            self.blocks.clear()
+        io.RawIOBase.close(self)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(
+                requests=self.request_count,
+                bytes_fetched=self.bytes_fetched,
+                block_hits=self.block_hit_count,
+                block_misses=self.block_miss_count
+            )
+
+    def _read(self, offset, count):
+        first_block = offset // self.block_size
+        last_block = (offset + count - 1) // self.block_size
+        sequential = self.last_block_read is not None and \
+            self.last_block_read <= first_block <= self.last_block_read + 1
+        self.last_block_read = last_block
+        blocks = self._get_blocks(first_block, last_block)
+        if sequential:
+            self._read_ahead(last_block + 1)
+        data = six.b('').join(blocks[i] for i in six.moves.range(first_block, last_block + 1))
+        start = offset - first_block * self.block_size
+        return data[start:start + count]
+
+    def _get_blocks(self, first_block, last_block):
+        """
+        Returns a dict with the blocks from first_block through last_block.
+        """
+        result = {}
+        missing = []
+        waiting = {}
+        with self.lock:
+            for i in six.moves.range(first_block, last_block + 1):
+                if i in self.blocks:
+                    result[i] = self._use_block(i)
+                    self.block_hit_count += 1
+                elif i in self.pending:
+                    waiting[i] = self.pending[i]
+                    self.block_hit_count += 1
+                else:
+                    missing.append(i)
+                    self.block_miss_count += 1
+        for (run_first, run_last) in _runs(missing):
+            result.update(self._fetch(run_first, run_last))
+        for (i, future) in six.iteritems(waiting):
+            try:
+                result[i] = future.result()
+            except B2Error:
+                # Readahead is best effort.  Try again for real.
+                result.update(self._fetch(i, i))
+        return result
+
+    def _read_ahead(self, first_block):
+        if self.executor is None:
+            return
+        block_count = (self.size + self.block_size - 1) // self.block_size
+        last_block = min(first_block + self.readahead_blocks, block_count) - 1
+        with self.lock:
+            for i in six.moves.range(first_block, last_block + 1):
+                if i not in self.blocks and i not in self.pending:
+                    self.pending[i] = self.executor.submit(self._fetch_one, i)
+
+    def _fetch_one(self, block_number):
+        try:
+            return self._fetch(block_number, block_number)[block_number]
+        finally:
+            with self.lock:
+                self.pending.pop(block_number, None)
+
+    def _fetch(self, first_block, last_block):
+        """
+        Gets blocks first_block through last_block with one request,
+        and keeps them.
+
+        :return: a dict from block number to bytes
+        """
+        start = first_block * self.block_size
+        end = min((last_block + 1) * self.block_size, self.size) - 1
+        data = self.api.session.download_file_range_by_id(
+            self.file_id, start, end, url_factory=self.api.account_info.get_download_url
+        )
+        blocks = {}
+        for i in six.moves.range(first_block, last_block + 1):
+            offset = (i - first_block) * self.block_size
+            blocks[i] = data[offset:offset + self.block_size]
+        with self.lock:
+            self.request_count += 1
+            self.bytes_fetched += len(data)
+            for (i, block) in six.iteritems(blocks):
+                self.blocks[i] = block
+                self._use_block(i)
+            while self.max_cached_blocks < len(self.blocks):
+                self.blocks.popitem(last=False)
+        return blocks
+
+    def _use_block(self, block_number):
+        """
+        Marks a block as the most recently used, and returns it.
+        """
+        block = self.blocks.pop(block_number)
+        self.blocks[block_number] = block
+        return block
+
+
+def _runs(numbers):
+    """
+    Yields (first, last) for each run of consecutive numbers in a sorted list.
+    """
+    first = None
+    previous = None
+    for n in numbers:
+        if first is None:
+            first = n
+        elif n != previous + 1:
+            yield (first, previous)
+            first = n
+        previous = n
+    if first is not None:
+        yield (first, previous)
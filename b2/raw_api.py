@@ -21,12 +21,23 @@ from abc import (ABCMeta, abstractmethod)
 
 import six
 
-from .b2http import (B2Http)
+from .bandwidth import get_bandwidth_limiter
+from .b2http import (B2Http, shut_down_response)
 from .download_dest import DownloadDestBytes
-from .exception import (ChecksumMismatch, TruncatedOutput)
+from .download_stream import (DownloadHeaders, DownloadStream)
+from .exception import TransferStalled, TruncatedOutput
 from .utils import b2_url_encode, hex_sha1_of_stream
 
 
+def _raise_if_stalled(stall_detector):
+    """
+    Raises TransferStalled if the watchdog broke the connection of a
+    download, which ends the body early or with a connection error.
+    """
+    if stall_detector is not None:
+        stall_detector.raise_if_stalled()
+
+
 @six.add_metaclass(ABCMeta)
 class AbstractRawApi(object):
     """
@@ -109,8 +120,47 @@ class B2RawApi(AbstractRawApi):
     for B2Session magic.
     """
 
-    def __init__(self, b2_http):
+    # Tries of a download that keeps stalling, before giving up.
+    MAX_DOWNLOAD_ATTEMPTS = 5
+
+    def __init__(self, b2_http, stall_watchdog=None):
+        """
+        :param b2_http: the B2Http to make calls with
+        :param stall_watchdog: optional StallWatchdog that breaks the connection of
+                               downloads that slow to a crawl, or never start sending;
+                               they are tried again from the start
+        """
         self.b2_http = b2_http
+        self.stall_watchdog = stall_watchdog
+
+    def _watch_download(self, response):
+        """
+        Returns a StallDetector for reading the body of a download, or
+        None if there is no watchdog.  Watching starts now that the
+        headers have arrived, and the connection is broken if the body
+        stalls.
+        """
+        if self.stall_watchdog is None:
+            return None
+        stall_detector = self.stall_watchdog.start_transfer()
+        stall_detector.add_abort_callback(lambda: shut_down_response(response))
+        stall_detector.start()
+        return stall_detector
+
+    def _retry_stalled(self, operation, download):
+        """
+        Calls download(), trying again when it raises TransferStalled.
+        """
+        retry_state = self.b2_http.retry_policy.start(operation, self.MAX_DOWNLOAD_ATTEMPTS)
+        while True:
+            try:
+                result = download()
+            except TransferStalled as e:
+                if not retry_state.failed(e):
+                    raise
+            else:
+                retry_state.succeeded()
+                return result
 
     def _post_json(self, base_url, api_name, auth, **params):
         """
@@ -170,6 +220,90 @@ class B2RawApi(AbstractRawApi):
         url = download_url + '/file/' + bucket_name + '/' + b2_url_encode(file_name)
         return self._download_file_from_url(url, account_auth_token_or_none, download_dest)
 
+    def stream_file_by_id(
+        self,
+        download_url,
+        account_auth_token_or_none,
+        file_id,
+        chunk_size=DownloadStream.DEFAULT_CHUNK_SIZE
+    ):
+        url = download_url + '/b2api/v1/b2_download_file_by_id?fileId=' + file_id
+        return self._stream_file_from_url(url, account_auth_token_or_none, chunk_size)
+
+    def stream_file_by_name(
+        self,
+        download_url,
+        account_auth_token_or_none,
+        bucket_name,
+        file_name,
+        chunk_size=DownloadStream.DEFAULT_CHUNK_SIZE
+    ):
+        url = download_url + '/file/' + bucket_name + '/' + b2_url_encode(file_name)
+        return self._stream_file_from_url(url, account_auth_token_or_none, chunk_size)
+
+    def _stream_file_from_url(self, url, account_auth_token_or_none, chunk_size):
+        """
+        Starts a download and returns a DownloadStream for reading it.
+        The request is made here, so errors like a bad auth token are
+        raised here too, and not when the stream is used.
+        """
+        request_headers = {}
+        if account_auth_token_or_none is not None:
+            request_headers['Authorization'] = account_auth_token_or_none
+        response_context = self.b2_http.get_content(url, request_headers)
+        return DownloadStream(response_context, self.stall_watchdog, chunk_size)
+
+    def download_file_range_by_id(
+        self, download_url, account_auth_token_or_none, file_id, start, end
+    ):
+        """
+        Downloads part of a file.
+
+        :param start: the offset of the first byte to get
+        :param end: the offset of the last byte to get; must be in the file
+        :return: the bytes
+        """
+        url = download_url + '/b2api/v1/b2_download_file_by_id?fileId=' + file_id
+        request_headers = {'Range': 'bytes=%d-%d' % (start, end)}
+        if account_auth_token_or_none is not None:
+            request_headers['Authorization'] = account_auth_token_or_none
+        expected_length = end - start + 1
+        return self._retry_stalled(
+            'b2_download_file_by_id',
+            lambda: self._download_range_once(url, request_headers, start, expected_length)
+        )
+
+    def _download_range_once(self, url, request_headers, start, expected_length):
+        with self.b2_http.get_content(url, request_headers) as response:
+            # A server that doesn't do ranges sends the whole file.
+            skip = start if 'content-range' not in response.headers else 0
+            chunks = []
+            bytes_read = 0
+            bandwidth_limiter = get_bandwidth_limiter()
+            stall_detector = self._watch_download(response)
+            try:
+                for data in response.iter_content(chunk_size=65536):
+                    waited = bandwidth_limiter.throttle_download(len(data))
+                    if stall_detector is not None:
+                        stall_detector.add_idle_time(waited)
+                        stall_detector.bytes_transferred(len(data))
+                    chunks.append(data)
+                    bytes_read += len(data)
+                    if skip + expected_length <= bytes_read:
+                        break
+            except Exception:
+                _raise_if_stalled(stall_detector)
+                raise
+            finally:
+                if stall_detector is not None:
+                    stall_detector.finish()
+            _raise_if_stalled(stall_detector)
+
+        data = six.b('').join(chunks)[skip:skip + expected_length]
+        if len(data) != expected_length:
+            raise TruncatedOutput(len(data), expected_length)
+        return data
+
     def _download_file_from_url(self, url, account_auth_token_or_none, download_dest):
         """
         Downloads a file from given url and stores it in the given download_destination.
@@ -185,54 +319,50 @@ class B2RawApi(AbstractRawApi):
         request_headers = {}
         if account_auth_token_or_none is not None:
             request_headers['Authorization'] = account_auth_token_or_none
+        try:
+            return self._retry_stalled(
+                'b2_download_file',
+                lambda: self._download_file_once(url, request_headers, download_dest)
+            )
+        except TransferStalled:
+            download_dest.abandon()
+            raise
 
+    def _download_file_once(self, url, request_headers, download_dest):
         with self.b2_http.get_content(url, request_headers) as response:
-
-            info = response.headers
-
-            file_id = info['x-bz-file-id']
-            file_name = info['x-bz-file-name']
-            content_type = info['content-type']
-            content_length = int(info['content-length'])
-            content_sha1 = info['x-bz-content-sha1']
-            file_info = dict((k[10:], info[k]) for k in info if k.startswith('x-bz-info-'))
-
-            if 'src_last_modified_millis' in file_info:
-                mod_time_millis = int(file_info['src_last_modified_millis'])
-            else:
-                mod_time_millis = int(info['x-bz-upload-timestamp'])
+            headers = DownloadHeaders(response.headers)
 
             block_size = 4096
             digest = hashlib.sha1()
             bytes_read = 0
+            bandwidth_limiter = get_bandwidth_limiter()
 
             with download_dest.open(
-                file_id, file_name, content_length, content_type, content_sha1, file_info,
-                mod_time_millis
+                headers.file_id, headers.file_name, headers.content_length,
+                headers.content_type, headers.content_sha1, headers.file_info,
+                headers.mod_time_millis
             ) as file:
-                for data in response.iter_content(chunk_size=block_size):
-                    file.write(data)
-                    digest.update(data)
-                    bytes_read += len(data)
-
-                if bytes_read != int(info['content-length']):
-                    raise TruncatedOutput(bytes_read, content_length)
-
-                if content_sha1 != 'none' and digest.hexdigest() != content_sha1:
-                    raise ChecksumMismatch(
-                        checksum_type='sha1',
-                        expected=content_length,
-                        actual=digest.hexdigest()
-                    )
-
-            return dict(
-                fileId=file_id,
-                fileName=file_name,
-                contentType=content_type,
-                contentLength=content_length,
-                contentSha1=content_sha1,
-                fileInfo=file_info
-            )
+                stall_detector = self._watch_download(response)
+                try:
+                    for data in response.iter_content(chunk_size=block_size):
+                        waited = bandwidth_limiter.throttle_download(len(data))
+                        if stall_detector is not None:
+                            stall_detector.add_idle_time(waited)
+                            stall_detector.bytes_transferred(len(data))
+                        file.write(data)
+                        digest.update(data)
+                        bytes_read += len(data)
+                except Exception:
+                    _raise_if_stalled(stall_detector)
+                    raise
+                finally:
+                    if stall_detector is not None:
+                        stall_detector.finish()
+                _raise_if_stalled(stall_detector)
+
+                headers.check_download(bytes_read, digest)
+
+            return headers.as_download_result()
 
     def finish_large_file(self, api_url, account_auth_token, file_id, part_sha1_array):
         return self._post_json(
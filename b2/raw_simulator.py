@@ -13,9 +13,10 @@ import re
 import six
 from six.moves import range
 
+from .download_stream import DownloadStream
 from .exception import (
-    BadJson, BadUploadUrl, DuplicateBucketName, FileNotPresent, InvalidAuthToken, MissingPart,
-    NonExistentBucket
+    BadJson, BadUploadUrl, DuplicateBucketName, FileNotPresent, InvalidAuthToken, InvalidRange,
+    MissingPart, NonExistentBucket
 )
 from .raw_api import AbstractRawApi
 
@@ -82,6 +83,35 @@ class FileSimulator(object):
             uploadTimestamp=self.upload_timestamp
         )  # yapf: disable
 
+    def as_download_result(self):
+        return dict(
+            fileId=self.file_id,
+            fileName=self.name,
+            contentType=self.content_type,
+            contentLength=len(self.data_bytes),
+            contentSha1=self.content_sha1,
+            fileInfo=self.file_info,
+            uploadTimestamp=self.upload_timestamp
+        )  # yapf: disable
+
+    def as_download_headers(self):
+        headers = {
+            'x-bz-file-id': self.file_id,
+            'x-bz-file-name': self.name,
+            'content-type': self.content_type,
+            'content-length': str(len(self.data_bytes)),
+            'x-bz-content-sha1': self.content_sha1,
+            'x-bz-upload-timestamp': str(self.upload_timestamp),
+        }
+        for (key, value) in six.iteritems(self.file_info):
+            headers['x-bz-info-' + key] = value
+        return headers
+
+    def as_get_file_info_result(self):
+        result = self.as_upload_result()
+        result['action'] = self.action
+        return result
+
     def as_list_files_dict(self):
         return dict(
             fileId=self.file_id,
@@ -152,6 +182,29 @@ class FileSimulator(object):
         return 0
 
 
+class ResponseSimulator(object):
+    """
+    The parts of the response to a download that are used, for a file
+    in the simulator.  It is its own context manager, like the one
+    B2Http.get_content() returns.
+    """
+
+    def __init__(self, file_sim):
+        self.headers = file_sim.as_download_headers()
+        self.data_bytes = file_sim.data_bytes
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for offset in six.moves.range(0, len(self.data_bytes), chunk_size):
+            yield self.data_bytes[offset:offset + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.closed = True
+
+
 class BucketSimulator(object):
 
     # File IDs start at 9999 and count down, so they sort in the order
@@ -160,7 +213,11 @@ class BucketSimulator(object):
 
     FIRST_FILE_ID = str(FIRST_FILE_NUMBER)
 
-    def __init__(self, account_id, bucket_id, bucket_name, bucket_type):
+    def __init__(self, account_id, bucket_id, bucket_name, bucket_type, file_id_counter=None):
+        """
+        :param file_id_counter: where to get file ids from, when they must be
+                                different from the ones in other buckets
+        """
         assert bucket_type in ['allPrivate', 'allPublic']
         self.account_id = account_id
         self.bucket_name = bucket_name
@@ -168,7 +225,7 @@ class BucketSimulator(object):
         self.bucket_type = bucket_type
         self.upload_url_counter = iter(range(200))
         # File IDs count down, so that the most recent will come first when they are sorted.
-        self.file_id_counter = iter(range(self.FIRST_FILE_NUMBER, 0, -1))
+        self.file_id_counter = file_id_counter or iter(range(self.FIRST_FILE_NUMBER, 0, -1))
         self.upload_timestamp_counter = iter(range(5000, 9999))
         self.file_id_to_file = dict()
         # It would be nice to use an OrderedDict for this, but 2.6 doesn't have it.
@@ -203,17 +260,31 @@ class BucketSimulator(object):
 
     def download_file_by_id(self, file_id, download_dest):
         file_sim = self.file_id_to_file[file_id]
-        self._download_file_sim(download_dest, file_sim)
+        return self._download_file_sim(download_dest, file_sim)
+
+    def download_file_range_by_id(self, file_id, start, end):
+        file_sim = self.file_id_to_file[file_id]
+        if not (0 <= start <= end < len(file_sim.data_bytes)):
+            raise InvalidRange('%d-%d of %d bytes' % (start, end, len(file_sim.data_bytes)))
+        return file_sim.data_bytes[start:end + 1]
 
     def download_file_by_name(self, file_name, download_dest):
+        return self._download_file_sim(download_dest, self._get_visible_file_sim(file_name))
+
+    def stream_file_by_id(self, file_id):
+        return ResponseSimulator(self.file_id_to_file[file_id])
+
+    def stream_file_by_name(self, file_name):
+        return ResponseSimulator(self._get_visible_file_sim(file_name))
+
+    def _get_visible_file_sim(self, file_name):
         files = self.list_file_names(file_name, 1)['files']
         if len(files) == 0:
             raise FileNotPresent(file_name)
         file_dict = files[0]
         if file_dict['fileName'] != file_name or file_dict['action'] != 'upload':
             raise FileNotPresent(file_name)
-        file_sim = self.file_name_and_id_to_file[(file_name, file_dict['fileId'])]
-        self._download_file_sim(download_dest, file_sim)
+        return self.file_name_and_id_to_file[(file_name, file_dict['fileId'])]
 
     def _download_file_sim(self, download_dest, file_sim):
         with download_dest.open(
@@ -221,12 +292,16 @@ class BucketSimulator(object):
             file_sim.content_sha1, file_sim.file_info, file_sim.mod_time_millis()
         ) as f:
             f.write(file_sim.data_bytes)
+        return file_sim.as_download_result()
 
     def finish_large_file(self, file_id, part_sha1_array):
         file_sim = self.file_id_to_file[file_id]
         file_sim.finish(part_sha1_array)
         return file_sim.as_upload_result()
 
+    def get_file_info(self, file_id):
+        return self.file_id_to_file[file_id].as_get_file_info_result()
+
     def get_upload_url(self):
         upload_id = six.next(self.upload_url_counter)
         upload_url = 'https://upload.example.com/%s/%s' % (self.bucket_id, upload_id)
@@ -244,7 +319,7 @@ class BucketSimulator(object):
         )
         self.file_id_to_file[file_id] = file_sim
         self.file_name_and_id_to_file[file_sim.sort_key()] = file_sim
-        return file_sim.as_upload_result()
+        return file_sim.as_list_files_dict()
 
     def list_file_names(self, start_file_name=None, max_file_count=None):
         start_file_name = start_file_name or ''
@@ -333,7 +408,8 @@ class BucketSimulator(object):
         self, upload_id, upload_auth_token, file_name, content_length, content_type, content_sha1,
         file_infos, data_stream
     ):
-        data_bytes = data_stream.read()
+        # Copy the data, which may be a memoryview that the uploader releases
+        data_bytes = memoryview(data_stream.read()).tobytes()
         assert len(data_bytes) == content_length
         file_id = self._next_file_id()
         file_sim = FileSimulator(
@@ -346,7 +422,7 @@ class BucketSimulator(object):
 
     def upload_part(self, file_id, part_number, content_length, sha1_sum, input_stream):
         file_sim = self.file_id_to_file[file_id]
-        part_data = input_stream.read(content_length)
+        part_data = memoryview(input_stream.read(content_length)).tobytes()
         assert len(part_data) == content_length
         part = PartSimulator(file_sim.file_id, part_number, content_length, sha1_sum, part_data)
         file_sim.add_part(part_number, part)
@@ -380,6 +456,8 @@ class RawSimulator(AbstractRawApi):
         self.bucket_name_to_bucket = dict()
         self.bucket_id_to_bucket = dict()
         self.bucket_id_counter = iter(range(100))
+        # File ids are unique across buckets, as they are in B2.
+        self.file_id_counter = iter(range(BucketSimulator.FIRST_FILE_NUMBER, 0, -1))
         self.file_id_to_bucket_id = {}
         self.upload_errors = []
 
@@ -420,7 +498,9 @@ class RawSimulator(AbstractRawApi):
         if bucket_name in self.bucket_name_to_bucket:
             raise DuplicateBucketName(bucket_name)
         bucket_id = 'bucket_' + str(six.next(self.bucket_id_counter))
-        bucket = BucketSimulator(account_id, bucket_id, bucket_name, bucket_type)
+        bucket = BucketSimulator(
+            account_id, bucket_id, bucket_name, bucket_type, self.file_id_counter
+        )
         self.bucket_name_to_bucket[bucket_name] = bucket
         self.bucket_id_to_bucket[bucket_id] = bucket
         return bucket.bucket_dict()
@@ -442,7 +522,14 @@ class RawSimulator(AbstractRawApi):
         # TODO: check auth token if bucket is not public
         bucket_id = self.file_id_to_bucket_id[file_id]
         bucket = self._get_bucket_by_id(bucket_id)
-        bucket.download_file_by_id(file_id, download_dest)
+        return bucket.download_file_by_id(file_id, download_dest)
+
+    def download_file_range_by_id(
+        self, download_url, account_auth_token_or_none, file_id, start, end
+    ):
+        bucket_id = self.file_id_to_bucket_id[file_id]
+        bucket = self._get_bucket_by_id(bucket_id)
+        return bucket.download_file_range_by_id(file_id, start, end)
 
     def download_file_by_name(
         self, download_url, account_auth_token_or_none, bucket_name, file_name, download_dest
@@ -450,7 +537,30 @@ class RawSimulator(AbstractRawApi):
         assert download_url == self.DOWNLOAD_URL
         # TODO: check auth token if bucket is not public
         bucket = self._get_bucket_by_name(bucket_name)
-        bucket.download_file_by_name(file_name, download_dest)
+        return bucket.download_file_by_name(file_name, download_dest)
+
+    def stream_file_by_id(
+        self,
+        download_url,
+        account_auth_token_or_none,
+        file_id,
+        chunk_size=DownloadStream.DEFAULT_CHUNK_SIZE
+    ):
+        bucket_id = self.file_id_to_bucket_id[file_id]
+        bucket = self._get_bucket_by_id(bucket_id)
+        return DownloadStream(bucket.stream_file_by_id(file_id), chunk_size=chunk_size)
+
+    def stream_file_by_name(
+        self,
+        download_url,
+        account_auth_token_or_none,
+        bucket_name,
+        file_name,
+        chunk_size=DownloadStream.DEFAULT_CHUNK_SIZE
+    ):
+        assert download_url == self.DOWNLOAD_URL
+        bucket = self._get_bucket_by_name(bucket_name)
+        return DownloadStream(bucket.stream_file_by_name(file_name), chunk_size=chunk_size)
 
     def finish_large_file(self, api_url, account_auth_token, file_id, part_sha1_array):
         bucket_id = self.file_id_to_bucket_id[file_id]
@@ -458,6 +568,12 @@ class RawSimulator(AbstractRawApi):
         self._assert_account_auth(api_url, account_auth_token, bucket.account_id)
         return bucket.finish_large_file(file_id, part_sha1_array)
 
+    def get_file_info(self, api_url, account_auth_token, file_id):
+        bucket_id = self.file_id_to_bucket_id[file_id]
+        bucket = self._get_bucket_by_id(bucket_id)
+        self._assert_account_auth(api_url, account_auth_token, bucket.account_id)
+        return bucket.get_file_info(file_id)
+
     def get_upload_url(self, api_url, account_auth_token, bucket_id):
         bucket = self._get_bucket_by_id(bucket_id)
         self._assert_account_auth(api_url, account_auth_token, bucket.account_id)
@@ -0,0 +1,286 @@
+######################################################################
+#
+# File: b2/retry.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+from __future__ import division
+
+import calendar
+import email.utils
+import random
+import threading
+import time
+
+import six
+
+from .utils import sleep_unless_shutting_down
+
+
+def parse_retry_after(value):
+    """
+    Parses the value of a Retry-After header, which is either a
+    number of seconds or an HTTP date.
+
+    :return: seconds to wait, or None if there is no usable value
+    """
+    if not isinstance(value, six.string_types):
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    parsed = email.utils.parsedate(value)
+    if parsed is None:
+        return None
+    return max(0, calendar.timegm(parsed) - time.time())
+
+
+class RetryAttempt(object):
+    """
+    The record of one try of an operation.
+    """
+
+    def __init__(self, operation, attempt_number, error, delay):
+        """
+        :param operation: the name of the operation, like 'b2_list_file_names'
+        :param attempt_number: 1 for the first try, 2 for the second, ...
+        :param error: the exception the try raised, or None if it worked
+        :param delay: seconds waited before the next try, or None if there isn't one
+        """
+        self.operation = operation
+        self.attempt_number = attempt_number
+        self.error = error
+        self.delay = delay
+
+    def __repr__(self):
+        return 'RetryAttempt(%r, %d, %r, %r)' % (
+            self.operation, self.attempt_number, self.error, self.delay
+        )
+
+
+class RetryBudget(object):
+    """
+    Limits retries across all operations, so that when everything
+    is failing the retries don't multiply the load on the service.
+
+    This is the retry throttling scheme from gRPC: each retry takes a
+    token, and each success puts back token_ratio of one.  Retries are
+    allowed while more than half of the tokens would be left.  Only
+    retries that are about to happen take a token, and a call that
+    works after retrying gives back the tokens it took, so the budget
+    shrinks only while retries keep failing.  A steady background
+    rate of errors that one retry fixes never uses it up.
+
+    The number of tokens should grow with the number of calls in
+    progress at once; see set_max_tokens().
+
+    This class is THREAD SAFE.
+    """
+
+    DEFAULT_MAX_TOKENS = 100
+
+    # Tokens for each call that can be in progress at once.
+    TOKENS_PER_WORKER = 10
+
+    def __init__(self, max_tokens=DEFAULT_MAX_TOKENS, token_ratio=0.1):
+        self.max_tokens = max_tokens
+        self.token_ratio = token_ratio
+        self.tokens = float(max_tokens)
+        self.lock = threading.Lock()
+
+    def set_max_tokens(self, max_tokens):
+        """
+        Changes the size of the budget, keeping the fraction of it that is left.
+        """
+        with self.lock:
+            self.tokens = self.tokens * max_tokens / self.max_tokens
+            self.max_tokens = max_tokens
+
+    def record_success(self, tokens_taken=0):
+        """
+        :param tokens_taken: the tokens the retries of the call that worked took
+        """
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.token_ratio + tokens_taken)
+
+    def take_retry_token(self):
+        """
+        Takes a token for a retry, if the budget allows one.
+
+        :return: True if a retry is allowed
+        """
+        with self.lock:
+            if self.tokens - 1 <= self.max_tokens / 2:
+                return False
+            self.tokens -= 1
+            return True
+
+    def get_token_ratio_left(self):
+        with self.lock:
+            return self.tokens / self.max_tokens
+
+
+class RetryPolicy(object):
+    """
+    Decides whether to try an operation again after it fails, and
+    how long to wait first.
+
+    Delays use "decorrelated jitter": each one is chosen at random
+    between base_delay and three times the previous delay, up to
+    max_delay.  Threads that fail at the same moment then come back
+    at different times, instead of all hitting the service together
+    again.  If the service sends a Retry-After header, the delay is
+    at least that long.
+
+    Retries are limited by the number of tries the caller allows,
+    by error_budgets, which maps exception classes to the most tries
+    allowed after errors of that class, and by the RetryBudget that
+    all operations share.
+
+    Every try is recorded in the stats, and passed to the
+    attempt_listener, if there is one.
+
+    Waits end early, with KeyboardInterrupt, when the app starts
+    shutting down.
+
+    This class is THREAD SAFE.
+    """
+
+    def __init__(
+        self,
+        base_delay=1.0,
+        max_delay=60.0,
+        error_budgets=None,
+        retry_budget=None,
+        attempt_listener=None,
+        random_uniform=random.uniform,
+        sleep=sleep_unless_shutting_down
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.error_budgets = error_budgets or {}
+        self.retry_budget = retry_budget or RetryBudget()
+        self.attempt_listener = attempt_listener
+        self.random_uniform = random_uniform
+        self.sleep = sleep
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def start(self, operation, max_attempts, max_delay=None):
+        """
+        Returns a RetryState to track the tries of one call.
+
+        :param max_delay: a lower cap on the wait between tries for this
+                          call, for operations where retrying soon is
+                          what fixes the problem.  A Retry-After from the
+                          service still wins.
+        """
+        return RetryState(self, operation, max_attempts, max_delay)
+
+    def get_stats(self):
+        """
+        Returns a dict from operation name to a dict from outcome to
+        count, where the outcome is 'ok' or the name of an exception class.
+        """
+        with self.lock:
+            return dict((op, dict(counts)) for (op, counts) in six.iteritems(self.stats))
+
+    def _next_delay(self, previous_delay, error, max_delay=None):
+        if max_delay is None or self.max_delay < max_delay:
+            max_delay = self.max_delay
+        base_delay = min(self.base_delay, max_delay)
+        previous_delay = max(previous_delay, base_delay)
+        delay = min(max_delay, self.random_uniform(base_delay, previous_delay * 3))
+        retry_after = getattr(error, 'retry_after_seconds', None)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _error_budget(self, error):
+        for cls in type(error).__mro__:
+            if cls in self.error_budgets:
+                return self.error_budgets[cls]
+        return None
+
+    def _record(self, attempt):
+        outcome = 'ok' if attempt.error is None else type(attempt.error).__name__
+        with self.lock:
+            counts = self.stats.setdefault(attempt.operation, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+        if self.attempt_listener is not None:
+            self.attempt_listener(attempt)
+
+
+class RetryState(object):
+    """
+    Tracks the tries of one call to an operation.  Use like this:
+
+        retry_state = policy.start('upload_file', 5)
+        while True:
+            try:
+                result = do_it()
+                retry_state.succeeded()
+                return result
+            except B2Error as e:
+                if not retry_state.failed(e, e.should_retry_upload()):
+                    raise
+
+    Not thread safe; each call gets its own.
+    """
+
+    def __init__(self, policy, operation, max_attempts, max_delay=None):
+        self.policy = policy
+        self.operation = operation
+        self.max_attempts = max_attempts
+        self.max_delay = max_delay
+        self.attempt_count = 0
+        self.previous_delay = 0
+        self.attempts = []
+        self.tokens_taken = 0
+
+    def succeeded(self):
+        self.attempt_count += 1
+        self.policy.retry_budget.record_success(self.tokens_taken)
+        self.tokens_taken = 0
+        self._record(None, None)
+
+    def failed(self, error, can_retry=True):
+        """
+        Records a failed try, and decides whether to try again.  If so,
+        waits before returning.
+
+        :param error: the exception raised
+        :param can_retry: False if the error is one that retrying won't fix
+        :return: True if the caller should try again
+        """
+        self.attempt_count += 1
+        retry = can_retry and self.attempt_count < self.max_attempts
+        if retry:
+            error_budget = self.policy._error_budget(error)
+            if error_budget is not None:
+                error_count = sum(1 for a in self.attempts if isinstance(a.error, type(error)))
+                retry = error_count + 1 < error_budget
+        if retry:
+            # Only a retry that will happen takes from the shared budget, so
+            # a layer that isn't going to retry doesn't charge for the layer
+            # above it that will.
+            retry = self.policy.retry_budget.take_retry_token()
+            if retry:
+                self.tokens_taken += 1
+        if not retry:
+            self._record(error, None)
+            return False
+        delay = self.policy._next_delay(self.previous_delay, error, self.max_delay)
+        self.previous_delay = delay
+        self._record(error, delay)
+        self.policy.sleep(delay)
+        return True
+
+    def _record(self, error, delay):
+        attempt = RetryAttempt(self.operation, self.attempt_count, error, delay)
+        self.attempts.append(attempt)
+        self.policy._record(attempt)
@@ -9,19 +9,55 @@
 ######################################################################
 
 import functools
+import threading
+import time
 
-from .exception import (InvalidAuthToken)
+from .exception import (B2Error, InvalidAuthToken, MissingAccountData)
 
 
 class B2Session(object):
     """
         Facade that supplies the correct api_url and account_auth_token to methods
         of underlying raw_api and reauthorizes if necessary
+
+        When the auth token expires, every call in progress fails at
+        about the same time.  Only one of them authorizes again; the
+        others wait for it, and then use the new token.
+
+        If refresh_after_seconds is set, the token is replaced before
+        a call once it is that old, so that long jobs don't have calls
+        fail when it expires.  The age of a token that was stored by
+        an earlier run isn't known, so it is replaced before the first
+        call.
     """
 
-    def __init__(self, api, raw_api):
+    # Auth tokens last 24 hours.  This leaves time to spare.
+    DEFAULT_REFRESH_AFTER_SECONDS = 23 * 3600
+
+    # When refreshing early fails, how long to keep using the old token
+    # before trying again.
+    REFRESH_RETRY_SECONDS = 60
+
+    def __init__(self, api, raw_api, refresh_after_seconds=None, clock=time.time):
         self._api = api  # for reauthorization
         self.raw_api = raw_api
+        self.refresh_after_seconds = refresh_after_seconds
+        self._clock = clock
+        self._auth_lock = threading.Lock()
+        self._refresh_time = None  # when to replace the token; None means before the next call
+        self.reauthorization_count = 0
+
+    def set_refresh_after_seconds(self, refresh_after_seconds):
+        with self._auth_lock:
+            self.refresh_after_seconds = refresh_after_seconds
+            self._refresh_time = None
+
+    def auth_token_changed(self):
+        """
+        Called when the account has just been authorized.
+        """
+        if self.refresh_after_seconds is not None:
+            self._refresh_time = self._clock() + self.refresh_after_seconds
 
     def __getattr__(self, name):
         f = getattr(self.raw_api, name)
@@ -32,6 +68,7 @@ class B2Session(object):
             # download_by_name uses different URLs
             url_factory = kwargs.pop('url_factory', self._api.account_info.get_api_url)
             while 1:
+                self._refresh_if_due()
                 api_url = url_factory()
                 account_auth_token = self._api.account_info.get_account_auth_token()
                 try:
@@ -39,7 +76,7 @@ class B2Session(object):
                 except InvalidAuthToken:
                     if not auth_failure_encountered:
                         auth_failure_encountered = True
-                        reauthorization_success = self._api.authorize_automatically()
+                        reauthorization_success = self._reauthorize(account_auth_token)
                         if reauthorization_success:
                             continue
                         # TODO: exception chaining could be added here
@@ -47,3 +84,43 @@ class B2Session(object):
                     raise
 
         return wrapper
+
+    def _reauthorize(self, failed_auth_token):
+        """
+        Gets a new token to replace one that failed, unless another
+        thread already has.
+
+        :return: True if there is a new token to try
+        """
+        with self._auth_lock:
+            try:
+                current_auth_token = self._api.account_info.get_account_auth_token()
+            except MissingAccountData:
+                current_auth_token = None
+            if current_auth_token is not None and current_auth_token != failed_auth_token:
+                return True
+            return self._authorize()
+
+    def _refresh_if_due(self):
+        if self.refresh_after_seconds is None or self._is_fresh():
+            return
+        with self._auth_lock:
+            if self.refresh_after_seconds is None or self._is_fresh():
+                return  # another thread just did it
+            try:
+                if not self._authorize():
+                    # Nothing stored to authorize with.  The call will say so.
+                    self._refresh_time = self._clock() + self.refresh_after_seconds
+            except B2Error:
+                # The old token is probably still good.
+                self._refresh_time = self._clock() + self.REFRESH_RETRY_SECONDS
+
+    def _is_fresh(self):
+        refresh_time = self._refresh_time
+        return refresh_time is not None and self._clock() < refresh_time
+
+    def _authorize(self):
+        success = self._api.authorize_automatically()
+        if success:
+            self.reauthorization_count += 1
+        return success
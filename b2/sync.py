@@ -10,7 +10,9 @@
 
 from __future__ import division
 
+import collections
 import os
+import sys
 import threading
 import time
 from abc import (ABCMeta, abstractmethod)
@@ -19,8 +21,9 @@ import six
 
 from .download_dest import DownloadDestLocalFile
 from .exception import CommandError, DestFileNewer
-from .progress import AbstractProgressListener
-from .upload_source import UploadSourceLocalFile
+from .fan_out import upload_to_buckets
+from .progress import AbstractProgressListener, get_progress_sampler
+from .upload_source import UploadSourceB2File, UploadSourceLocalFile
 from .utils import format_and_scale_number, format_and_scale_fraction, raise_if_shutting_down
 
 try:
@@ -43,34 +46,74 @@ class SyncReport(object):
        - Step 2/2: compare file lists
        - Step 3/3: transfer files
 
+    Syncs can have tens of millions of files, so the calls made for each
+    file don't lock or write anything.  Counts are kept per thread, and
+    completion lines are queued.  The ProgressSampler thread prints the
+    queued lines in blocks and redraws the progress bar.  A thread that
+    finds a full block of lines waiting prints them itself.
+
+    With a log_file, completion lines go there instead of to stdout.
+    With summary_only, there are no completion lines or progress bars,
+    just a line with totals and rates at the end.  Errors are always
+    printed to stdout.
+
     This class is THREAD SAFE so that it can be used from parallel sync threads.
     """
 
     # Minimum time between displayed updates
     UPDATE_INTERVAL = 0.1
 
-    def __init__(self, stdout, no_progress):
+    # Number of queued lines that makes the thread queuing them print them.
+    FLUSH_LINE_COUNT = 1000
+
+    # Indexes into the per-thread lists of counts
+    LOCAL, COMPARE, TRANSFER_FILES, TRANSFER_BYTES = range(4)
+
+    def __init__(self, stdout, no_progress, log_file=None, summary_only=False, sampler=None):
         self.stdout = stdout
-        self.no_progress = no_progress
+        self.no_progress = no_progress or summary_only
+        self.log_file = log_file
+        self.summary_only = summary_only
         self.start_time = time.time()
-        self.local_file_count = 0
         self.local_done = False
         self.compare_done = False
-        self.compare_count = 0
         self.total_transfer_files = 0  # set in end_compare()
         self.total_transfer_bytes = 0  # set in end_compare()
-        self.transfer_files = 0
-        self.transfer_bytes = 0
         self.current_line = ''
-        self._last_update_time = 0
         self.closed = False
-        self.lock = threading.Lock()
-        self._update_progress()
+        self.lock = threading.Lock()  # held while writing output
+        self._thread_local = threading.local()
+        self._thread_counts = []
+        self._thread_counts_lock = threading.Lock()
+        self._stdout_lines = collections.deque()
+        self._log_lines = collections.deque()
+        self._sampler = sampler or get_progress_sampler()
+        self._sampler.add(self)
+
+    @property
+    def local_file_count(self):
+        return self._total(self.LOCAL)
+
+    @property
+    def compare_count(self):
+        return self._total(self.COMPARE)
+
+    @property
+    def transfer_files(self):
+        return self._total(self.TRANSFER_FILES)
+
+    @property
+    def transfer_bytes(self):
+        return self._total(self.TRANSFER_BYTES)
 
     def close(self):
+        self._sampler.remove(self)
         with self.lock:
+            self._flush_lines()
             if not self.no_progress:
                 self._print_line('', False)
+            if self.summary_only:
+                self._print_line(self._summary(), True)
             self.closed = True
 
     def __enter__(self):
@@ -80,54 +123,108 @@ class SyncReport(object):
         self.close()
 
     def error(self, message):
-        self.print_completion(message)
+        self._stdout_lines.append(message)
+        if self.log_file is not None:
+            self._log_lines.append(message)
+        self._flush_if_full()
 
     def print_completion(self, message):
         """
-        Removes the progress bar, prints a message, and puts the progress
-        bar back.
+        Queues a message to print.  The progress bar is taken down while
+        the message is printed, and put back afterwards.
+        """
+        raise_if_shutting_down()
+        if self.log_file is not None:
+            self._log_lines.append(message)
+        elif not self.summary_only:
+            self._stdout_lines.append(message)
+        self._flush_if_full()
+
+    def sample(self):
+        """
+        Called periodically by the ProgressSampler.
         """
         with self.lock:
             if not self.closed:
-                self._print_line(message, True)
-                self._last_update_time = 0
+                self._flush_lines()
                 self._update_progress()
 
+    def _flush_if_full(self):
+        if self.FLUSH_LINE_COUNT <= max(len(self._stdout_lines), len(self._log_lines)):
+            with self.lock:
+                if not self.closed:
+                    self._flush_lines()
+
+    def _flush_lines(self):
+        """
+        Prints all of the queued lines.  Must be called with the lock held.
+        """
+        lines = self._pop_all(self._stdout_lines)
+        if lines:
+            self._print_line(lines[0], True)
+            for line in lines[1:]:
+                self.stdout.write(line + '\n')
+            self.stdout.flush()
+        lines = self._pop_all(self._log_lines)
+        if lines:
+            self.log_file.write(''.join(line + '\n' for line in lines))
+            self.log_file.flush()
+
+    def _pop_all(self, lines):
+        result = []
+        while True:
+            try:
+                result.append(lines.popleft())
+            except IndexError:
+                return result
+
+    def _summary(self):
+        time_delta = time.time() - self.start_time
+        rate = 0 if time_delta == 0 else int(self.transfer_bytes / time_delta)
+        file_rate = 0 if time_delta == 0 else self.compare_count / time_delta
+        return 'compared: %d files   updated: %d files   %s   %.1f s   %s   %.1f files/s' % (
+            self.compare_count,
+            self.transfer_files,
+            format_and_scale_number(self.transfer_bytes, 'B'),
+            time_delta,
+            format_and_scale_number(rate, 'B/s'),
+            file_rate
+        )  # yapf: disable
+
     def _update_progress(self):
-        raise_if_shutting_down()
         if not self.closed and not self.no_progress:
-            now = time.time()
-            interval = now - self._last_update_time
-            if self.UPDATE_INTERVAL <= interval:
-                self._last_update_time = now
-                time_delta = time.time() - self.start_time
-                rate = 0 if time_delta == 0 else int(self.transfer_bytes / time_delta)
-                if not self.local_done:
-                    message = ' count: %d files   compare: %d files   updated: %d files   %s   %s' % (
-                        self.local_file_count,
-                        self.compare_count,
-                        self.transfer_files,
-                        format_and_scale_number(self.transfer_bytes, 'B'),
-                        format_and_scale_number(rate, 'B/s')
-                    )  # yapf: disable
-                elif not self.compare_done:
-                    message = ' compare: %d/%d files   updated: %d files   %s   %s' % (
-                        self.compare_count,
-                        self.local_file_count,
-                        self.transfer_files,
-                        format_and_scale_number(self.transfer_bytes, 'B'),
-                        format_and_scale_number(rate, 'B/s')
-                    )  # yapf: disable
-                else:
-                    message = ' compare: %d/%d files   updated: %d/%d files   %s   %s' % (
-                        self.compare_count,
-                        self.local_file_count,
-                        self.transfer_files,
-                        self.total_transfer_files,
-                        format_and_scale_fraction(self.transfer_bytes, self.total_transfer_bytes, 'B'),
-                        format_and_scale_number(rate, 'B/s')
-                    )  # yapf: disable
-                self._print_line(message, False)
+            time_delta = time.time() - self.start_time
+            local_file_count = self.local_file_count
+            compare_count = self.compare_count
+            transfer_files = self.transfer_files
+            transfer_bytes = self.transfer_bytes
+            rate = 0 if time_delta == 0 else int(transfer_bytes / time_delta)
+            if not self.local_done:
+                message = ' count: %d files   compare: %d files   updated: %d files   %s   %s' % (
+                    local_file_count,
+                    compare_count,
+                    transfer_files,
+                    format_and_scale_number(transfer_bytes, 'B'),
+                    format_and_scale_number(rate, 'B/s')
+                )  # yapf: disable
+            elif not self.compare_done:
+                message = ' compare: %d/%d files   updated: %d files   %s   %s' % (
+                    compare_count,
+                    local_file_count,
+                    transfer_files,
+                    format_and_scale_number(transfer_bytes, 'B'),
+                    format_and_scale_number(rate, 'B/s')
+                )  # yapf: disable
+            else:
+                message = ' compare: %d/%d files   updated: %d/%d files   %s   %s' % (
+                    compare_count,
+                    local_file_count,
+                    transfer_files,
+                    self.total_transfer_files,
+                    format_and_scale_fraction(transfer_bytes, self.total_transfer_bytes, 'B'),
+                    format_and_scale_number(rate, 'B/s')
+                )  # yapf: disable
+            self._print_line(message, False)
 
     def _print_line(self, line, newline):
         """
@@ -147,42 +244,52 @@ class SyncReport(object):
             self.current_line = line
         self.stdout.flush()
 
+    def _counts(self):
+        """
+        Returns the list of counts for the current thread, which only
+        this thread changes.
+        """
+        counts = getattr(self._thread_local, 'counts', None)
+        if counts is None:
+            counts = [0, 0, 0, 0]
+            self._thread_local.counts = counts
+            with self._thread_counts_lock:
+                self._thread_counts.append(counts)
+        return counts
+
+    def _total(self, index):
+        with self._thread_counts_lock:
+            all_counts = list(self._thread_counts)
+        return sum(counts[index] for counts in all_counts)
+
     def update_local(self, delta):
         """
         Reports that more local files have been found.
         """
-        with self.lock:
-            self.local_file_count += delta
-            self._update_progress()
+        self._counts()[self.LOCAL] += delta
 
     def end_local(self):
         """
         Local file count is done.  Can proceed to step 2.
         """
-        with self.lock:
-            self.local_done = True
-            self._update_progress()
+        self.local_done = True
 
     def update_compare(self, delta):
         """
         Reports that more files have been compared.
         """
-        with self.lock:
-            self.compare_count += delta
-            self._update_progress()
+        self._counts()[self.COMPARE] += delta
 
     def end_compare(self, total_transfer_files, total_transfer_bytes):
-        with self.lock:
-            self.compare_done = True
-            self.total_transfer_files = total_transfer_files
-            self.total_transfer_bytes = total_transfer_bytes
-            self._update_progress()
+        self.total_transfer_files = total_transfer_files
+        self.total_transfer_bytes = total_transfer_bytes
+        self.compare_done = True
 
     def update_transfer(self, file_delta, byte_delta):
-        with self.lock:
-            self.transfer_files += file_delta
-            self.transfer_bytes += byte_delta
-            self._update_progress()
+        raise_if_shutting_down()
+        counts = self._counts()
+        counts[self.TRANSFER_FILES] += file_delta
+        counts[self.TRANSFER_BYTES] += byte_delta
 
 
 class SyncFileReporter(AbstractProgressListener):
@@ -207,7 +314,7 @@ class SyncFileReporter(AbstractProgressListener):
 
 
 def sample_sync_report_run():
-    sync_report = SyncReport()
+    sync_report = SyncReport(sys.stdout, False)
 
     for i in six.moves.range(20):
         sync_report.update_local(1)
@@ -226,6 +333,7 @@ def sample_sync_report_run():
         if i == 4:
             sync_report.update_transfer(25, 25000)
     sync_report.end_compare(50, 50000)
+    sync_report.close()
 
     for i in six.moves.range(25):
         if i % 2 == 0:
@@ -295,6 +403,85 @@ class B2UploadAction(AbstractAction):
         )
 
 
+class B2FanOutUploadAction(AbstractAction):
+    """
+    Uploads a local file to the same name in several B2 folders at
+    once.  The file is read and its checksums are computed once, for
+    all of them, and one upload failing doesn't stop the others.
+    """
+
+    def __init__(
+        self, local_full_path, relative_name, destinations, mod_time_millis, size, executor
+    ):
+        """
+        :param destinations: a list of (bucket, b2_file_name)
+        :param executor: the thread pool that runs the uploads to each destination
+        """
+        self.local_full_path = local_full_path
+        self.relative_name = relative_name
+        self.destinations = destinations
+        self.mod_time_millis = mod_time_millis
+        self.size = size
+        self.executor = executor
+
+    def get_bytes(self):
+        return self.size * len(self.destinations)
+
+    def do_action(self, bucket, reporter):
+        with UploadSourceLocalFile(self.local_full_path, use_mmap=True) as upload_source:
+            results = upload_to_buckets(
+                self.destinations,
+                upload_source,
+                file_info={'src_last_modified_millis': str(self.mod_time_millis)},
+                progress_listeners=[SyncFileReporter(reporter) for _ in self.destinations],
+                executor=self.executor
+            )
+        for ((dest_bucket, b2_file_name), result) in zip(self.destinations, results):
+            if isinstance(result, Exception):
+                reporter.error(
+                    'b2_upload(%s, %s, %s, %s): %r %s' % (
+                        self.local_full_path, dest_bucket.name, b2_file_name,
+                        self.mod_time_millis, result, result
+                    )
+                )
+            else:
+                reporter.print_completion(
+                    'upload ' + self.relative_name + ' to ' + dest_bucket.name
+                )
+        reporter.update_transfer(1, 0)  # bytes reported during transfer
+
+    def __str__(self):
+        return 'b2_fan_out_upload(%s, %s, %s)' % (
+            self.local_full_path, ', '.join(
+                '%s:%s' % (dest_bucket.name, b2_file_name)
+                for (dest_bucket, b2_file_name) in self.destinations
+            ), self.mod_time_millis
+        )
+
+
+class ActionInBucket(AbstractAction):
+    """
+    Runs an action against the bucket it was made for, instead of the
+    one the sync passes in.  Used when a sync has several destinations.
+    """
+
+    def __init__(self, action, bucket):
+        self.action = action
+        self.bucket = bucket
+
+    def run(self, bucket, reporter):
+        self.action.run(self.bucket, reporter)
+
+    def get_bytes(self):
+        return self.action.get_bytes()
+
+    def do_action(self, bucket, reporter):
+        self.action.do_action(self.bucket, reporter)
+
+    def __str__(self):
+        return str(self.action)
+
+
 class B2HideAction(AbstractAction):
     def __init__(self, relative_name, b2_file_name):
         self.relative_name = relative_name
@@ -359,6 +546,52 @@ class B2DownloadAction(AbstractAction):
         )
 
 
+class B2CopyAction(AbstractAction):
+    """
+    Copies a file from one B2 folder to another by uploading straight
+    from downloads of it, so nothing is stored locally.
+    """
+
+    def __init__(
+        self, relative_name, source_bucket, source_file_name, file_id, b2_file_name,
+        mod_time_millis, size
+    ):
+        self.relative_name = relative_name
+        self.source_bucket = source_bucket
+        self.source_file_name = source_file_name
+        self.file_id = file_id
+        self.b2_file_name = b2_file_name
+        self.mod_time_millis = mod_time_millis
+        self.size = size
+
+    def get_bytes(self):
+        return self.size
+
+    def do_action(self, bucket, reporter):
+        source_api = self.source_bucket.api
+        # Listing the source folder put this in the file info cache.
+        source_info = source_api.get_file_version_info(self.file_id)
+        content_sha1 = source_info.content_sha1
+        if content_sha1 == 'none':
+            content_sha1 = source_info.file_info.get('large_file_sha1')
+        file_info = dict(source_info.file_info)
+        file_info['src_last_modified_millis'] = str(self.mod_time_millis)
+        bucket.upload(
+            UploadSourceB2File(source_api, self.file_id, self.size, content_sha1),
+            self.b2_file_name,
+            content_type=source_info.content_type,
+            file_info=file_info,
+            progress_listener=SyncFileReporter(reporter)
+        )
+        reporter.update_transfer(1, 0)  # bytes reported during transfer
+        reporter.print_completion('copy   ' + self.relative_name)
+
+    def __str__(self):
+        return 'b2_copy(%s, %s, %s, %d)' % (
+            self.source_file_name, self.file_id, self.b2_file_name, self.mod_time_millis
+        )
+
+
 class B2DeleteAction(AbstractAction):
     def __init__(self, relative_name, b2_file_name, file_id, note):
         self.relative_name = relative_name
@@ -564,21 +797,24 @@ class LocalFolder(AbstractFolder):
 class B2Folder(AbstractFolder):
     """
     Folder interface to B2.
+
+    When max_index_age_seconds is set and the api has a ListingIndex,
+    the files are listed from the index, which is refreshed first if
+    it is older than that.
     """
 
-    def __init__(self, bucket_name, folder_name, api):
+    def __init__(self, bucket_name, folder_name, api, max_index_age_seconds=None):
         self.bucket_name = bucket_name
         self.folder_name = folder_name
         self.bucket = api.get_bucket_by_name(bucket_name)
         self.prefix = '' if self.folder_name == '' else self.folder_name + '/'
+        self.listing_index = api.listing_index
+        self.max_index_age_seconds = max_index_age_seconds
 
     def all_files(self):
         current_name = None
         current_versions = []
-        for (file_version_info, folder_name) in self.bucket.ls(
-            self.folder_name, show_versions=True,
-            recursive=True, fetch_count=1000
-        ):
+        for (file_version_info, folder_name) in self._list_file_versions():
             assert file_version_info.file_name.startswith(self.prefix)
             file_name = file_version_info.file_name[len(self.prefix):]
             if current_name != file_name and current_name is not None:
@@ -599,6 +835,19 @@ class B2Folder(AbstractFolder):
         if current_name is not None:
             yield File(current_name, current_versions)
 
+    def _list_file_versions(self):
+        if self.listing_index is None or self.max_index_age_seconds is None:
+            return self.bucket.ls(
+                self.folder_name, show_versions=True,
+                recursive=True, fetch_count=1000
+            )
+        self.listing_index.refresh_if_stale(
+            self.bucket, self.folder_name, self.max_index_age_seconds
+        )
+        return self.listing_index.ls(
+            self.bucket.id_, self.folder_name, show_versions=True, recursive=True
+        )
+
     def folder_type(self):
         return 'b2'
 
@@ -657,6 +906,30 @@ def zip_folders(folder_a, folder_b):
             current_b = next_or_none(iter_b)
 
 
+def zip_many_folders(source_folder, dest_folders):
+    """
+    An iterator over all of the files in the union of a source folder
+    and several destination folders, matching file names.
+
+    Each item is a pair (source_file, dest_files), where dest_files
+    has the file with that name in each destination folder, in the
+    same order as dest_folders.  Files that a folder doesn't have are
+    None.
+    """
+    iters = [source_folder.all_files()] + [folder.all_files() for folder in dest_folders]
+    currents = [next_or_none(iterator) for iterator in iters]
+    while any(current is not None for current in currents):
+        name = min(current.name for current in currents if current is not None)
+        files = []
+        for (i, current) in enumerate(currents):
+            if current is not None and current.name == name:
+                files.append(current)
+                currents[i] = next_or_none(iters[i])
+            else:
+                files.append(None)
+        yield (files[0], files[1:])
+
+
 def make_transfer_action(sync_type, source_file, source_folder, dest_folder):
     source_mod_time = source_file.latest_version().mod_time
     if sync_type == 'local-to-b2':
@@ -667,6 +940,16 @@ def make_transfer_action(sync_type, source_file, source_folder, dest_folder):
             source_mod_time,
             source_file.latest_version().size
         )  # yapf: disable
+    elif sync_type == 'b2-to-b2':
+        return B2CopyAction(
+            source_file.name,
+            source_folder.bucket,
+            source_folder.make_full_path(source_file.name),
+            source_file.latest_version().id_,
+            dest_folder.make_full_path(source_file.name),
+            source_mod_time,
+            source_file.latest_version().size
+        )  # yapf: disable
     else:
         return B2DownloadAction(
             source_file.name,
@@ -685,6 +968,8 @@ def make_file_sync_actions(
     Yields the sequence of actions needed to sync the two files
     """
 
+    dest_is_b2 = sync_type in ('local-to-b2', 'b2-to-b2')
+
     # Get the modification time of the latest version of the source file
     source_mod_time = 0
     if source_file is not None:
@@ -709,7 +994,7 @@ def make_file_sync_actions(
     if dest_mod_time < source_mod_time:
         yield make_transfer_action(sync_type, source_file, source_folder, dest_folder)
         transferred = True
-        if sync_type == 'local-to-b2' and dest_file is not None:
+        if dest_is_b2 and dest_file is not None:
             dest_versions_to_clean = dest_file.versions
 
     # Case 2: Both exist and source is older
@@ -724,14 +1009,14 @@ def make_file_sync_actions(
 
     # Case 3: No source file, but destination file exists
     elif source_mod_time == 0 and dest_mod_time != 0:
-        if args.keepDays is not None and sync_type == 'local-to-b2':
+        if args.keepDays is not None and dest_is_b2:
             if dest_file.versions[0].action == 'upload':
                 yield B2HideAction(dest_file.name, dest_folder.make_full_path(dest_file.name))
         # all versions of the destination file are candidates for cleaning
         dest_versions_to_clean = dest_file.versions
 
     # Clean up old versions
-    if sync_type == 'local-to-b2':
+    if dest_is_b2:
         for version in dest_versions_to_clean:
             note = ''
             if transferred or (version is not dest_file.versions[0]):
@@ -754,11 +1039,7 @@ def make_file_sync_actions(
                 yield LocalDeleteAction(dest_file.name, version.id_)
 
 
-def make_folder_sync_actions(source_folder, dest_folder, args, now_millis, reporter):
-    """
-    Yields a sequence of actions that will sync the destination
-    folder to the source folder.
-    """
+def _check_sync_args(args, dest_folder):
     if args.skipNewer and args.replaceNewer:
         raise CommandError('--skipNewer and --replaceNewer are incompatible')
 
@@ -768,27 +1049,85 @@ def make_folder_sync_actions(source_folder, dest_folder, args, now_millis, repor
     if (args.keepDays is not None) and (dest_folder.folder_type() == 'local'):
         raise CommandError('--keepDays cannot be used for local files')
 
+
+def make_folder_sync_actions(source_folder, dest_folder, args, now_millis, reporter):
+    """
+    Yields a sequence of actions that will sync the destination
+    folder to the source folder.
+    """
+    _check_sync_args(args, dest_folder)
+
     source_type = source_folder.folder_type()
     dest_type = dest_folder.folder_type()
     sync_type = '%s-to-%s' % (source_type, dest_type)
     if (source_folder.folder_type(), dest_folder.folder_type()) not in [
-        ('b2', 'local'), ('local', 'b2')
+        ('b2', 'local'), ('local', 'b2'), ('b2', 'b2')
     ]:
-        raise NotImplementedError("Sync support only local-to-b2 and b2-to-local")
+        raise NotImplementedError("Sync support only local-to-b2, b2-to-local and b2-to-b2")
     for (source_file, dest_file) in zip_folders(source_folder, dest_folder):
         if source_folder.folder_type() == 'local':
             if source_file is not None:
                 reporter.update_compare(1)
-        else:
+        elif dest_folder.folder_type() == 'local':
             if dest_file is not None:
                 reporter.update_compare(1)
+        else:
+            # With no local folder to count first, the source files are counted here.
+            if source_file is not None:
+                reporter.update_local(1)
+                reporter.update_compare(1)
         for action in make_file_sync_actions(
             sync_type, source_file, dest_file, source_folder, dest_folder, args, now_millis
         ):
             yield action
 
 
-def _parse_bucket_and_folder(bucket_and_path, api):
+def make_fan_out_sync_actions(source_folder, dest_folders, args, now_millis, reporter, executor):
+    """
+    Yields a sequence of actions that will sync each of several B2
+    destination folders to a local source folder.
+
+    Each destination is compared with the source on its own, but a
+    file that several of them need is uploaded to all of them by one
+    B2FanOutUploadAction, so it is read from disk once.  The other
+    actions are wrapped in ActionInBucket, so they run against their
+    own destination's bucket.
+
+    :param executor: the thread pool for the uploads to each destination
+    """
+    for dest_folder in dest_folders:
+        _check_sync_args(args, dest_folder)
+    if source_folder.folder_type() != 'local' or \
+            any(dest_folder.folder_type() != 'b2' for dest_folder in dest_folders):
+        raise NotImplementedError("Sync to several destinations supports only local-to-b2")
+    for (source_file, dest_files) in zip_many_folders(source_folder, dest_folders):
+        if source_file is not None:
+            reporter.update_compare(1)
+        destinations = []
+        other_actions = []
+        for (dest_file, dest_folder) in zip(dest_files, dest_folders):
+            for action in make_file_sync_actions(
+                'local-to-b2', source_file, dest_file, source_folder, dest_folder, args,
+                now_millis
+            ):
+                if isinstance(action, B2UploadAction):
+                    destinations.append((dest_folder.bucket, action.b2_file_name))
+                else:
+                    other_actions.append(ActionInBucket(action, dest_folder.bucket))
+        if destinations:
+            yield B2FanOutUploadAction(
+                source_folder.make_full_path(source_file.name),
+                source_file.name,
+                destinations,
+                source_file.latest_version().mod_time,
+                source_file.latest_version().size,
+                executor
+            )  # yapf: disable
+        for action in other_actions:
+            yield action
+
+
+def _parse_bucket_and_folder(bucket_and_path, api, max_index_age_seconds):
     """
     Turns 'my-bucket/foo' into B2Folder(my-bucket, foo)
     """
@@ -801,10 +1140,10 @@ def _parse_bucket_and_folder(bucket_and_path, api):
         (bucket_name, folder_name) = bucket_and_path.split('/', 1)
     if folder_name.endswith('/'):
         folder_name = folder_name[:-1]
-    return B2Folder(bucket_name, folder_name, api)
+    return B2Folder(bucket_name, folder_name, api, max_index_age_seconds)
 
 
-def parse_sync_folder(folder_name, api):
+def parse_sync_folder(folder_name, api, max_index_age_seconds=None):
     """
     Takes either a local path, or a B2 path, and returns a Folder
     object for it.
@@ -813,11 +1152,14 @@ def parse_sync_folder(folder_name, api):
     because the previous sync command didn't use it.
 
     Anything else is treated like a local folder.
+
+    :param max_index_age_seconds: for B2 folders, list from the api's ListingIndex
+                                  if it was refreshed this recently
     """
     if folder_name.startswith('b2://'):
-        return _parse_bucket_and_folder(folder_name[5:], api)
+        return _parse_bucket_and_folder(folder_name[5:], api, max_index_age_seconds)
     elif folder_name.startswith('b2:') and folder_name[3].isalnum():
-        return _parse_bucket_and_folder(folder_name[3:], api)
+        return _parse_bucket_and_folder(folder_name[3:], api, max_index_age_seconds)
     else:
         if folder_name.endswith('/'):
             folder_name = folder_name[:-1]
@@ -833,19 +1175,41 @@ def count_files(local_folder, reporter):
     reporter.end_local()
 
 
-def sync_folders(source_folder, dest_folder, args, now_millis, stdout, no_progress, max_workers):
+def sync_folders(
+    source_folder,
+    dest_folder,
+    args,
+    now_millis,
+    stdout,
+    no_progress,
+    max_workers,
+    log_file=None,
+    summary_only=False,
+    extra_dest_folders=None
+):
     """
     Syncs two folders.  Always ensures that every file in the
     source is also in the destination.  Deletes any file versions
     in the destination older than history_days.
+
+    :param log_file: a file to write the lines about each file to, instead of stdout
+    :param summary_only: when True, prints just the totals at the end
+    :param extra_dest_folders: more B2 folders to sync a local source folder to,
+                               at the same time as dest_folder; each file is read
+                               once, and uploaded to all of the folders that need it
     """
+    if extra_dest_folders:
+        return _sync_to_many_folders(
+            source_folder, [dest_folder] + list(extra_dest_folders), args, now_millis, stdout,
+            no_progress, max_workers, log_file, summary_only
+        )
 
     # For downloads, make sure that the target directory is there.
     if dest_folder.folder_type() == 'local':
         dest_folder.ensure_present()
 
     # Make a reporter to report progress.
-    with SyncReport(stdout, no_progress) as reporter:
+    with SyncReport(stdout, no_progress, log_file, summary_only) as reporter:
 
         # Make an executor to count files and run all of the actions.  This is
         # not the same as the executor in the API object, which is used for
@@ -860,9 +1224,8 @@ def sync_folders(source_folder, dest_folder, args, now_millis, stdout, no_progre
             local_folder = source_folder
         if dest_folder.folder_type() == 'local':
             local_folder = dest_folder
-        if local_folder is None:
-            raise ValueError('neither folder is a local folder')
-        sync_executor.submit(count_files, local_folder, reporter)
+        if local_folder is not None:
+            sync_executor.submit(count_files, local_folder, reporter)
 
         # Schedule each of the actions
         bucket = None
@@ -870,17 +1233,66 @@ def sync_folders(source_folder, dest_folder, args, now_millis, stdout, no_progre
             bucket = source_folder.bucket
         if dest_folder.folder_type() == 'b2':
             bucket = dest_folder.bucket
+
+            # Get upload URLs while comparing, so the first uploads don't wait for them.
+            bucket.start_upload_url_warmer(max_workers)
         if bucket is None:
             raise ValueError('neither folder is a b2 folder')
-        total_files = 0
-        total_bytes = 0
-        for action in make_folder_sync_actions(
-            source_folder, dest_folder, args, now_millis, reporter
-        ):
-            sync_executor.submit(action.run, bucket, reporter)
-            total_files += 1
-            total_bytes += action.get_bytes()
-        reporter.end_compare(total_files, total_bytes)
+        try:
+            total_files = 0
+            total_bytes = 0
+            for action in make_folder_sync_actions(
+                source_folder, dest_folder, args, now_millis, reporter
+            ):
+                sync_executor.submit(action.run, bucket, reporter)
+                total_files += 1
+                total_bytes += action.get_bytes()
+            if local_folder is None:
+                reporter.end_local()
+            reporter.end_compare(total_files, total_bytes)
+
+            # Wait for everything to finish
+            sync_executor.shutdown()
+        finally:
+            bucket.stop_upload_url_warmer()
+
+
+def _sync_to_many_folders(
+    source_folder, dest_folders, args, now_millis, stdout, no_progress, max_workers, log_file,
+    summary_only
+):
+    """
+    Syncs a local folder to several B2 folders.  See sync_folders().
+    """
+    with SyncReport(stdout, no_progress, log_file, summary_only) as reporter:
+        # Each action in the sync executor waits for up to one upload per
+        # destination, which run in the fan-out executor.
+        sync_executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        fan_out_executor = futures.ThreadPoolExecutor(
+            max_workers=max_workers * len(dest_folders)
+        )
+        sync_executor.submit(count_files, source_folder, reporter)
 
-        # Wait for everything to finish
-        sync_executor.shutdown()
+        buckets = collections.OrderedDict()
+        for dest_folder in dest_folders:
+            buckets.setdefault(dest_folder.bucket.id_, dest_folder.bucket)
+        for bucket in buckets.values():
+            bucket.start_upload_url_warmer(max_workers)
+        try:
+            total_files = 0
+            total_bytes = 0
+            for action in make_fan_out_sync_actions(
+                source_folder, dest_folders, args, now_millis, reporter, fan_out_executor
+            ):
+                # The actions know their own buckets.
+                sync_executor.submit(action.run, None, reporter)
+                total_files += 1
+                total_bytes += action.get_bytes()
+            reporter.end_compare(total_files, total_bytes)
+
+            # Wait for everything to finish
+            sync_executor.shutdown()
+        finally:
+            fan_out_executor.shutdown()
+            for bucket in buckets.values():
+                bucket.stop_upload_url_warmer()
@@ -0,0 +1,176 @@
+######################################################################
+#
+# File: b2/upload_health.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+from __future__ import division
+
+import collections
+import threading
+import time
+
+import six
+from six.moves.urllib.parse import urlsplit
+
+
+def upload_url_host(upload_url):
+    """
+    Returns the host (storage pod) that an upload URL sends to.
+    """
+    return urlsplit(upload_url).netloc
+
+
+class PodHealth(object):
+    """
+    What we know about uploads to one storage pod.
+    """
+
+    def __init__(self):
+        self.latency_ewma = None
+        self.throughput_ewma = None
+        self.sample_count = 0
+        self.throughput_sample_count = 0
+        self.failure_times = collections.deque()
+        self.last_update_time = None
+
+    def as_dict(self):
+        return dict(
+            latency=self.latency_ewma,
+            throughput=self.throughput_ewma,
+            samples=self.sample_count,
+            recent_failures=len(self.failure_times)
+        )
+
+
+class UploadHealthTracker(object):
+    """
+    Keeps track of how uploads to each storage pod are going, so that
+    a pod that is failing or slow can be avoided without giving up the
+    upload URLs for the pods that are fine.
+
+    For each pod, keeps an exponentially weighted moving average of
+    the latency and throughput of uploads, and the times of recent
+    failures.  Only uploads of at least min_throughput_bytes count
+    toward throughput: a small upload takes about as long as a round
+    trip, so its bytes per second say more about its size than about
+    the pod.  A pod is unhealthy if it has failed max_recent_failures
+    times in the last window_seconds, or if its throughput is less than
+    1/slow_factor of the median throughput of all pods.  Pods that
+    haven't been heard from in window_seconds are forgotten, so they
+    get another chance.
+
+    This class is THREAD SAFE.
+    """
+
+    def __init__(
+        self,
+        ewma_weight=0.3,
+        window_seconds=300,
+        max_recent_failures=2,
+        slow_factor=4,
+        min_samples=3,
+        min_throughput_bytes=1000000,
+        clock=time.time
+    ):
+        self.ewma_weight = ewma_weight
+        self.window_seconds = window_seconds
+        self.max_recent_failures = max_recent_failures
+        self.slow_factor = slow_factor
+        self.min_samples = min_samples
+        self.min_throughput_bytes = min_throughput_bytes
+        self.clock = clock
+        self.pods = {}
+        self.lock = threading.Lock()
+
+    def record_success(self, upload_url, byte_count, seconds):
+        with self.lock:
+            pod = self._get_pod(upload_url_host(upload_url))
+            seconds = max(seconds, 1e-6)
+            pod.latency_ewma = self._ewma(pod.latency_ewma, seconds)
+            pod.sample_count += 1
+            if self.min_throughput_bytes <= byte_count:
+                pod.throughput_ewma = self._ewma(pod.throughput_ewma, byte_count / seconds)
+                pod.throughput_sample_count += 1
+
+    def record_failure(self, upload_url):
+        with self.lock:
+            pod = self._get_pod(upload_url_host(upload_url))
+            pod.failure_times.append(self.clock())
+
+    def is_healthy(self, upload_url):
+        with self.lock:
+            self._forget_old()
+            pod = self.pods.get(upload_url_host(upload_url))
+            if pod is None:
+                return True
+            if self.max_recent_failures <= len(pod.failure_times):
+                return False
+            if pod.throughput_sample_count < self.min_samples:
+                return True
+            median = self._median_throughput()
+            return median is None or median <= pod.throughput_ewma * self.slow_factor
+
+    def pod_count(self):
+        with self.lock:
+            return len(self.pods)
+
+    def choose_best(self, upload_urls):
+        """
+        Returns the URL in the list that goes to the pod with the best
+        throughput.  Pods we know nothing about rank at the median, so
+        that new pods get tried.
+        """
+        with self.lock:
+            median = self._median_throughput() or 0
+
+            def score(upload_url):
+                pod = self.pods.get(upload_url_host(upload_url))
+                if pod is None or pod.throughput_ewma is None:
+                    return median
+                return pod.throughput_ewma
+
+            return max(upload_urls, key=score)
+
+    def get_stats(self):
+        """
+        Returns a dict from pod host name to a dict of what is known about it.
+        """
+        with self.lock:
+            self._forget_old()
+            return dict((host, pod.as_dict()) for (host, pod) in six.iteritems(self.pods))
+
+    def _get_pod(self, host):
+        pod = self.pods.get(host)
+        if pod is None:
+            pod = self.pods[host] = PodHealth()
+        pod.last_update_time = self.clock()
+        return pod
+
+    def _ewma(self, average, value):
+        if average is None:
+            return value
+        return self.ewma_weight * value + (1 - self.ewma_weight) * average
+
+    def _median_throughput(self):
+        values = sorted(
+            pod.throughput_ewma
+            for pod in six.itervalues(self.pods)
+            if self.min_samples <= pod.throughput_sample_count
+        )
+        if not values:
+            return None
+        return values[len(values) // 2]
+
+    def _forget_old(self):
+        cutoff = self.clock() - self.window_seconds
+        for host in list(self.pods):
+            pod = self.pods[host]
+            while pod.failure_times and pod.failure_times[0] < cutoff:
+                pod.failure_times.popleft()
+            if pod.last_update_time < cutoff:
+                del self.pods[host]
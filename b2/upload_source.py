@@ -9,12 +9,15 @@
 ######################################################################
 
 import hashlib
+import mmap
 import os
+import threading
 from abc import (ABCMeta, abstractmethod)
 
 import six
 
-from .utils import (BytesIoContextManager, hex_sha1_of_stream)
+from .progress import RangeOfInputStream
+from .utils import hex_sha1_of_stream
 
 
 @six.add_metaclass(ABCMeta)
@@ -43,6 +46,74 @@ class AbstractUploadSource(object):
         :return:
         """
 
+    def get_range_sha1(self, offset, length):
+        """
+        Returns the hex SHA1 checksum of a range of the data, like a part
+        of a large file.
+        """
+        with self.open() as f:
+            f.seek(offset)
+            range_stream = RangeOfInputStream(f, offset, length)
+            return hex_sha1_of_stream(range_stream, length)
+
+
+class MemoryViewReader(object):
+    """
+    A read-only file-like object over a buffer, such as bytes or an mmap.
+
+    read() returns memoryview slices of the buffer, so the data is not
+    copied on its way to the HTTP layer or to hashlib.
+    """
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        # Slices handed out by read() stay valid after this.
+        self.view.release()
+
+    def seek(self, pos):
+        self.position = pos
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=None):
+        start = self.position
+        if size is None or size < 0:
+            end = len(self.view)
+        else:
+            end = min(start + size, len(self.view))
+        self.position = max(start, end)
+        return self.view[start:end]
+
+
+class MmapFileReader(MemoryViewReader):
+    """
+    A MemoryViewReader over a memory-mapped local file that passes
+    access-pattern hints for the ranges being read on to the kernel.
+    """
+
+    def __init__(self, file_mmap, fileno):
+        super(MmapFileReader, self).__init__(file_mmap)
+        self.fileno = fileno
+
+    def advise_range(self, offset, length):
+        """
+        Tells the kernel that the given range of the file will be read
+        soon, from start to end.
+        """
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(self.fileno, offset, length, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(self.fileno, offset, length, os.POSIX_FADV_WILLNEED)
+
 
 class UploadSourceBytes(AbstractUploadSource):
     def __init__(self, data_bytes):
@@ -55,14 +126,28 @@ class UploadSourceBytes(AbstractUploadSource):
         return hashlib.sha1(self.data_bytes).hexdigest()
 
     def open(self):
-        return BytesIoContextManager(self.data_bytes)
+        return MemoryViewReader(self.data_bytes)
 
 
 class UploadSourceLocalFile(AbstractUploadSource):
-    def __init__(self, local_path, content_sha1=None):
+    """
+    Uploads the contents of a file on the local disk.
+
+    With use_mmap set, the file is memory-mapped once, and every open()
+    returns a reader over that mapping.  The file must not be truncated
+    while it is being uploaded in this mode: reading pages past the new
+    end of a mapped file kills the process with SIGBUS.  Call close(),
+    or use a with statement, to unmap it when the uploads are done.
+    """
+
+    def __init__(self, local_path, content_sha1=None, use_mmap=False):
         self.local_path = local_path
         self.content_length = os.path.getsize(local_path)
         self.content_sha1 = content_sha1
+        self.use_mmap = use_mmap and self.content_length != 0  # can't map an empty file
+        self._file = None  # set, with self._mmap, by the first open() in mmap mode
+        self._mmap = None
+        self._mmap_lock = threading.Lock()
 
     def get_content_length(self):
         return self.content_length
@@ -73,8 +158,184 @@ class UploadSourceLocalFile(AbstractUploadSource):
         return self.content_sha1
 
     def open(self):
-        return open(self.local_path, 'rb')
+        if not self.use_mmap:
+            return open(self.local_path, 'rb')
+        with self._mmap_lock:
+            if self._mmap is None:
+                self._file = open(self.local_path, 'rb')
+                self._mmap = mmap.mmap(
+                    self._file.fileno(), self.content_length, access=mmap.ACCESS_READ
+                )
+        return MmapFileReader(self._mmap, self._file.fileno())
+
+    def close(self):
+        """
+        Unmaps the file and closes it, in mmap mode.  A later open()
+        maps it again.
+        """
+        with self._mmap_lock:
+            if self._mmap is not None:
+                try:
+                    self._mmap.close()
+                except BufferError:
+                    # Something still holds a slice of it; the mapping
+                    # goes away when the last slice does.
+                    pass
+                self._file.close()
+                self._mmap = None
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def _hex_sha1_of_file(self, local_path):
-        with open(local_path, 'rb') as f:
+        with self.open() as f:
             return hex_sha1_of_stream(f, self.content_length)
+
+
+class UploadSourceB2File(AbstractUploadSource):
+    """
+    Uploads the contents of a file that is already in B2, without
+    making a local copy.  The source can be in another bucket, or
+    another account, depending on the api given.
+
+    A small file is uploaded from a download of it, as it arrives.
+    The parts of a large file have to be hashed before they are
+    uploaded, so each part is fetched with one ranged download when
+    it is hashed, and kept until the same thread uploads it.  The
+    memory used is one part for each thread uploading parts.
+    """
+
+    def __init__(self, api, file_id, content_length, content_sha1=None):
+        """
+        :param api: the B2Api for the account the file is in
+        :param content_sha1: the checksum of the file; when None, it
+                             is computed by downloading the file
+        """
+        self.api = api
+        self.file_id = file_id
+        self.content_length = content_length
+        self.content_sha1 = content_sha1
+        self.thread_local = threading.local()
+
+    def get_content_length(self):
+        return self.content_length
+
+    def get_content_sha1(self):
+        if self.content_sha1 is None:
+            digest = hashlib.sha1()
+            with self.api.stream_file_by_id(self.file_id) as stream:
+                for chunk in stream:
+                    digest.update(chunk)
+            self.content_sha1 = digest.hexdigest()
+        return self.content_sha1
+
+    def open(self):
+        return B2FileReader(self)
+
+    def get_range(self, offset, length):
+        """
+        Returns the bytes in a range of the file, fetching them unless
+        they are what this thread fetched last.
+        """
+        part = getattr(self.thread_local, 'part', None)
+        if part is not None and part[0] == (offset, length):
+            return part[1]
+        self.thread_local.part = None  # let go of the last part before fetching this one
+        data = self.api.session.download_file_range_by_id(
+            self.file_id,
+            offset,
+            offset + length - 1,
+            url_factory=self.api.account_info.get_download_url
+        )
+        self.thread_local.part = ((offset, length), data)
+        return data
+
+
+class B2FileReader(object):
+    """
+    A read-only file-like object for an UploadSourceB2File.
+
+    Reading from the start streams a download of the whole file.
+    After advise_range(), which RangeOfInputStream calls for the part
+    it reads, reads come from that range, fetched in one piece.
+    """
+
+    def __init__(self, upload_source):
+        self.upload_source = upload_source
+        self.position = 0
+        self.range_offset = None
+        self.range_data = None
+        self.stream = None
+        self.chunks = None
+        self.leftover = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._close_stream()
+        self.range_data = None
+
+    def advise_range(self, offset, length):
+        self.range_offset = offset
+        self.range_data = memoryview(self.upload_source.get_range(offset, length))
+
+    def seek(self, pos):
+        if pos != self.position:
+            self._close_stream()
+        self.position = pos
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=None):
+        if self.range_data is not None:
+            start = self.position - self.range_offset
+            if size is None or size < 0:
+                end = len(self.range_data)
+            else:
+                end = min(start + size, len(self.range_data))
+            data = self.range_data[start:end]
+            self.position += len(data)
+            return data
+        return self._read_stream(size)
+
+    def _read_stream(self, size):
+        if self.stream is None:
+            if self.position != 0:
+                raise IOError('a B2 file can only be streamed from the start')
+            self.stream = self.upload_source.api.stream_file_by_id(self.upload_source.file_id)
+            self.stream.__enter__()
+            self.chunks = self.stream.iter_chunks()
+            self.leftover = memoryview(six.b(''))
+        pieces = []
+        while size is None or size < 0 or 0 < size:
+            if len(self.leftover) == 0:
+                # The length and checksum are checked when the chunks run out.
+                self.leftover = next(self.chunks, None)
+                if self.leftover is None:
+                    self.leftover = memoryview(six.b(''))
+                    break
+            take = len(self.leftover)
+            if size is not None and 0 <= size:
+                take = min(take, size)
+                size -= take
+            pieces.append(self.leftover[:take].tobytes())
+            self.leftover = self.leftover[take:]
+        data = six.b('').join(pieces)
+        self.position += len(data)
+        return data
+
+    def _close_stream(self):
+        if self.stream is not None:
+            self.stream.__exit__(None, None, None)
+            self.stream = None
+            self.chunks = None
+            self.leftover = None
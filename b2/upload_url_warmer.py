@@ -0,0 +1,117 @@
+######################################################################
+#
+# File: b2/upload_url_warmer.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import threading
+
+from .exception import B2Error
+
+try:
+    import concurrent.futures as futures
+except:
+    import futures
+
+
+class UploadUrlWarmer(object):
+    """
+    Keeps a pool of upload URLs filled, so that uploads don't each
+    start by waiting for a b2_get_upload_url call.
+
+    warm_up() fetches target_count URLs at once, in background
+    threads.  After that, top_up() fetches more to replace URLs that
+    were thrown away because they failed or expired.  URLs that
+    can't be fetched are just counted; uploads that find the pool
+    empty get their own.
+
+    This class is THREAD SAFE.
+    """
+
+    def __init__(self, fetch_one, target_count):
+        """
+        :param fetch_one: function that gets one upload URL and puts it in the pool
+        :param target_count: the number of URLs to keep in the pool, usually
+                             the number of uploads that run at once
+        """
+        self.fetch_one = fetch_one
+        self.target_count = target_count
+        self.executor = futures.ThreadPoolExecutor(max_workers=target_count)
+        self.stopped = False
+        self.fetched_count = 0
+        self.failed_count = 0
+        self.refill_count = 0
+        self.refill_futures = []  # for the refill under way, if there is one
+        self.lock = threading.Lock()
+
+    def warm_up(self, wait=False):
+        """
+        Starts fetching target_count URLs.
+
+        :param wait: when True, returns only after they have all been fetched
+        """
+        pending = self.top_up(self.target_count)
+        if wait:
+            futures.wait(pending)
+
+    def refill(self, empty_pool=None):
+        """
+        Empties the pool and fetches a whole new set of URLs, after
+        they went stale.  When several uploads find out at once, only
+        the first one starts a refill; the others join it.
+
+        :param empty_pool: function that throws away the URLs in the pool, called
+                           only when a new refill starts
+        :return: a list of futures, one for each URL
+        """
+        with self.lock:
+            if self.stopped:
+                return []
+            if any(not future.done() for future in self.refill_futures):
+                return list(self.refill_futures)
+            if empty_pool is not None:
+                empty_pool()
+            self.refill_count += 1
+            self.refill_futures = [
+                self.executor.submit(self._fetch) for _ in range(self.target_count)
+            ]
+            return list(self.refill_futures)
+
+    def top_up(self, count=1):
+        """
+        Starts fetching count more URLs.
+
+        :return: a list of futures, one for each URL
+        """
+        with self.lock:
+            if self.stopped:
+                return []
+            return [self.executor.submit(self._fetch) for _ in range(count)]
+
+    def stop(self):
+        """
+        Stops fetching more URLs.  Fetches already asked for finish in the background.
+        """
+        with self.lock:
+            self.stopped = True
+        self.executor.shutdown(wait=False)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(
+                fetched=self.fetched_count, failed=self.failed_count, refills=self.refill_count
+            )
+
+    def _fetch(self):
+        try:
+            self.fetch_one()
+        except B2Error:
+            with self.lock:
+                self.failed_count += 1
+        else:
+            with self.lock:
+                self.fetched_count += 1
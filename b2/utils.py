@@ -11,9 +11,12 @@
 from __future__ import division, print_function
 
 import hashlib
+import os
 import shutil
 import tempfile
+import threading
 import time
+import uuid
 
 import six
 from six.moves import urllib
@@ -23,13 +26,26 @@ try:
 except:
     import futures
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # not on Windows
+
+# The Linux ioctl that makes a copy-on-write clone of a file, on file
+# systems that can (like btrfs and xfs).
+FICLONE = 0x40049409
+
 # Global variable that says whether the app is shutting down
 _shutting_down = False
 
+# Set at the same time, to wake up threads waiting in sleep_unless_shutting_down()
+_shutdown_event = threading.Event()
+
 
 def set_shutting_down():
     global _shutting_down
     _shutting_down = True
+    _shutdown_event.set()
 
 
 def raise_if_shutting_down():
@@ -37,6 +53,16 @@ def raise_if_shutting_down():
         raise KeyboardInterrupt()
 
 
+def sleep_unless_shutting_down(seconds):
+    """
+    Like time.sleep(), but raises KeyboardInterrupt as soon as the
+    app starts shutting down, instead of finishing the wait.
+    """
+    raise_if_shutting_down()
+    if _shutdown_event.wait(seconds):
+        raise KeyboardInterrupt()
+
+
 def current_time_millis():
     """
     File times are in integer milliseconds, to avoid roundoff errors.
@@ -162,6 +188,45 @@ def validate_b2_file_name(name):
         raise ValueError("file names segments (between '/') can be at most 250 utf-8 bytes")
 
 
+def clone_or_link_file(source_path, dest_path, allow_hard_link=False):
+    """
+    Makes dest_path have the contents of source_path without copying
+    the data, by cloning the file if the file system can, or else, if
+    allow_hard_link is set, by making a hard link to it.  Replaces
+    dest_path if it exists.
+
+    A hard link is the same file, so changing one, or its mode or
+    times, changes the other.
+
+    :return: 'clone' or 'link', or None if neither can be done here
+    """
+    temp_path = '%s.%s.tmp' % (dest_path, uuid.uuid4().hex)
+    method = None
+    if fcntl is not None:
+        try:
+            with open(source_path, 'rb') as source:
+                with open(temp_path, 'wb') as dest:
+                    fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+            method = 'clone'
+        except (IOError, OSError):
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+    if method is None and allow_hard_link and hasattr(os, 'link'):
+        try:
+            os.link(source_path, temp_path)
+            method = 'link'
+        except OSError:
+            pass
+    if method is not None:
+        try:
+            os.rename(temp_path, dest_path)
+        except OSError:
+            # Windows won't rename over a file.
+            os.unlink(dest_path)
+            os.rename(temp_path, dest_path)
+    return method
+
+
 class BytesIoContextManager(object):
     """
     A simple wrapper for a BytesIO that makes it look like
@@ -276,12 +341,12 @@ def human2bytes(s):
 
     init = s
     num = ""
-    while s and s[0].isdigit() or s[0] == '.':
+    while s and (s[0].isdigit() or s[0] == '.'):
         num += s[0]
         s = s[1:]
     num = float(num)
     unit = s.strip()
 
-    if not UNITS.has_key(unit):
+    if unit not in UNITS:
         raise ValueError("can't interpret %r" % init)
     return int(num * UNITS[unit])
@@ -10,11 +10,12 @@
 
 import json
 import os
+import sqlite3
 import unittest
 
 import six
 
-from b2.account_info import SqliteAccountInfo
+from b2.account_info import InMemoryAccountInfo, SqliteAccountInfo
 from b2.exception import CorruptAccountInfo, MissingAccountData
 
 try:
@@ -27,17 +28,22 @@ class TestSqliteAccountInfo(unittest.TestCase):
 
     FILE_NAME = '/tmp/test_b2_account_info'
 
+    # the database, and the files sqlite keeps next to it in WAL mode
+    FILE_NAMES = [FILE_NAME, FILE_NAME + '-wal', FILE_NAME + '-shm']
+
     def setUp(self):
-        try:
-            os.unlink(self.FILE_NAME)
-        except:
-            pass
+        for file_name in self.FILE_NAMES:
+            try:
+                os.unlink(file_name)
+            except:
+                pass
 
     def tearDown(self):
-        try:
-            os.unlink(self.FILE_NAME)
-        except BaseException:
-            pass
+        for file_name in self.FILE_NAMES:
+            try:
+                os.unlink(file_name)
+            except BaseException:
+                pass
 
     def test_account_info(self):
         account_info = self._make_info()
@@ -53,6 +59,64 @@ class TestSqliteAccountInfo(unittest.TestCase):
         self.assertEqual('realm', info2.get_realm())
         self.assertEqual(100, info2.get_minimum_part_size())
 
+    def test_account_row_is_cached(self):
+        account_info = self._make_info()
+        account_info.set_auth_data(
+            'account_id', 'account_auth', 'api_url', 'download_url', 100, 'app_key', 'realm'
+        )
+        connection = account_info._get_connection()
+        if not hasattr(connection, 'set_trace_callback'):
+            return  # not until Python 3.3
+        statements = []
+        connection.set_trace_callback(statements.append)
+        other_process = self._make_info()
+        for _ in range(3):
+            self.assertEqual('api_url', account_info.get_api_url())
+            self.assertEqual('account_auth', account_info.get_account_auth_token())
+            # Upload URL traffic from others doesn't make the row be read again.
+            other_process.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+            other_process.take_bucket_upload_url('bucket-0')
+        self.assertEqual(1, len([s for s in statements if s.startswith('SELECT account_id')]))
+
+    def test_cached_row_sees_changes(self):
+        account_info = self._make_info()
+        account_info.set_auth_data(
+            'account_id', 'account_auth', 'api_url', 'download_url', 100, 'app_key', 'realm'
+        )
+        self.assertEqual('account_auth', account_info.get_account_auth_token())
+
+        # changed by this object
+        account_info.set_auth_data(
+            'account_id', 'account_auth_2', 'api_url', 'download_url', 100, 'app_key', 'realm'
+        )
+        self.assertEqual('account_auth_2', account_info.get_account_auth_token())
+
+        # changed by another process
+        self._make_info().set_auth_data(
+            'account_id', 'account_auth_3', 'api_url', 'download_url', 100, 'app_key', 'realm'
+        )
+        self.assertEqual('account_auth_3', account_info.get_account_auth_token())
+
+        # changed by an older version of b2, which doesn't set the generation
+        conn = sqlite3.connect(self.FILE_NAME)
+        with conn:
+            conn.execute("UPDATE account SET account_auth_token = 'old', generation = NULL;")
+        conn.close()
+        self.assertEqual('old', account_info.get_account_auth_token())
+
+        # cleared by another process
+        self._make_info().clear()
+        try:
+            account_info.get_account_auth_token()
+            self.fail('should have raised MissingAccountData')
+        except MissingAccountData:
+            pass
+
+    def test_write_ahead_log(self):
+        account_info = self._make_info()
+        cursor = account_info._get_connection().execute('PRAGMA journal_mode;')
+        self.assertEqual('wal', cursor.fetchone()[0])
+
     def test_corrupted(self):
         """
         Test that a corrupted file will be replaced with a blank file.
@@ -85,6 +149,27 @@ class TestSqliteAccountInfo(unittest.TestCase):
         account_info = self._make_info()
         self.assertEqual('auth_token', account_info.get_account_auth_token())
 
+    def test_older_versions_keep_their_tables(self):
+        conn = sqlite3.connect(self.FILE_NAME)
+        with conn:
+            conn.execute(
+                'CREATE TABLE bucket_upload_url '
+                '(bucket_id TEXT, upload_url TEXT, upload_auth_token TEXT);'
+            )
+            conn.execute("INSERT INTO bucket_upload_url VALUES ('bucket-0', 'url', 'auth');")
+        conn.close()
+        for _ in range(2):
+            account_info = self._make_info()
+        conn = account_info._get_connection()
+        self.assertEqual(
+            [('bucket-0', 'url', 'auth')],
+            conn.execute('SELECT * FROM bucket_upload_url;').fetchall()
+        )
+        self.assertEqual(
+            SqliteAccountInfo.SCHEMA_VERSION,
+            conn.execute('PRAGMA user_version;').fetchone()[0]
+        )
+
     def test_clear(self):
         account_info = self._make_info()
         account_info.set_auth_data(
@@ -127,12 +212,113 @@ class TestSqliteAccountInfo(unittest.TestCase):
         )
         self.assertEqual((None, None), account_info.take_large_file_upload_url('file_0'))
 
+    def test_large_file_upload_urls_stay_in_memory(self):
+        account_info = self._make_info()
+        connection = account_info._get_connection()
+        if not hasattr(connection, 'set_trace_callback'):
+            return  # not until Python 3.3
+        statements = []
+        connection.set_trace_callback(statements.append)
+        for _ in range(3):
+            account_info.put_large_file_upload_url('file_0', 'http://file_0', 'auth_0')
+            account_info.take_large_file_upload_url('file_0')
+        self.assertEqual([], statements)
+        account_info.put_large_file_upload_url('file_0', 'http://file_0', 'auth_0')
+        self.assertEqual((None, None), self._make_info().take_large_file_upload_url('file_0'))
+
+    def test_stale_lease_is_reclaimed(self):
+        account_info = self._make_info()
+        other_process = self._make_info()
+        lease_millis = SqliteAccountInfo.UPLOAD_URL_LEASE_SECONDS * 1000
+        with mock.patch.object(account_info, '_now_millis', return_value=1000000):
+            account_info.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+            account_info.take_bucket_upload_url('bucket-0')
+        with mock.patch.object(other_process, '_now_millis', return_value=1000000 + lease_millis):
+            self.assertEqual((None, None), other_process.take_bucket_upload_url('bucket-0'))
+        with mock.patch.object(
+            other_process, '_now_millis', return_value=1000001 + lease_millis
+        ), mock.patch.object(other_process, '_lease_owner', return_value='other:1'):
+            self.assertEqual(
+                ('http://bucket-0', 'bucket-0_auth'),
+                other_process.take_bucket_upload_url('bucket-0')
+            )
+
+        # The first process finishes late, and must not end the other one's lease.
+        account_info.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+        self.assertEqual((None, None), account_info.take_bucket_upload_url('bucket-0'))
+
+    def test_old_upload_urls_are_dropped(self):
+        account_info = self._make_info()
+        lifetime_millis = SqliteAccountInfo.UPLOAD_URL_LIFETIME_SECONDS * 1000
+        with mock.patch.object(account_info, '_now_millis', return_value=1000000):
+            account_info.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+        with mock.patch.object(
+            account_info, '_now_millis', return_value=1000001 + lifetime_millis
+        ):
+            self.assertEqual((None, None), account_info.take_bucket_upload_url('bucket-0'))
+
+    def test_use_does_not_extend_lifetime(self):
+        account_info = self._make_info()
+        lifetime_millis = SqliteAccountInfo.UPLOAD_URL_LIFETIME_SECONDS * 1000
+        with mock.patch.object(account_info, '_now_millis', return_value=1000000):
+            account_info.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+            account_info.take_bucket_upload_url('bucket-0')
+        # Another process drops the pool while the URL is leased.
+        self._make_info().clear_bucket_upload_data('bucket-0')
+        with mock.patch.object(
+            account_info, '_now_millis', return_value=1000000 + lifetime_millis - 10
+        ):
+            account_info.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+            self.assertEqual(
+                ('http://bucket-0', 'bucket-0_auth'),
+                account_info.take_bucket_upload_url('bucket-0')
+            )
+        with mock.patch.object(
+            account_info, '_now_millis', return_value=1000001 + lifetime_millis
+        ):
+            account_info.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+            self.assertEqual((None, None), account_info.take_bucket_upload_url('bucket-0'))
+
+    def test_discard_upload_url(self):
+        account_info = self._make_info()
+        account_info.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+        account_info.take_bucket_upload_url('bucket-0')
+        account_info.discard_bucket_upload_url('bucket-0', 'bucket-0_auth')
+        lease_millis = SqliteAccountInfo.UPLOAD_URL_LEASE_SECONDS * 1000
+        now_millis = account_info._now_millis() + lease_millis + 1
+        with mock.patch.object(account_info, '_now_millis', return_value=now_millis):
+            self.assertEqual((None, None), account_info.take_bucket_upload_url('bucket-0'))
+
     def test_clear_large_file_upload_urls(self):
         account_info = self._make_info()
         account_info.put_large_file_upload_url('file_0', 'http://file_0', 'auth_0')
         account_info.clear_large_file_upload_urls('file_0')
         self.assertEqual((None, None), account_info.take_large_file_upload_url('file_0'))
 
+    def test_reauthorizing_keeps_upload_urls(self):
+        account_info = self._make_info()
+        account_info.set_auth_data(
+            'account_id', 'auth_1', 'api_url', 'download_url', 100, 'app_key', 'realm'
+        )
+        account_info.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+        account_info.set_auth_data(
+            'account_id', 'auth_2', 'api_url', 'download_url', 100, 'app_key', 'realm'
+        )
+        self.assertEqual(
+            ('http://bucket-0', 'bucket-0_auth'),
+            self._make_info().take_bucket_upload_url('bucket-0')
+        )
+
+        account_info.put_bucket_upload_url('bucket-0', 'http://bucket-1', 'bucket-1_auth')
+        account_info.set_auth_data(
+            'other_account', 'auth_3', 'api_url', 'download_url', 100, 'app_key', 'realm'
+        )
+        self.assertEqual((None, None), account_info.take_bucket_upload_url('bucket-0'))
+
+        account_info.put_bucket_upload_url('bucket-0', 'http://bucket-2', 'bucket-2_auth')
+        account_info.clear()
+        self.assertEqual((None, None), account_info.take_bucket_upload_url('bucket-0'))
+
     def test_bucket(self):
         account_info = self._make_info()
         bucket = mock.MagicMock()
@@ -165,3 +351,110 @@ class TestSqliteAccountInfo(unittest.TestCase):
         Returns a new StoredAccountInfo that has just read the data from the file.
         """
         return SqliteAccountInfo(file_name=self.FILE_NAME)
+
+
+class TestInMemoryAccountInfo(unittest.TestCase):
+
+    FILE_NAME = '/tmp/test_b2_account_info_snapshot'
+
+    def setUp(self):
+        self.account_info = InMemoryAccountInfo()
+
+    def tearDown(self):
+        try:
+            os.unlink(self.FILE_NAME)
+        except BaseException:
+            pass
+
+    def _set_auth_data(self, account_info):
+        account_info.set_auth_data(
+            'account_id', 'account_auth', 'api_url', 'download_url', 100, 'app_key', 'realm'
+        )
+
+    def test_account_info(self):
+        try:
+            self.account_info.get_account_id()
+            self.fail('should have raised MissingAccountData')
+        except MissingAccountData:
+            pass
+        self._set_auth_data(self.account_info)
+        self.assertEqual('account_id', self.account_info.get_account_id())
+        self.assertEqual('account_auth', self.account_info.get_account_auth_token())
+        self.assertEqual(100, self.account_info.get_minimum_part_size())
+        self.account_info.clear()
+        try:
+            self.account_info.get_api_url()
+            self.fail('should have raised MissingAccountData')
+        except MissingAccountData:
+            pass
+
+    def test_bucket(self):
+        bucket = mock.MagicMock()
+        bucket.name = 'my-bucket'
+        bucket.id_ = 'bucket-0'
+        self.account_info.save_bucket(bucket)
+        self.assertEqual(
+            'bucket-0', self.account_info.get_bucket_id_or_none_from_bucket_name('my-bucket')
+        )
+        self.account_info.remove_bucket_name('my-bucket')
+        self.assertEqual(
+            None, self.account_info.get_bucket_id_or_none_from_bucket_name('my-bucket')
+        )
+        self.account_info.refresh_entire_bucket_name_cache([('a', 'bucket-1')])
+        self.assertEqual('bucket-1', self.account_info.get_bucket_id_or_none_from_bucket_name('a'))
+
+    def test_upload_urls(self):
+        self.account_info.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+        self.assertEqual(
+            ('http://bucket-0', 'bucket-0_auth'),
+            self.account_info.take_bucket_upload_url('bucket-0')
+        )
+        self.assertEqual((None, None), self.account_info.take_bucket_upload_url('bucket-0'))
+        self.account_info.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+        self.account_info.clear_bucket_upload_data('bucket-0')
+        self.assertEqual((None, None), self.account_info.take_bucket_upload_url('bucket-0'))
+
+        self.account_info.put_large_file_upload_url('file_0', 'http://file_0', 'auth_0')
+        self.assertEqual(
+            ('http://file_0', 'auth_0'), self.account_info.take_large_file_upload_url('file_0')
+        )
+        self.account_info.put_large_file_upload_url('file_0', 'http://file_0', 'auth_0')
+        self.account_info.clear_large_file_upload_urls('file_0')
+        self.assertEqual((None, None), self.account_info.take_large_file_upload_url('file_0'))
+
+    def test_reauthorizing_keeps_upload_urls(self):
+        self._set_auth_data(self.account_info)
+        self.account_info.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+        self._set_auth_data(self.account_info)
+        self.assertEqual(
+            ('http://bucket-0', 'bucket-0_auth'),
+            self.account_info.take_bucket_upload_url('bucket-0')
+        )
+        self.account_info.put_bucket_upload_url('bucket-0', 'http://bucket-0', 'bucket-0_auth')
+        self.account_info.set_auth_data(
+            'other_account', 'account_auth', 'api_url', 'download_url', 100, 'app_key', 'realm'
+        )
+        self.assertEqual((None, None), self.account_info.take_bucket_upload_url('bucket-0'))
+
+    def test_snapshot(self):
+        self._set_auth_data(self.account_info)
+        self.account_info.refresh_entire_bucket_name_cache([('a', 'bucket-1')])
+        self.account_info.put_bucket_upload_url('bucket-1', 'http://bucket-1', 'bucket-1_auth')
+        self.account_info.save_snapshot(self.FILE_NAME)
+        self.assertEqual(0o600, os.stat(self.FILE_NAME).st_mode & 0o777)
+
+        restored = InMemoryAccountInfo()
+        restored.load_snapshot(self.FILE_NAME)
+        self.assertEqual('account_auth', restored.get_account_auth_token())
+        self.assertEqual('realm', restored.get_realm())
+        self.assertEqual('bucket-1', restored.get_bucket_id_or_none_from_bucket_name('a'))
+        self.assertEqual((None, None), restored.take_bucket_upload_url('bucket-1'))
+
+    def test_corrupt_snapshot(self):
+        with open(self.FILE_NAME, 'wb') as f:
+            f.write(six.b('{"account": {}, "buckets": {}}'))
+        try:
+            self.account_info.load_snapshot(self.FILE_NAME)
+            self.fail('should have raised CorruptAccountInfo')
+        except CorruptAccountInfo:
+            pass
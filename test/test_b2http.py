@@ -9,12 +9,22 @@
 ######################################################################
 
 from b2.b2http import _translate_and_retry, _translate_errors, B2Http
-from b2.exception import BadJson, BrokenPipe, ConnectionError, ServiceError, UnknownError, UnknownHost
+from b2.concurrency import ConcurrencyController, DOWNLOAD, METADATA, UPLOAD
+from b2.download_dest import DownloadDestBytes, DownloadDestLocalFile
+from b2.hedging import HedgingPolicy
+from b2.exception import BadJson, BrokenPipe, ConnectionError, ServiceError, TooManyRequests, TransferStalled, UnknownError, UnknownHost
+from b2.progress import AbstractProgressListener, StallWatchdog
+from b2.raw_api import B2RawApi
+from b2.retry import RetryPolicy
+from b2.utils import hex_sha1_of_bytes, TempDir
 from b2.version import USER_AGENT
+import json
+import os
 import requests
 import six
 import socket
 import sys
+import threading
 import unittest
 
 if sys.version_info < (3, 3):
@@ -100,6 +110,9 @@ class TestTranslateAndRetry(unittest.TestCase):
     def setUp(self):
         self.response = MagicMock()
         self.response.status_code = 200
+        self.sleep = MagicMock()
+        # always picks the longest delay, so the waits are predictable
+        self.retry_policy = RetryPolicy(random_uniform=lambda low, high: high, sleep=self.sleep)
 
     def test_works_first_try(self):
         fcn = MagicMock()
@@ -107,38 +120,54 @@ class TestTranslateAndRetry(unittest.TestCase):
         self.assertTrue(self.response is _translate_and_retry(fcn, 3))  # no assertIs until 2.7
 
     def test_non_retryable(self):
-        with patch('time.sleep') as mock_time:
-            fcn = MagicMock()
-            fcn.side_effect = [BadJson('a'), self.response]
-            # no assertRaises until 2.7
-            try:
-                _translate_and_retry(fcn, 3)
-                self.fail('should have raised BadJson')
-            except BadJson:
-                pass
-            self.assertEqual([], mock_time.mock_calls)
+        fcn = MagicMock()
+        fcn.side_effect = [BadJson('a'), self.response]
+        # no assertRaises until 2.7
+        try:
+            _translate_and_retry(fcn, 3, retry_policy=self.retry_policy)
+            self.fail('should have raised BadJson')
+        except BadJson:
+            pass
+        self.assertEqual([], self.sleep.mock_calls)
 
     def test_works_second_try(self):
-        with patch('time.sleep') as mock_time:
-            fcn = MagicMock()
-            fcn.side_effect = [ServiceError('a'), self.response]
-            self.assertTrue(self.response is _translate_and_retry(fcn, 3))  # no assertIs until 2.7
-            self.assertEqual([call(1.0)], mock_time.mock_calls)
+        fcn = MagicMock()
+        fcn.side_effect = [ServiceError('a'), self.response]
+        actual = _translate_and_retry(fcn, 3, retry_policy=self.retry_policy)
+        self.assertTrue(self.response is actual)  # no assertIs until 2.7
+        self.assertEqual([call(3.0)], self.sleep.mock_calls)
 
     def test_never_works(self):
-        with patch('time.sleep') as mock_time:
-            fcn = MagicMock()
-            fcn.side_effect = [
-                ServiceError('a'), ServiceError('a'), ServiceError('a'), self.response
-            ]
-            # no assertRaises until 2.7
-            try:
-                _translate_and_retry(fcn, 3)
-                self.fail('should have raised ServiceError')
-            except ServiceError:
-                pass
-            self.assertEqual([call(1.0), call(1.5)], mock_time.mock_calls)
+        fcn = MagicMock()
+        fcn.side_effect = [ServiceError('a'), ServiceError('a'), ServiceError('a'), self.response]
+        # no assertRaises until 2.7
+        try:
+            _translate_and_retry(fcn, 3, retry_policy=self.retry_policy)
+            self.fail('should have raised ServiceError')
+        except ServiceError:
+            pass
+        self.assertEqual([call(3.0), call(9.0)], self.sleep.mock_calls)
 
+    def test_retry_after(self):
+        error = TooManyRequests()
+        error.retry_after_seconds = 30
+        fcn = MagicMock()
+        fcn.side_effect = [error, self.response]
+        _translate_and_retry(fcn, 3, retry_policy=self.retry_policy)
+        self.assertEqual([call(30)], self.sleep.mock_calls)
+
+    def test_error_budget(self):
+        policy = RetryPolicy(error_budgets={TooManyRequests: 2}, sleep=self.sleep)
+        fcn = MagicMock()
+        fcn.side_effect = [TooManyRequests(), TooManyRequests(), self.response]
+        # no assertRaises until 2.7
+        try:
+            _translate_and_retry(fcn, 5, retry_policy=policy, operation='b2_test')
+            self.fail('should have raised TooManyRequests')
+        except TooManyRequests:
+            pass
+        self.assertEqual(1, len(self.sleep.mock_calls))
+        self.assertEqual({'b2_test': {'TooManyRequests': 2}}, policy.get_stats())
 
 class TestB2Http(unittest.TestCase):
 
@@ -173,3 +202,335 @@ class TestB2Http(unittest.TestCase):
             self.assertTrue(self.response is r)  # no assertIs until 2.7
         self.requests.get.assert_called_with(self.URL, headers=self.EXPECTED_HEADERS, stream=True)
         self.response.close.assert_called_with()
+
+    def test_concurrency_feedback(self):
+        controller = ConcurrencyController(max_data_calls=4, max_metadata_calls=4)
+        b2_http = B2Http(
+            self.requests,
+            concurrency_controller=controller,
+            retry_policy=RetryPolicy(sleep=MagicMock())
+        )
+        busy = MagicMock()
+        busy.status_code = 503
+        busy.content = six.b('{"status": 503, "code": "service_unavailable", "message": "busy"}')
+        self.response.status_code = 200
+        self.response.content = six.b('{}')
+        busy.headers = {}
+        self.requests.post.side_effect = [busy, self.response]
+        b2_http.post_json_return_json(self.URL, self.HEADERS, self.PARAMS, try_count=2)
+        stats = controller.get_stats()
+        self.assertEqual(
+            dict(limit=2, in_flight=0, successes=1, overloads=1), stats[METADATA]
+        )
+        self.assertEqual(4, stats[UPLOAD]['limit'])
+
+        self.requests.get.return_value = self.response
+        with b2_http.get_content(self.URL, self.HEADERS):
+            self.assertEqual(1, controller.get_stats()[DOWNLOAD]['in_flight'])
+        self.assertEqual(0, controller.get_stats()[DOWNLOAD]['in_flight'])
+
+    def test_upload_throughput_is_reported(self):
+        controller = ConcurrencyController()
+        b2_http = B2Http(self.requests, concurrency_controller=controller)
+        self.requests.post.return_value = self.response
+        self.response.status_code = 200
+        self.response.content = six.b('{}')
+        data = six.BytesIO(six.b('x') * 2000000)
+        b2_http.post_content_return_json(self.URL, {'Content-Length': '2000000'}, data)
+        self.assertTrue(controller.get_limit(UPLOAD).total_throughput is not None)
+        self.assertEqual(None, controller.get_limit(METADATA).total_throughput)
+
+    def test_hedged_get(self):
+        hedging_policy = HedgingPolicy(min_samples=1, min_delay=0.001)
+        b2_http = B2Http(self.requests, hedging_policy=hedging_policy)
+        url = self.URL + '/b2api/v1/b2_download_file_by_id?fileId=1234'
+        self.response.status_code = 200
+        self.requests.get.return_value = self.response
+        with b2_http.get_content(url, self.HEADERS):
+            pass
+
+        slow_response = MagicMock()
+        slow_response.status_code = 200
+        release = threading.Event()
+
+        def slow_get(*args, **kwargs):
+            release.wait(10)
+            return slow_response
+
+        responses = [slow_get, lambda *args, **kwargs: self.response]
+        self.requests.get.side_effect = lambda *args, **kwargs: responses.pop(0)(*args, **kwargs)
+        with b2_http.get_content(url, self.HEADERS) as r:
+            self.assertTrue(self.response is r)  # no assertIs until 2.7
+        release.set()
+        stats = hedging_policy.get_stats()['b2_download_file_by_id']
+        self.assertEqual(1, stats['hedges'])
+        self.assertEqual(1, stats['hedge_wins'])
+
+    def test_hedged_post_gets_own_data(self):
+        hedging_policy = HedgingPolicy(min_samples=1)
+        b2_http = B2Http(self.requests, hedging_policy=hedging_policy)
+        self.requests.post.return_value = self.response
+        self.response.status_code = 200
+        self.response.content = six.b('{}')
+        b2_http.post_json_return_json(
+            self.URL + '/b2api/v1/b2_list_file_names', self.HEADERS, self.PARAMS
+        )
+        (pos_args, kw_args) = self.requests.post.call_args
+        self.assertEqual(self.PARAMS_JSON_BYTES, kw_args['data'])
+
+    def test_hedged_upload_uses_expect_continue(self):
+        hedging_policy = HedgingPolicy(min_samples=1, operations=[UPLOAD])
+        b2_http = B2Http(self.requests, hedging_policy=hedging_policy)
+        poster = b2_http.expect_continue_poster = MagicMock()
+        poster.can_post.return_value = True
+        bodies = []
+
+        def post(url, headers, body):
+            bodies.append(body.read())
+            return self.response
+
+        poster.post.side_effect = post
+        self.response.status_code = 200
+        self.response.content = six.b('{}')
+        data = six.BytesIO(six.b('hello'))
+        data.read()
+        b2_http.post_content_return_json(self.URL + '/b2api/v1/b2_upload_file/bucket', {}, data)
+        self.assertEqual([six.b('hello')], bodies)
+        self.assertEqual(0, self.requests.post.call_count)
+
+
+class RejectingUploadServer(object):
+    """
+    A local stand-in for an upload URL.  Like a busy storage pod, it
+    rejects a share of the uploads with 503, answering the headers
+    of an "Expect: 100-continue" request without reading the body.
+    """
+
+    def __init__(self, reject_share):
+        from six.moves import BaseHTTPServer, socketserver
+
+        self.reject_share = reject_share
+        self.request_count = 0
+        self.reject_count = 0
+        self.bytes_received = 0
+        stand_in = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle_expect_100(self):
+                if stand_in._should_reject():
+                    self._send_json(
+                        503, dict(status=503, code='service_unavailable', message='busy')
+                    )
+                    self.close_connection = True
+                    return False
+                return BaseHTTPServer.BaseHTTPRequestHandler.handle_expect_100(self)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stand_in.bytes_received += len(body)
+                self._send_json(200, dict(contentLength=len(body)))
+
+            def _send_json(self, status, value):
+                content = six.b(json.dumps(value))
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True  # the client may leave its connection open
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/b2api/v1/b2_upload_file/bucket' % (self.server.server_port,)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs=dict(poll_interval=0.05)
+        )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _should_reject(self):
+        # spreads the rejections evenly over the requests
+        self.request_count += 1
+        should_reject = int(self.request_count * self.reject_share
+                           ) != int((self.request_count - 1) * self.reject_share)
+        if should_reject:
+            self.reject_count += 1
+        return should_reject
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@unittest.skipIf(six.PY2, 'Expect: 100-continue is only supported on Python 3')
+class TestExpectContinue(unittest.TestCase):
+    DATA = six.b('x') * 1000000
+
+    def _upload(self, b2_http, url, try_count=1):
+        headers = {'Content-Length': str(len(self.DATA))}
+        return b2_http.post_content_return_json(url, headers, six.BytesIO(self.DATA), try_count)
+
+    def _make_server(self, reject_share):
+        server = RejectingUploadServer(reject_share)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_rejected_upload_sends_no_body(self):
+        server = self._make_server(1.0)
+        b2_http = B2Http(expect_continue_timeout=10)
+        with self.assertRaises(ServiceError):
+            self._upload(b2_http, server.url)
+        self.assertEqual(0, server.bytes_received)
+
+    def test_some_rejected(self):
+        server = self._make_server(0.5)
+        b2_http = B2Http(expect_continue_timeout=10, retry_policy=RetryPolicy(base_delay=0))
+        for _ in range(4):
+            response = self._upload(b2_http, server.url, 2)
+            self.assertEqual(dict(contentLength=len(self.DATA)), response)
+        self.assertEqual(3, server.reject_count)
+        self.assertEqual(4 * len(self.DATA), server.bytes_received)
+
+    def test_without_expect_continue(self):
+        server = self._make_server(0.0)
+        b2_http = B2Http(expect_continue_timeout=None)
+        self.assertEqual(dict(contentLength=len(self.DATA)), self._upload(b2_http, server.url))
+
+    def test_off_by_default(self):
+        self.assertEqual(None, B2Http().expect_continue_poster)
+
+    def test_proxy_uses_requests(self):
+        requests_module = MagicMock()
+        requests_module.post.return_value.status_code = 200
+        requests_module.post.return_value.content = six.b('{}')
+        b2_http = B2Http(requests_module, expect_continue_timeout=10)
+        url = 'https://pod-000.backblaze.com/b2api/v1/b2_upload_file/bucket'
+        proxies = {'HTTPS_PROXY': 'http://proxy.example.com:3128', 'NO_PROXY': ''}
+        with patch.dict('os.environ', proxies):
+            self.assertFalse(b2_http.expect_continue_poster.can_post(url))
+            self.assertEqual({}, self._upload(b2_http, url))
+        self.assertEqual(1, requests_module.post.call_count)
+
+    def test_timeouts(self):
+        server = self._make_server(0.0)
+        b2_http = B2Http(expect_continue_timeout=10)
+        self._upload(b2_http, server.url)
+        poster = b2_http.expect_continue_poster
+        connection = poster.local.connection
+        self.assertEqual(poster.CONNECT_TIMEOUT, connection.timeout)
+        self.assertEqual(poster.READ_TIMEOUT, connection.sock.gettimeout())
+
+
+class StallingDownloadServer(object):
+    """
+    A local stand-in for a download URL.  The first stall_count
+    downloads send their headers and then never send a byte of the
+    body; the rest send all of it.
+    """
+
+    DATA = six.b('hello world')
+
+    def __init__(self, stall_count):
+        from six.moves import BaseHTTPServer, socketserver
+
+        self.stall_count = stall_count
+        self.request_count = 0
+        self.stopped = threading.Event()
+        stand_in = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stand_in.request_count += 1
+                data = stand_in.DATA
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('x-bz-file-id', 'file-id')
+                self.send_header('x-bz-file-name', 'file1')
+                self.send_header('x-bz-content-sha1', hex_sha1_of_bytes(data))
+                self.send_header('x-bz-upload-timestamp', '1000')
+                self.end_headers()
+                self.wfile.flush()
+                if stand_in.request_count <= stand_in.stall_count:
+                    stand_in.stopped.wait(30)
+                    self.close_connection = True
+                    return
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % (self.server.server_port,)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs=dict(poll_interval=0.05)
+        )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def shutdown(self):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class RecordingProgressListener(AbstractProgressListener):
+    def __init__(self):
+        self.events = []
+
+    def set_total_bytes(self, total_byte_count):
+        self.events.append('closed too soon' if 'close' in self.events else 'total')
+
+    def bytes_completed(self, byte_count):
+        pass
+
+    def close(self):
+        self.events.append('close')
+
+
+class TestDownloadStall(unittest.TestCase):
+    def _download(self, stall_count, download=None):
+        server = StallingDownloadServer(stall_count)
+        self.addCleanup(server.shutdown)
+        raw_api = B2RawApi(
+            B2Http(retry_policy=RetryPolicy(base_delay=0)),
+            stall_watchdog=StallWatchdog(min_bytes_per_second=1, grace_seconds=0.3)
+        )
+        download = download or DownloadDestBytes()
+        try:
+            raw_api.download_file_by_id(server.url, None, 'file-id', download)
+        finally:
+            self.request_count = server.request_count
+        return download
+
+    def test_no_bytes_is_retried(self):
+        download = self._download(1)
+        self.assertEqual(StallingDownloadServer.DATA, download.bytes_io.getvalue())
+        self.assertEqual(2, self.request_count)
+
+    def test_always_stalled(self):
+        with self.assertRaises(TransferStalled):
+            self._download(B2RawApi.MAX_DOWNLOAD_ATTEMPTS)
+        self.assertEqual(B2RawApi.MAX_DOWNLOAD_ATTEMPTS, self.request_count)
+
+    def test_progress_listener_closed_after_last_try(self):
+        for stall_count in [1, B2RawApi.MAX_DOWNLOAD_ATTEMPTS]:
+            listener = RecordingProgressListener()
+            with TempDir() as temp_dir:
+                download = DownloadDestLocalFile(os.path.join(temp_dir, 'file1'), listener)
+                try:
+                    self._download(stall_count, download)
+                except TransferStalled:
+                    pass
+            attempts = min(stall_count + 1, B2RawApi.MAX_DOWNLOAD_ATTEMPTS)
+            self.assertEqual(['total'] * attempts + ['close'], listener.events)
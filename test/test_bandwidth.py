@@ -0,0 +1,166 @@
+######################################################################
+#
+# File: test/test_bandwidth.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import os
+import time
+import unittest
+
+from b2.bandwidth import (
+    DOWNLOAD, UPLOAD, BandwidthLimiter, TokenBucket, parse_control_file, parse_rate
+)
+from b2.utils import TempDir
+
+
+class FakeClock(object):
+    """
+    A clock that only moves when something sleeps.
+    """
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def local_time_at(hour, minute):
+    def local_time(seconds):
+        return time.struct_time((2016, 1, 1, hour, minute, 0, 4, 1, 0))
+
+    return local_time
+
+
+class TestParsing(unittest.TestCase):
+    def test_parse_rate(self):
+        self.assertEqual(None, parse_rate('unlimited'))
+        self.assertEqual(1000, parse_rate('1000'))
+        self.assertEqual(10000000, parse_rate('10MB'))
+        self.assertEqual(1536, parse_rate('1.5KiB'))
+        self.assertRaises(ValueError, parse_rate, '10 furlongs')
+
+    def test_parse_control_file(self):
+        lines = [
+            '# limits for the office link',
+            'upload = 10MB',
+            '',
+            'upload 22:00-06:00 = unlimited',
+            'download = 1MB',
+        ]
+        (base_rates, schedules) = parse_control_file(lines)
+        self.assertEqual({UPLOAD: 10000000, DOWNLOAD: 1000000}, base_rates)
+        self.assertEqual({UPLOAD: [(22 * 60, 6 * 60, None)], DOWNLOAD: []}, schedules)
+
+    def test_parse_control_file_errors(self):
+        self.assertRaises(ValueError, parse_control_file, ['sideways = 10MB'])
+        self.assertRaises(ValueError, parse_control_file, ['upload 25:00-26:00 = 1MB'])
+        self.assertRaises(ValueError, parse_control_file, ['upload 10MB'])
+
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(1000, clock=self.clock.time, sleep=self.clock.sleep)
+
+    def test_unlimited_does_not_sleep(self):
+        self.bucket.set_rate(None)
+        self.bucket.consume(10 ** 9)
+        self.assertEqual(0, self.clock.now)
+
+    def test_rate(self):
+        for _ in range(10):
+            self.bucket.consume(500)
+        self.assertAlmostEqual(5.0, self.clock.now)
+
+    def test_burst_after_idle(self):
+        self.clock.now = 100
+        self.bucket.consume(1000)
+        self.assertAlmostEqual(100, self.clock.now)
+        self.bucket.consume(1000)
+        self.assertAlmostEqual(101, self.clock.now)
+
+    def test_set_rate(self):
+        self.bucket.consume(1000)
+        self.bucket.set_rate(100)
+        self.bucket.consume(100)
+        self.assertAlmostEqual(2.0, self.clock.now)
+
+
+class TestBandwidthLimiter(unittest.TestCase):
+    def _make_limiter(self, hour=12, minute=0):
+        self.clock = FakeClock()
+        return BandwidthLimiter(
+            clock=self.clock.time, sleep=self.clock.sleep, local_time=local_time_at(hour, minute)
+        )
+
+    def test_directions_are_separate(self):
+        limiter = self._make_limiter()
+        limiter.set_rate(UPLOAD, 1000)
+        limiter.throttle_download(10 ** 9)
+        self.assertEqual(0, self.clock.now)
+        limiter.throttle_upload(2000)
+        self.assertAlmostEqual(2.0, self.clock.now)
+
+    def test_schedule(self):
+        limiter = self._make_limiter(hour=23, minute=30)
+        limiter.set_rate(UPLOAD, 1000)
+        limiter.set_schedule(UPLOAD, [(22 * 60, 6 * 60, 5000)])
+        self.assertEqual(5000, limiter.get_rate(UPLOAD))
+        limiter.local_time = local_time_at(6, 0)
+        limiter.set_schedule(UPLOAD, [(22 * 60, 6 * 60, 5000)])
+        self.assertEqual(1000, limiter.get_rate(UPLOAD))
+
+    def test_control_file(self):
+        limiter = self._make_limiter()
+        with TempDir() as temp_dir:
+            path = os.path.join(temp_dir, 'bandwidth')
+            with open(path, 'w') as f:
+                f.write('upload = 1000\n')
+            limiter.set_control_file(path)
+            self.assertEqual(1000, limiter.get_rate(UPLOAD))
+
+            with open(path, 'w') as f:
+                f.write('upload = 2000\ndownload = 3000\n')
+            os.utime(path, (1, 1))
+            self.clock.now += limiter.CHECK_INTERVAL
+            limiter.throttle_upload(0)
+            self.assertEqual(2000, limiter.get_rate(UPLOAD))
+            self.assertEqual(3000, limiter.get_rate(DOWNLOAD))
+
+            # a broken file leaves the old limits in place
+            with open(path, 'w') as f:
+                f.write('upload = lots\n')
+            os.utime(path, (2, 2))
+            self.clock.now += limiter.CHECK_INTERVAL
+            limiter.throttle_upload(0)
+            self.assertEqual(2000, limiter.get_rate(UPLOAD))
+
+    def test_max_rate_caps_control_file(self):
+        limiter = self._make_limiter()
+        limiter.set_max_rate(UPLOAD, 1500)
+        limiter.set_max_rate(DOWNLOAD, 1500)
+        self.assertEqual(1500, limiter.get_rate(UPLOAD))
+        with TempDir() as temp_dir:
+            path = os.path.join(temp_dir, 'bandwidth')
+            with open(path, 'w') as f:
+                f.write('upload = 1000\ndownload = 2000\nupload 11:00-13:00 = unlimited\n')
+            limiter.set_control_file(path)
+            self.assertEqual(1500, limiter.get_rate(UPLOAD))
+            self.assertEqual(1500, limiter.get_rate(DOWNLOAD))
+
+            with open(path, 'w') as f:
+                f.write('upload = 1000\n')
+            os.utime(path, (1, 1))
+            self.clock.now += limiter.CHECK_INTERVAL
+            limiter.throttle_upload(0)
+            self.assertEqual(1000, limiter.get_rate(UPLOAD))
+            self.assertEqual(1500, limiter.get_rate(DOWNLOAD))
@@ -12,6 +12,7 @@ from __future__ import absolute_import, division, print_function
 
 import os
 import sys
+import threading
 import unittest
 
 import six
@@ -24,8 +25,9 @@ from b2.file_version import FileVersionInfo
 from b2.part import Part
 from b2.progress import AbstractProgressListener
 from b2.raw_simulator import RawSimulator
-from b2.upload_source import UploadSourceBytes
-from b2.utils import hex_sha1_of_bytes, TempDir
+from b2.retry import RetryPolicy
+from b2.upload_source import UploadSourceB2File, UploadSourceBytes, UploadSourceLocalFile
+from b2.utils import choose_part_ranges, hex_sha1_of_bytes, TempDir
 
 try:
     import unittest.mock as mock
@@ -91,7 +93,9 @@ class TestCaseWithBucket(unittest.TestCase):
         self.bucket_name = 'my-bucket'
         self.simulator = RawSimulator()
         self.account_info = StubAccountInfo()
-        self.api = B2Api(self.account_info, raw_api=self.simulator)
+        self.api = B2Api(
+            self.account_info, raw_api=self.simulator, retry_policy=RetryPolicy(base_delay=0)
+        )
         self.api.authorize_account('production', 'my-account', 'good-app-key')
         self.api_url = self.account_info.get_api_url()
         self.account_auth_token = self.account_info.get_account_auth_token()
@@ -234,6 +238,53 @@ class TestLs(TestCaseWithBucket):
         self.assertEqual(expected, actual)
 
 
+class TestFileInfoCache(TestCaseWithBucket):
+    def setUp(self):
+        super(TestFileInfoCache, self).setUp()
+        self.simulator.get_file_info = mock.Mock(wraps=self.simulator.get_file_info)
+
+    def test_upload_is_remembered(self):
+        file_info = self.bucket.upload_bytes(six.b('hello world'), 'file1')
+        self.assertEqual('file1', self.api.get_file_version_info(file_info.id_).file_name)
+        self.assertEqual(0, self.simulator.get_file_info.call_count)
+
+    def test_listing_is_remembered(self):
+        file_id = self._upload_behind_the_cache('file1')
+        list(self.bucket.ls())
+        self.assertEqual(11, self.api.get_file_version_info(file_id).size)
+        self.assertEqual(0, self.simulator.get_file_info.call_count)
+
+    def test_download_is_remembered(self):
+        file_id = self._upload_behind_the_cache('file1')
+        self.bucket.download_file_by_name('file1', DownloadDestBytes())
+        self.assertEqual('file1', self.api.get_file_version_info(file_id).file_name)
+        self.assertEqual(0, self.simulator.get_file_info.call_count)
+
+    def test_fetched_once(self):
+        file_id = self._upload_behind_the_cache('file1')
+        self.assertEqual('file1', self.api.get_file_version_info(file_id).file_name)
+        self.assertEqual('file1', self.api.get_file_version_info(file_id).file_name)
+        self.assertEqual(1, self.simulator.get_file_info.call_count)
+
+    def test_delete_forgets(self):
+        file_info = self.bucket.upload_bytes(six.b('hello world'), 'file1')
+        self.api.delete_file_version(file_info.id_, 'file1')
+        self.assertEqual(None, self.api.file_info_cache.get(file_info.id_))
+
+    def test_get_many(self):
+        self.api.set_thread_pool_size(3)
+        file_ids = [self._upload_behind_the_cache('file%d' % (i,)) for i in range(3)]
+        self.api.get_file_version_info(file_ids[1])
+        versions = self.api.get_file_version_infos(file_ids)
+        self.assertEqual(['file0', 'file1', 'file2'], [v.file_name for v in versions])
+        self.assertEqual(3, self.simulator.get_file_info.call_count)
+
+    def _upload_behind_the_cache(self, file_name):
+        file_info = self.bucket.upload_bytes(six.b('hello world'), file_name)
+        self.api.file_info_cache.clear()
+        return file_info.id_
+
+
 class TestUpload(TestCaseWithBucket):
     def test_upload_bytes(self):
         data = six.b('hello world')
@@ -248,10 +299,76 @@ class TestUpload(TestCaseWithBucket):
             self.bucket.upload_local_file(path, 'file1')
             self._check_file_contents('file1', data)
 
+    def test_upload_local_file_mmap(self):
+        with TempDir() as d:
+            path = os.path.join(d, 'file1')
+            data = self._make_data(self.simulator.MIN_PART_SIZE * 3)
+            write_file(path, data)
+            upload_source = UploadSourceLocalFile(path, use_mmap=True)
+            self.bucket.upload(upload_source, 'file1')
+            self._check_file_contents('file1', data)
+
+    def test_upload_empty_local_file_mmap(self):
+        with TempDir() as d:
+            path = os.path.join(d, 'file1')
+            write_file(path, six.b(''))
+            self.bucket.upload(UploadSourceLocalFile(path, use_mmap=True), 'file1')
+            self._check_file_contents('file1', six.b(''))
+
     def test_upload_one_retryable_error(self):
         self.simulator.set_upload_errors([CanRetry(True)])
         data = six.b('hello world')
         self.bucket.upload_bytes(data, 'file1')
+        self.assertEqual(
+            {'upload_file': {'CanRetry': 1, 'ok': 1}}, self.api.retry_policy.get_stats()
+        )
+
+    def test_upload_retryable_error_keeps_other_upload_urls(self):
+        self.simulator.set_upload_errors([CanRetry(True)])
+        with mock.patch.object(self.account_info, 'clear_bucket_upload_data') as clear:
+            self.bucket.upload_bytes(six.b('hello world'), 'file1')
+        self.assertEqual([], clear.mock_calls)
+        stats = self.api.upload_health.get_stats()
+        self.assertEqual([1], [pod['recent_failures'] for pod in stats.values()])
+
+    def test_upload_url_warmer(self):
+        with mock.patch.object(self.account_info, 'put_bucket_upload_url') as put:
+            warmer = self.bucket.start_upload_url_warmer(3, wait=True)
+            self.simulator.set_upload_errors([CanRetry(True)])
+            self.bucket.upload_bytes(six.b('hello world'), 'file1')
+            self.bucket.stop_upload_url_warmer()
+            warmer.executor.shutdown(wait=True)
+        # three to start, and one to replace the URL that failed
+        self.assertEqual(dict(fetched=4, failed=0, refills=0), warmer.get_stats())
+        # plus the one put back after the upload
+        self.assertEqual(5, len(put.mock_calls))
+        self.assertEqual(None, self.bucket.upload_url_warmer)
+
+    def test_expired_token_refills_once(self):
+        warmer = self.bucket.start_upload_url_warmer(4, wait=True)
+        release = threading.Event()
+        get_upload_url = self.simulator.get_upload_url
+
+        def slow_get_upload_url(*args):
+            release.wait()
+            return get_upload_url(*args)
+
+        self.simulator.get_upload_url = mock.Mock(side_effect=slow_get_upload_url)
+        error = InvalidAuthToken('expired', 'expired_auth_token')
+        threads = [
+            threading.Thread(
+                target=self.bucket._upload_url_failed, args=('url', 'token-%d' % (i,), error)
+            ) for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        release.set()
+        self.bucket.stop_upload_url_warmer()
+        warmer.executor.shutdown(wait=True)
+        self.assertEqual(4, self.simulator.get_upload_url.call_count)
+        self.assertEqual(1, warmer.get_stats()['refills'])
 
     def test_upload_file_one_fatal_error(self):
         if IS_27_OR_LATER:
@@ -267,6 +384,27 @@ class TestUpload(TestCaseWithBucket):
             with self.assertRaises(MaxRetriesExceeded):
                 self.bucket.upload_bytes(data, 'file1')
 
+    def test_upload_from_b2_file(self):
+        data = six.b('hello world')
+        source = self.bucket.upload_bytes(data, 'file1')
+        self.simulator.stream_file_by_id = mock.Mock(wraps=self.simulator.stream_file_by_id)
+        upload_source = UploadSourceB2File(self.api, source.id_, 11, source.content_sha1)
+        self.bucket.upload(upload_source, 'file2')
+        self._check_file_contents('file2', data)
+        self.assertEqual(1, self.simulator.stream_file_by_id.call_count)
+
+    def test_upload_large_from_b2_file(self):
+        data = self._make_data(self.simulator.MIN_PART_SIZE * 3)
+        source = self.bucket.upload_bytes(data, 'file1')
+        self.simulator.download_file_range_by_id = mock.Mock(
+            wraps=self.simulator.download_file_range_by_id
+        )
+        upload_source = UploadSourceB2File(self.api, source.id_, len(data))
+        self.bucket.upload(upload_source, 'file2')
+        self._check_file_contents('file2', data)
+        # Each part is fetched once, for both hashing and uploading it.
+        self.assertEqual(3, self.simulator.download_file_range_by_id.call_count)
+
     def test_upload_large(self):
         data = self._make_data(self.simulator.MIN_PART_SIZE * 3)
         progress_listener = StubProgressListener()
@@ -362,6 +500,68 @@ class TestUpload(TestCaseWithBucket):
         self._check_file_contents('file1', data)
         self.assertEqual("600: 200 400 600", progress_listener.get_history())
 
+    def test_upload_large_resume_part_number_past_end(self):
+        part_size = self.simulator.MIN_PART_SIZE
+        data = self._make_data(part_size * 3)
+        large_file_id = self._start_large_file('file1')
+        self._upload_part(large_file_id, 4, data[:part_size])  # more parts than the local file
+        file_info = self.bucket.upload_bytes(data, 'file1')
+        self.assertNotEqual(large_file_id, file_info.id_)
+        self._check_file_contents('file1', data)
+
+    def test_upload_large_resume_lists_unfinished_files_once(self):
+        part_size = self.simulator.MIN_PART_SIZE
+        data = self._make_data(part_size * 3)
+        large_file_id_1 = self._start_large_file('file1')
+        self._upload_part(large_file_id_1, 1, data[:part_size])
+        large_file_id_2 = self._start_large_file('file2')
+        self._upload_part(large_file_id_2, 1, data[:part_size])
+        with mock.patch.object(
+            self.simulator,
+            'list_unfinished_large_files',
+            wraps=self.simulator.list_unfinished_large_files
+        ) as list_unfinished:
+            file_info_1 = self.bucket.upload_bytes(data, 'file1')
+            file_info_2 = self.bucket.upload_bytes(data, 'file2')
+            file_info_3 = self.bucket.upload_bytes(data, 'file1')
+        # one full listing, and then one check of each file resumed
+        self.assertEqual(3, list_unfinished.call_count)
+        self.assertEqual(large_file_id_1, file_info_1.id_)
+        self.assertEqual(large_file_id_2, file_info_2.id_)
+        self.assertNotEqual(large_file_id_1, file_info_3.id_)
+
+    def test_upload_large_resume_canceled_elsewhere(self):
+        part_size = self.simulator.MIN_PART_SIZE
+        data = self._make_data(part_size * 3)
+        large_file_id = self._start_large_file('file1')
+        self._upload_part(large_file_id, 1, data[:part_size])
+        self.bucket.upload_bytes(data, 'file2')  # builds the index of unfinished files
+        self.simulator.cancel_large_file(self.api_url, self.account_auth_token, large_file_id)
+        file_info = self.bucket.upload_bytes(data, 'file1')
+        self.assertNotEqual(large_file_id, file_info.id_)
+        self._check_file_contents('file1', data)
+
+    def test_upload_large_resume_stops_hashing_at_mismatch(self):
+        part_size = self.simulator.MIN_PART_SIZE
+        data = self._make_data(part_size * 5)
+        large_file_id = self._start_large_file('file1')
+        for part_number in range(1, 6):
+            part_data = data[(part_number - 1) * part_size:part_number * part_size]
+            if part_number == 3:
+                part_data = part_data[::-1]  # same size, different contents
+            self._upload_part(large_file_id, part_number, part_data)
+        self.api.set_thread_pool_size(1)  # the checks then start in order
+        with mock.patch.object(
+            self.bucket, '_hex_sha1_of_range', wraps=self.bucket._hex_sha1_of_range
+        ) as hex_sha1_of_range:
+            unfinished_file, finished_parts = self.bucket._find_unfinished_file(
+                UploadSourceBytes(data), 'file1', {},
+                choose_part_ranges(len(data), part_size)
+            )
+        self.assertEqual(None, unfinished_file)
+        offsets = [c[0][1][0] for c in hex_sha1_of_range.call_args_list]
+        self.assertEqual([0, part_size, 2 * part_size], offsets)
+
     def _start_large_file(self, file_name, file_info=None):
         if file_info is None:
             file_info = {}
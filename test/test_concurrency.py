@@ -0,0 +1,174 @@
+######################################################################
+#
+# File: test/test_concurrency.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import threading
+import unittest
+
+from b2.account_info import StubAccountInfo
+from b2.api import B2Api
+from b2.concurrency import (
+    DOWNLOAD, METADATA, UPLOAD, AdaptiveConcurrencyLimit, ConcurrencyController
+)
+from b2.exception import BadJson, ServiceError, TooManyRequests
+from b2.raw_simulator import RawSimulator
+
+
+class TestAdaptiveConcurrencyLimit(unittest.TestCase):
+    def test_overload_cuts_limit_once_per_round(self):
+        limit = AdaptiveConcurrencyLimit(8)
+        slots = [limit.acquire() for _ in range(8)]
+        for slot in slots:
+            slot.report(ServiceError('busy'))
+            slot.release()
+        self.assertEqual(4, limit.get_limit())
+
+        slot = limit.acquire()
+        slot.report(TooManyRequests())
+        slot.release()
+        self.assertEqual(2, limit.get_limit())
+        self.assertEqual(9, limit.get_stats()['overloads'])
+
+    def test_other_errors_do_not_cut_limit(self):
+        limit = AdaptiveConcurrencyLimit(4)
+        with limit.acquire() as slot:
+            slot.report(BadJson('nope'))
+        self.assertEqual(4, limit.get_limit())
+
+    def test_grows_only_when_saturated(self):
+        limit = AdaptiveConcurrencyLimit(4, initial_limit=2)
+        for _ in range(10):
+            with limit.acquire() as slot:
+                slot.report()
+        self.assertEqual(2, limit.get_limit())
+
+        # only the last call of each round uses the whole limit
+        for _ in range(3):
+            slots = [limit.acquire() for _ in range(limit.get_limit())]
+            for slot in slots:
+                slot.report()
+                slot.release()
+        self.assertEqual(3, limit.get_limit())
+
+    def test_never_above_max_or_below_min(self):
+        limit = AdaptiveConcurrencyLimit(1)
+        for _ in range(5):
+            with limit.acquire() as slot:
+                slot.report()
+        self.assertEqual(1, limit.get_limit())
+        for _ in range(5):
+            with limit.acquire() as slot:
+                slot.report(ServiceError('busy'))
+        self.assertEqual(1, limit.get_limit())
+
+    def test_acquire_waits_for_release(self):
+        limit = AdaptiveConcurrencyLimit(1)
+        first = limit.acquire()
+        acquired = threading.Event()
+
+        def acquire_second():
+            limit.acquire().release()
+            acquired.set()
+
+        thread = threading.Thread(target=acquire_second)
+        thread.start()
+        self.assertFalse(acquired.wait(0.2))
+        first.release()
+        thread.join()
+        self.assertTrue(acquired.is_set())
+
+    def _run_uploads(self, limit, seconds_for_upload, rounds=200):
+        """
+        Runs rounds of as many uploads at once as the limit allows, and
+        returns the highest limit seen.
+        """
+        highest = limit.get_limit()
+        for _ in range(rounds):
+            slots = [limit.acquire() for _ in range(limit.get_limit())]
+            for slot in slots:
+                slot.byte_count = 10000000
+                slot.report(seconds=seconds_for_upload(slot))
+                slot.release()
+            highest = max(highest, limit.get_limit())
+        return highest
+
+    def test_saturated_link_stops_growth(self):
+        # 10MB/s in total, shared by the uploads in progress
+        limit = AdaptiveConcurrencyLimit(16, initial_limit=1)
+        highest = self._run_uploads(limit, lambda slot: slot.in_flight * 1.0)
+        self.assertTrue(highest <= 3, highest)
+        self.assertTrue(limit.get_limit() <= 3)
+
+    def test_throughput_that_scales_grows(self):
+        # 10MB/s for each upload
+        limit = AdaptiveConcurrencyLimit(16, initial_limit=1)
+        self.assertEqual(16, self._run_uploads(limit, lambda slot: 1.0))
+
+    def test_small_uploads_are_not_throughput(self):
+        limit = AdaptiveConcurrencyLimit(16, initial_limit=1)
+        for _ in range(200):
+            slots = [limit.acquire() for _ in range(limit.get_limit())]
+            for slot in slots:
+                slot.byte_count = 1000
+                slot.report(seconds=slot.in_flight * 1.0)
+                slot.release()
+        self.assertEqual(16, limit.get_limit())
+
+
+class TestConcurrencyController(unittest.TestCase):
+    def test_kinds_are_separate(self):
+        controller = ConcurrencyController(max_data_calls=8, max_metadata_calls=4)
+        with controller.get_limit(UPLOAD).acquire() as slot:
+            slot.report(ServiceError('busy'))
+        stats = controller.get_stats()
+        self.assertEqual(4, stats[UPLOAD]['limit'])
+        self.assertEqual(8, stats[DOWNLOAD]['limit'])
+        self.assertEqual(4, stats[METADATA]['limit'])
+
+    def test_set_max_calls(self):
+        controller = ConcurrencyController(max_data_calls=8)
+        controller.set_max_calls(2)
+        self.assertEqual(2, controller.get_limit(UPLOAD).get_limit())
+        self.assertEqual(10, controller.get_limit(METADATA).get_limit())
+
+    def test_raising_max_raises_limit(self):
+        controller = ConcurrencyController()
+        controller.set_max_calls(64, 64)
+        slots = [controller.get_limit(UPLOAD).acquire() for _ in range(64)]
+        self.assertEqual(64, controller.get_stats()[UPLOAD]['in_flight'])
+        for slot in slots:
+            slot.release()
+
+    def test_raising_max_keeps_cut_limit(self):
+        limit = AdaptiveConcurrencyLimit(8)
+        with limit.acquire() as slot:
+            slot.report(ServiceError('busy'))
+        limit.set_max_limit(64)
+        self.assertEqual(4, limit.get_limit())
+
+
+class TestThreadPoolSize(unittest.TestCase):
+    def test_off_by_default(self):
+        api = B2Api(StubAccountInfo())
+        self.assertEqual(None, api.concurrency_controller)
+        self.assertEqual(None, api.raw_api.b2_http.concurrency_controller)
+        api.set_thread_pool_size(64)
+
+    def test_set_thread_pool_size(self):
+        api = B2Api(
+            StubAccountInfo(),
+            raw_api=RawSimulator(),
+            concurrency_controller=ConcurrencyController()
+        )
+        api.set_thread_pool_size(64)
+        upload_limit = api.concurrency_controller.get_limit(UPLOAD)
+        slots = [upload_limit.acquire() for _ in range(64)]
+        self.assertEqual(64, upload_limit.get_stats()['in_flight'])
+        for slot in slots:
+            slot.release()
@@ -27,6 +27,16 @@ except:
     import mock
 
 
+class BinaryStdout(six.StringIO):
+    """
+    A text stdout with the binary stream under it, like sys.stdout in Python 3.
+    """
+
+    def __init__(self):
+        six.StringIO.__init__(self)
+        self.buffer = six.BytesIO()
+
+
 class TestConsoleTool(unittest.TestCase):
     def setUp(self):
         self.account_info = StubAccountInfo()
@@ -63,6 +73,23 @@ class TestConsoleTool(unittest.TestCase):
         # Auth token should be in account info now
         assert self.account_info.get_account_auth_token() is not None
 
+    def test_cat(self):
+        self._authorize_account()
+        self._run_command(['create_bucket', 'my-bucket', 'allPublic'], 'bucket_0\n', '', 0)
+        self.b2_api.get_bucket_by_name('my-bucket').upload_bytes(six.b('hello world'), 'a/b')
+
+        stdout = BinaryStdout()
+        stderr = six.StringIO()
+        console_tool = ConsoleTool(self.b2_api, stdout, stderr)
+        status = console_tool.run_command(['b2', 'cat', '--partSize', '4B', 'my-bucket', 'a/b'])
+        self.assertEqual(0, status)
+        self.assertEqual(six.b('hello world'), stdout.buffer.getvalue())
+        self.assertEqual('', stderr.getvalue())
+
+        self._run_command(
+            ['cat', 'my-bucket', 'a/c'], '', 'ERROR: File not present: a/c\n', 1
+        )
+
     def test_help_with_bad_args(self):
         expected_stderr = '''
 
@@ -206,6 +233,7 @@ class TestConsoleTool(unittest.TestCase):
             # Hide the file
             expected_stdout = '''
             {
+              "action": "hide",
               "fileId": "9998",
               "fileName": "file1.txt",
               "size": 0,
@@ -350,6 +378,28 @@ class TestConsoleTool(unittest.TestCase):
                 ], expected_stdout, '', 0
             )
 
+    def test_du_and_find(self):
+        self._authorize_account()
+        self._create_my_bucket()
+        bucket = self.b2_api.get_bucket_by_name('my-bucket')
+        bucket.upload_bytes(six.b('hello world'), 'a/b.txt')
+        bucket.upload_bytes(six.b('hello'), 'a/c.jpg')
+
+        expected_stdout = '''
+        Files: 2
+        Bytes: 16
+        '''
+        self._run_command(['du', 'my-bucket', 'a'], expected_stdout, '', 0)
+        self._run_command(['find', 'my-bucket', 'a/*.txt'], 'a/b.txt\n', '', 0)
+
+    def test_offline_without_index(self):
+        self._authorize_account()
+        self._create_my_bucket()
+        expected_stderr = '''
+        ERROR: Not in the listing index: bucket bucket_0, prefix ""
+        '''
+        self._run_command(['ls', '--offline', 'my-bucket'], '', expected_stderr, 1)
+
     def test_sync(self):
         self._authorize_account()
         self._create_my_bucket()
@@ -365,6 +415,21 @@ class TestConsoleTool(unittest.TestCase):
             command = ['sync', '--threads', '5', '--noProgress', temp_dir, 'b2://my-bucket']
             self._run_command(command, expected_stdout, '', 0)
 
+    def test_sync_log_file(self):
+        self._authorize_account()
+        self._create_my_bucket()
+
+        with TempDir() as temp_dir, TempDir() as log_dir:
+            file_path = os.path.join(temp_dir, 'test.txt')
+            with open(file_path, 'wb') as f:
+                f.write(six.u('hello world').encode('utf-8'))
+            log_path = os.path.join(log_dir, 'sync.log')
+
+            command = ['sync', '--noProgress', '--logFile', log_path, temp_dir, 'b2://my-bucket']
+            self._run_command(command, '', '', 0)
+            with open(log_path) as f:
+                self.assertEqual('upload test.txt\n', f.read())
+
     def _authorize_account(self):
         """
         Prepare for a test by authorizing an account and getting an
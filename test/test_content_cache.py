@@ -0,0 +1,139 @@
+######################################################################
+#
+# File: test_content_cache.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import os
+import stat
+import unittest
+
+import six
+
+from b2.account_info import StubAccountInfo
+from b2.api import B2Api
+from b2.content_cache import CachingDownloadDest, ContentCache
+from b2.download_dest import DownloadDestBytes, DownloadDestLocalFile
+from b2.progress import DoNothingProgressListener
+from b2.raw_simulator import RawSimulator
+from b2.utils import TempDir
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestContentCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TempDir()
+        self.dir_path = self.temp_dir.__enter__()
+        self.cache_dir = os.path.join(self.dir_path, 'cache')
+        self.simulator = RawSimulator()
+        self.content_cache = ContentCache(self.cache_dir, 20)
+        self.api = B2Api(
+            StubAccountInfo(), raw_api=self.simulator, content_cache=self.content_cache
+        )
+        self.api.authorize_account('production', 'my-account', 'good-app-key')
+        self.bucket = self.api.create_bucket('my-bucket', 'allPublic')
+        self.simulator.download_file_by_id = mock.Mock(wraps=self.simulator.download_file_by_id)
+        self.simulator.download_file_by_name = mock.Mock(
+            wraps=self.simulator.download_file_by_name
+        )
+
+    def tearDown(self):
+        self.temp_dir.__exit__(None, None, None)
+
+    def test_second_download_is_cached(self):
+        file_id = self.bucket.upload_bytes(six.b('hello world'), 'file1').id_
+        for _ in range(2):
+            download = DownloadDestBytes()
+            self.api.download_file_by_id(file_id, download)
+            self.assertEqual(six.b('hello world'), download.bytes_io.getvalue())
+            self.assertEqual('file1', download.file_name)
+        self.assertEqual(1, self.simulator.download_file_by_id.call_count)
+        stats = self.content_cache.get_stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(11, stats['bytes'])
+
+    def _download_to_local_file(self, api):
+        file_id = self.bucket.upload_bytes(six.b('hello world'), 'file1').id_
+        api.download_file_by_id(file_id, DownloadDestBytes())
+        local_path = os.path.join(self.dir_path, 'file1')
+        download = DownloadDestLocalFile(local_path, DoNothingProgressListener())
+        api.download_file_by_id(file_id, download)
+        with open(local_path, 'rb') as f:
+            self.assertEqual(six.b('hello world'), f.read())
+        self.assertEqual(11, download.content_length)
+        return (file_id, local_path, api.content_cache.get(file_id).data_path)
+
+    def test_local_file_is_a_private_copy(self):
+        (_, local_path, data_path) = self._download_to_local_file(self.api)
+        self.assertNotEqual(os.stat(data_path).st_ino, os.stat(local_path).st_ino)
+        self.assertTrue(os.stat(local_path).st_mode & stat.S_IWUSR)
+        cached_mtime = os.stat(data_path).st_mtime
+        os.utime(local_path, (1, 1))
+        self.assertEqual(cached_mtime, os.stat(data_path).st_mtime)
+
+    def test_hard_links_are_opt_in(self):
+        content_cache = ContentCache(
+            os.path.join(self.dir_path, 'linking-cache'), 20, allow_hard_links=True
+        )
+        api = B2Api(StubAccountInfo(), raw_api=self.simulator, content_cache=content_cache)
+        api.authorize_account('production', 'my-account', 'good-app-key')
+        (file_id, local_path, data_path) = self._download_to_local_file(api)
+        self.assertEqual(1, content_cache.get_stats()['linked'])
+        mode = stat.S_IMODE(os.stat(data_path).st_mode)
+        # Evicting the cache entry leaves the mode of the linked file alone.
+        content_cache._remove_files(file_id)
+        self.assertEqual(mode, stat.S_IMODE(os.stat(local_path).st_mode))
+
+    def test_download_by_name(self):
+        self.bucket.upload_bytes(six.b('hello world'), 'file1')
+        for _ in range(2):
+            download = DownloadDestBytes()
+            self.bucket.download_file_by_name('file1', download)
+            self.assertEqual(six.b('hello world'), download.bytes_io.getvalue())
+        self.assertEqual(1, self.simulator.download_file_by_id.call_count)
+        self.assertEqual(0, self.simulator.download_file_by_name.call_count)
+
+    def test_least_recently_used_is_evicted(self):
+        file_ids = [
+            self.bucket.upload_bytes(six.b('123456789'), 'file%d' % (i,)).id_ for i in range(3)
+        ]
+        self.api.download_file_by_id(file_ids[0], DownloadDestBytes())
+        self.api.download_file_by_id(file_ids[1], DownloadDestBytes())
+        self.api.download_file_by_id(file_ids[0], DownloadDestBytes())
+        self.api.download_file_by_id(file_ids[2], DownloadDestBytes())
+        self.assertTrue(self.content_cache.get(file_ids[0]) is not None)
+        self.assertEqual(None, self.content_cache.get(file_ids[1]))
+        self.assertEqual(1, self.content_cache.get_stats()['evictions'])
+
+    def test_too_big_is_not_kept(self):
+        file_id = self.bucket.upload_bytes(six.b('x' * 21), 'file1').id_
+        self.api.download_file_by_id(file_id, DownloadDestBytes())
+        self.assertEqual(0, self.content_cache.get_stats()['entries'])
+
+    def test_failed_download_is_not_kept(self):
+        download = CachingDownloadDest(self.content_cache, DownloadDestBytes())
+        try:
+            with download.open('id', 'name', 5, 'text/plain', 'none', {}, 1000) as f:
+                f.write(six.b('hel'))
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(None, self.content_cache.get('id'))
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_remembered_by_next_run(self):
+        file_id = self.bucket.upload_bytes(six.b('hello world'), 'file1').id_
+        self.api.download_file_by_id(file_id, DownloadDestBytes())
+        content_cache = ContentCache(self.cache_dir, 20)
+        download = DownloadDestBytes()
+        self.assertEqual('file1', content_cache.serve(file_id, download)['fileName'])
+        self.assertEqual(six.b('hello world'), download.bytes_io.getvalue())
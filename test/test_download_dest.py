@@ -0,0 +1,62 @@
+######################################################################
+#
+# File: test_download_dest.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import mmap
+import unittest
+
+import six
+
+from b2.download_dest import DownloadDestBytes
+from b2.utils import TempDir
+
+
+class TestDownloadDestBytes(unittest.TestCase):
+    def _download(self, download_dest, data):
+        with download_dest.open('id1', 'file1', len(data), 'b2/x-auto', 'none', {}, 0) as f:
+            f.write(data[:3])
+            f.write(memoryview(data[3:]))
+        return download_dest.bytes_io
+
+    def test_small_file_uses_bytearray(self):
+        bytes_io = self._download(DownloadDestBytes(), six.b('hello world'))
+        self.assertTrue(isinstance(bytes_io.buffer, bytearray))
+        self.assertEqual(11, len(bytes_io.buffer))
+        self.assertEqual(six.b('hello world'), bytes_io.getvalue())
+        self.assertEqual(six.b('hello world'), bytes_io.getbuffer().tobytes())
+
+    def test_getbuffer_does_not_copy(self):
+        bytes_io = self._download(DownloadDestBytes(), six.b('hello world'))
+        bytes_io.buffer[0:1] = six.b('j')
+        self.assertEqual(six.b('jello world'), bytes_io.getbuffer().tobytes())
+
+    def test_empty_file(self):
+        bytes_io = self._download(DownloadDestBytes(mmap_threshold=0), six.b(''))
+        self.assertEqual(six.b(''), bytes_io.getvalue())
+
+    def test_big_file_uses_anonymous_mmap(self):
+        bytes_io = self._download(DownloadDestBytes(mmap_threshold=5), six.b('hello world'))
+        self.assertTrue(isinstance(bytes_io.buffer, mmap.mmap))
+        self.assertEqual(six.b('hello world'), bytes_io.getvalue())
+
+    def test_big_file_uses_temp_file_mmap(self):
+        with TempDir() as temp_dir:
+            download_dest = DownloadDestBytes(mmap_threshold=5, mmap_dir=temp_dir)
+            bytes_io = self._download(download_dest, six.b('hello world'))
+            self.assertTrue(isinstance(bytes_io.buffer, mmap.mmap))
+            self.assertEqual(six.b('hello world'), bytes_io.getvalue())
+
+    def test_too_much_data(self):
+        download_dest = DownloadDestBytes()
+        with download_dest.open('id1', 'file1', 5, 'b2/x-auto', 'none', {}, 0) as f:
+            try:
+                f.write(six.b('hello world'))
+                self.fail('should have raised IOError')
+            except IOError:
+                pass
@@ -0,0 +1,218 @@
+######################################################################
+#
+# File: test_download_stream.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import unittest
+
+import six
+
+from b2.account_info import StubAccountInfo
+from b2.api import B2Api
+from b2.download_stream import DownloadStream, write_file_in_order
+from b2.exception import ChecksumMismatch, FileNotPresent, TruncatedOutput
+from b2.file_version import FileVersionInfo
+from b2.raw_simulator import RawSimulator
+from b2.utils import hex_sha1_of_bytes
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class FakeResponse(object):
+    """
+    A response that records how much of it has been read.
+    """
+
+    def __init__(self, data, content_length=None, content_sha1=None):
+        self.headers = {
+            'x-bz-file-id': 'id1',
+            'x-bz-file-name': 'file1',
+            'content-type': 'b2/x-auto',
+            'content-length': str(len(data) if content_length is None else content_length),
+            'x-bz-content-sha1': content_sha1 or hex_sha1_of_bytes(data),
+            'x-bz-upload-timestamp': '5000',
+            'x-bz-info-src_last_modified_millis': '1234',
+        }
+        self.data = data
+        self.bytes_sent = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        while self.bytes_sent < len(self.data):
+            chunk = self.data[self.bytes_sent:self.bytes_sent + chunk_size]
+            self.bytes_sent += len(chunk)
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.closed = True
+
+
+class TestDownloadStream(unittest.TestCase):
+    def setUp(self):
+        self.data = six.b('0123456789') * 10
+
+    def test_reads_as_consumed(self):
+        response = FakeResponse(self.data)
+        with DownloadStream(response, chunk_size=30) as stream:
+            self.assertEqual('file1', stream.file_name)
+            self.assertEqual(100, stream.content_length)
+            self.assertEqual(1234, stream.mod_time_millis)
+            self.assertEqual({'src_last_modified_millis': '1234'}, stream.file_info)
+            chunks = stream.iter_chunks()
+            first = next(chunks)
+            self.assertTrue(isinstance(first, memoryview))
+            self.assertEqual(six.b('012345678901234567890123456789'), first.tobytes())
+            self.assertEqual(30, response.bytes_sent)
+            rest = [chunk.tobytes() for chunk in chunks]
+        self.assertEqual(self.data, first.tobytes() + six.b('').join(rest))
+        self.assertEqual(100, stream.bytes_read)
+        self.assertTrue(response.closed)
+
+    def test_truncated(self):
+        with DownloadStream(FakeResponse(self.data, content_length=200)) as stream:
+            try:
+                for _ in stream:
+                    pass
+                self.fail('should have raised TruncatedOutput')
+            except TruncatedOutput:
+                pass
+
+    def test_checksum_mismatch(self):
+        with DownloadStream(FakeResponse(self.data, content_sha1='1' * 40)) as stream:
+            try:
+                for _ in stream:
+                    pass
+                self.fail('should have raised ChecksumMismatch')
+            except ChecksumMismatch as e:
+                self.assertEqual('1' * 40, e.expected)
+
+
+class TestStreamFile(unittest.TestCase):
+    def setUp(self):
+        self.simulator = RawSimulator()
+        self.api = B2Api(StubAccountInfo(), raw_api=self.simulator)
+        self.api.authorize_account('production', 'my-account', 'good-app-key')
+        self.bucket = self.api.create_bucket('my-bucket', 'allPublic')
+        self.data = six.b('hello world') * 100
+        self.file_id = self.bucket.upload_bytes(self.data, 'file1', file_infos={'a': 'b'}).id_
+
+    def test_stream_file_by_id(self):
+        with self.api.stream_file_by_id(self.file_id, chunk_size=64) as stream:
+            self.assertEqual('file1', stream.file_name)
+            self.assertEqual({'a': 'b'}, stream.file_info)
+            chunks = [chunk.tobytes() for chunk in stream]
+        self.assertEqual(self.data, six.b('').join(chunks))
+        self.assertEqual(64, len(chunks[0]))
+
+    def test_stream_file_by_name(self):
+        with self.bucket.stream_file_by_name('file1') as stream:
+            self.assertEqual(self.file_id, stream.file_id)
+            self.assertEqual(self.data, six.b('').join(chunk.tobytes() for chunk in stream))
+
+    def test_stream_missing_file_by_name(self):
+        try:
+            self.bucket.stream_file_by_name('no-such-file')
+            self.fail('should have raised FileNotPresent')
+        except FileNotPresent:
+            pass
+
+
+class BoundCheckingOutput(object):
+    """
+    Output that checks how far ahead of the writes the fetches are.
+    """
+
+    def __init__(self, test, fetches, max_ahead):
+        self.test = test
+        self.fetches = fetches
+        self.max_ahead = max_ahead
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.test.assertTrue(self.fetches.call_count <= len(self.chunks) + self.max_ahead)
+
+
+class TestCatFile(unittest.TestCase):
+    def setUp(self):
+        self.simulator = RawSimulator()
+        self.api = B2Api(StubAccountInfo(), raw_api=self.simulator)
+        self.api.authorize_account('production', 'my-account', 'good-app-key')
+        self.bucket = self.api.create_bucket('my-bucket', 'allPublic')
+        self.data = six.b('').join(six.b('%04d' % (i,)) for i in range(250))  # 1000 bytes
+        self.file_id = self.bucket.upload_bytes(self.data, 'file1').id_
+        self.simulator.download_file_range_by_id = mock.Mock(
+            wraps=self.simulator.download_file_range_by_id
+        )
+
+    def test_cat_file_by_id_in_order(self):
+        output = BoundCheckingOutput(self, self.simulator.download_file_range_by_id, 3)
+        self.api.cat_file_by_id(self.file_id, output, part_size=64, parts_in_flight=3)
+        self.assertEqual(self.data, six.b('').join(output.chunks))
+        self.assertEqual(16, self.simulator.download_file_range_by_id.call_count)
+
+    def test_cat_file_by_name(self):
+        output = six.BytesIO()
+        file_version_info = self.bucket.cat_file_by_name('file1', output, part_size=300)
+        self.assertEqual(self.data, output.getvalue())
+        self.assertEqual(self.file_id, file_version_info.id_)
+        self.assertEqual(4, self.simulator.download_file_range_by_id.call_count)
+
+    def test_cat_empty_file(self):
+        file_id = self.bucket.upload_bytes(six.b(''), 'empty').id_
+        output = six.BytesIO()
+        self.api.cat_file_by_id(file_id, output)
+        self.assertEqual(six.b(''), output.getvalue())
+        self.assertEqual(0, self.simulator.download_file_range_by_id.call_count)
+
+    def test_cat_missing_file_by_name(self):
+        try:
+            self.bucket.cat_file_by_name('no-such-file', six.BytesIO())
+            self.fail('should have raised FileNotPresent')
+        except FileNotPresent:
+            pass
+
+    def test_checksum_mismatch(self):
+        file_version_info = FileVersionInfo(
+            self.file_id, 'file1', 1000, 'b2/x-auto', '1' * 40, {}, 0, 'upload'
+        )
+        try:
+            write_file_in_order(
+                self.api, self.file_id, six.BytesIO(), file_version_info=file_version_info
+            )
+            self.fail('should have raised ChecksumMismatch')
+        except ChecksumMismatch as e:
+            self.assertEqual(hex_sha1_of_bytes(self.data), e.actual)
+
+    def test_short_part_is_not_written(self):
+        # A file with no checksum, so only the part lengths catch this.
+        file_version_info = FileVersionInfo(
+            self.file_id, 'file1', 1000, 'b2/x-auto', 'none', {}, 0, 'upload'
+        )
+        short_part = self.data[:10]
+        self.simulator.download_file_range_by_id.side_effect = lambda *args, **kwargs: short_part
+        output = six.BytesIO()
+        try:
+            write_file_in_order(
+                self.api,
+                self.file_id,
+                output,
+                part_size=300,
+                file_version_info=file_version_info
+            )
+            self.fail('should have raised TruncatedOutput')
+        except TruncatedOutput as e:
+            self.assertEqual(10, e.bytes_read)
+            self.assertEqual(300, e.file_size)
+        self.assertEqual(six.b(''), output.getvalue())
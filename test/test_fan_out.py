@@ -0,0 +1,114 @@
+######################################################################
+#
+# File: test_fan_out.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import unittest
+
+import six
+
+from b2.account_info import StubAccountInfo
+from b2.api import B2Api
+from b2.download_dest import DownloadDestBytes
+from b2.exception import UnknownError
+from b2.fan_out import SharedUploadSource, upload_to_buckets
+from b2.file_version import FileVersionInfo
+from b2.raw_simulator import RawSimulator
+from b2.upload_source import UploadSourceBytes, UploadSourceLocalFile
+from b2.utils import hex_sha1_of_bytes, TempDir
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+def make_bucket(bucket_name):
+    """
+    Makes a bucket in an account of its own, with its own B2Api.
+    """
+    api = B2Api(StubAccountInfo(), raw_api=RawSimulator())
+    api.authorize_account('production', 'my-account', 'good-app-key')
+    return api.create_bucket(bucket_name, 'allPrivate')
+
+
+class TestSharedUploadSource(unittest.TestCase):
+    def test_checksums_computed_once(self):
+        data = six.b('hello world')
+        upload_source = UploadSourceBytes(data)
+        upload_source.get_content_sha1 = mock.Mock(wraps=upload_source.get_content_sha1)
+        upload_source.get_range_sha1 = mock.Mock(wraps=upload_source.get_range_sha1)
+        shared = SharedUploadSource(upload_source)
+        for _ in range(3):
+            self.assertEqual(hex_sha1_of_bytes(data), shared.get_content_sha1())
+            self.assertEqual(hex_sha1_of_bytes(data[6:]), shared.get_range_sha1(6, 5))
+        self.assertEqual(hex_sha1_of_bytes(data[:5]), shared.get_range_sha1(0, 5))
+        self.assertEqual(1, upload_source.get_content_sha1.call_count)
+        self.assertEqual(2, upload_source.get_range_sha1.call_count)
+
+
+class TestUploadToBuckets(unittest.TestCase):
+    def setUp(self):
+        self.bucket_1 = make_bucket('bucket-one')
+        self.bucket_2 = make_bucket('bucket-two')
+
+    def _check_file_contents(self, bucket, file_name, expected_contents):
+        download = DownloadDestBytes()
+        bucket.download_file_by_name(file_name, download)
+        self.assertEqual(expected_contents, download.bytes_io.getvalue())
+
+    def test_small_local_file(self):
+        data = six.b('hello world')
+        with TempDir() as d:
+            path = os.path.join(d, 'file1')
+            with open(path, 'wb') as f:
+                f.write(data)
+            with UploadSourceLocalFile(path, use_mmap=True) as upload_source:
+                results = upload_to_buckets(
+                    [(self.bucket_1, 'a/file1'), (self.bucket_2, 'b/file1')],
+                    upload_source,
+                    file_info={'color': 'blue'}
+                )
+                mapped_file = upload_source._file
+                self.assertFalse(mapped_file.closed)
+            self.assertTrue(upload_source._mmap is None)
+            self.assertTrue(mapped_file.closed)
+        self.assertTrue(all(isinstance(result, FileVersionInfo) for result in results))
+        self.assertEqual({'color': 'blue'}, results[1].file_info)
+        self._check_file_contents(self.bucket_1, 'a/file1', data)
+        self._check_file_contents(self.bucket_2, 'b/file1', data)
+
+    def test_large_file_parts_hashed_once(self):
+        part_size = self.bucket_1.api.raw_api.MIN_PART_SIZE
+        data = six.b('').join(six.b('%05d' % (i,)) for i in range(part_size * 3 // 5))
+        upload_source = UploadSourceBytes(data)
+        upload_source.get_range_sha1 = mock.Mock(wraps=upload_source.get_range_sha1)
+        results = upload_to_buckets(
+            [(self.bucket_1, 'file1'), (self.bucket_2, 'file1')], upload_source
+        )
+        self.assertTrue(all(isinstance(result, FileVersionInfo) for result in results))
+        self._check_file_contents(self.bucket_1, 'file1', data)
+        self._check_file_contents(self.bucket_2, 'file1', data)
+        self.assertEqual(3, upload_source.get_range_sha1.call_count)
+
+    def test_one_failure_does_not_stop_others(self):
+        data = six.b('hello world')
+        self.bucket_1.api.raw_api.upload_file = mock.Mock(side_effect=UnknownError('disk full'))
+        results = upload_to_buckets(
+            [(self.bucket_1, 'file1'), (self.bucket_2, 'file1')], UploadSourceBytes(data)
+        )
+        self.assertTrue(isinstance(results[0], UnknownError))
+        self.assertTrue(isinstance(results[1], FileVersionInfo))
+        self._check_file_contents(self.bucket_2, 'file1', data)
+
+
+if __name__ == '__main__':
+    unittest.main()
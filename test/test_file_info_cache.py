@@ -0,0 +1,83 @@
+######################################################################
+#
+# File: test_file_info_cache.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import os
+import unittest
+
+from b2.file_info_cache import FileInfoCache
+from b2.file_version import FileVersionInfo
+from b2.utils import TempDir
+
+
+def make_version(file_id, action='upload'):
+    return FileVersionInfo(
+        file_id, 'name-' + file_id, 10, 'text/plain', 'sha1', {'a': 'b'}, 1000, action
+    )
+
+
+class TestFileInfoCache(unittest.TestCase):
+    def test_get_and_put(self):
+        cache = FileInfoCache()
+        self.assertEqual(None, cache.get('id-1'))
+        version = make_version('id-1')
+        cache.put(version)
+        self.assertTrue(cache.get('id-1') is version)
+        self.assertEqual(dict(entries=1, hits=1, misses=1), cache.get_stats())
+
+    def test_least_recently_used_is_dropped(self):
+        cache = FileInfoCache(max_entries=2)
+        cache.put(make_version('id-1'))
+        cache.put(make_version('id-2'))
+        cache.get('id-1')
+        cache.put(make_version('id-3'))
+        self.assertEqual('id-1', cache.get('id-1').id_)
+        self.assertEqual(None, cache.get('id-2'))
+        self.assertEqual('id-3', cache.get('id-3').id_)
+
+    def test_unfinished_large_files_are_not_cached(self):
+        cache = FileInfoCache()
+        cache.put(make_version('id-1', action='start'))
+        self.assertEqual(None, cache.get('id-1'))
+
+    def test_remove(self):
+        cache = FileInfoCache()
+        cache.put(make_version('id-1'))
+        cache.remove('id-1')
+        self.assertEqual(None, cache.get('id-1'))
+
+    def test_persistent(self):
+        with TempDir() as temp_dir:
+            db_path = os.path.join(temp_dir, 'file_info.db')
+            cache = FileInfoCache(db_path=db_path)
+            cache.put(make_version('id-1'))
+            cache.put(make_version('id-2'))
+            cache.remove('id-2')
+
+            cache = FileInfoCache(db_path=db_path)
+            version = cache.get('id-1')
+            self.assertEqual(make_version('id-1').as_dict(), version.as_dict())
+            self.assertEqual({'a': 'b'}, version.file_info)
+            self.assertEqual('sha1', version.content_sha1)
+            self.assertEqual(None, cache.get('id-2'))
+
+    def test_put_many_is_one_transaction(self):
+        with TempDir() as temp_dir:
+            db_path = os.path.join(temp_dir, 'file_info.db')
+            cache = FileInfoCache(db_path=db_path)
+            statements = []
+            cache._get_connection().set_trace_callback(statements.append)
+            versions = [make_version('id-%d' % (i,)) for i in range(100)]
+            versions.append(make_version('id-unfinished', action='start'))
+            cache.put_many(versions)
+            self.assertEqual(1, sum(1 for s in statements if s.upper().startswith('COMMIT')))
+
+            cache = FileInfoCache(db_path=db_path)
+            self.assertEqual('name-id-99', cache.get('id-99').file_name)
+            self.assertEqual(None, cache.get('id-unfinished'))
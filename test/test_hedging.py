@@ -0,0 +1,135 @@
+######################################################################
+#
+# File: test/test_hedging.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import threading
+import time
+import unittest
+
+from b2.exception import ServiceError
+from b2.hedging import HedgingPolicy, LatencyHistogram
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentile(self):
+        histogram = LatencyHistogram()
+        self.assertEqual(None, histogram.percentile(0.95))
+        for _ in range(95):
+            histogram.record(0.01)
+        for _ in range(5):
+            histogram.record(2.0)
+        self.assertTrue(0.01 <= histogram.percentile(0.95) < 0.0125)
+        self.assertTrue(2.0 <= histogram.percentile(0.99) < 2.5)
+        self.assertEqual(100, sum(count for (_, count) in histogram.as_list()))
+
+    def test_huge_latency(self):
+        histogram = LatencyHistogram()
+        histogram.record(100000)
+        self.assertEqual([(None, 1)], histogram.as_list())
+        self.assertEqual(histogram.BOUNDS[-1], histogram.percentile(0.5))
+
+
+class SlowFirstCall(object):
+    """
+    A function whose first call waits until released, and whose
+    later calls return right away.
+    """
+
+    def __init__(self):
+        self.call_count = 0
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+        self.discarded = []
+
+    def __call__(self):
+        with self.lock:
+            self.call_count += 1
+            call_number = self.call_count
+        if call_number == 1:
+            self.release.wait(10)
+        return call_number
+
+    def discard(self, result):
+        self.discarded.append(result)
+
+
+class TestHedgingPolicy(unittest.TestCase):
+    def setUp(self):
+        self.policy = HedgingPolicy(min_samples=5, min_delay=0.001)
+
+    def warm_up(self):
+        for _ in range(5):
+            self.policy.call('b2_get_file_info', lambda: None)
+
+    def test_no_hedging_until_enough_samples(self):
+        self.assertEqual(None, self.policy.get_hedge_delay('b2_get_file_info'))
+        self.warm_up()
+        self.assertTrue(self.policy.get_hedge_delay('b2_get_file_info') is not None)
+        self.assertEqual(0, self.policy.get_stats()['b2_get_file_info']['hedges'])
+
+    def test_only_listed_operations(self):
+        fcn = SlowFirstCall()
+        fcn.release.set()
+        for _ in range(10):
+            self.policy.call('b2_delete_file_version', fcn)
+        self.assertEqual({}, self.policy.get_stats())
+
+    def test_hedge_wins(self):
+        self.warm_up()
+        fcn = SlowFirstCall()
+        self.assertEqual(2, self.policy.call('b2_get_file_info', fcn, fcn.discard))
+        fcn.release.set()
+        stats = self.policy.get_stats()['b2_get_file_info']
+        self.assertEqual(6, stats['calls'])
+        self.assertEqual(1, stats['hedges'])
+        self.assertEqual(1, stats['hedge_wins'])
+        self.assertEqual(1.0, stats['win_rate'])
+
+    def test_loser_is_discarded(self):
+        self.warm_up()
+        fcn = SlowFirstCall()
+        self.policy.call('b2_get_file_info', fcn, fcn.discard)
+        fcn.release.set()
+        for _ in range(100):
+            if fcn.discarded:
+                break
+            time.sleep(0.01)
+        self.assertEqual([1], fcn.discarded)
+
+    def test_first_error_waits_for_other_copy(self):
+        self.warm_up()
+        release = threading.Event()
+        calls = []
+
+        def fcn():
+            calls.append(True)
+            if len(calls) == 1:
+                release.wait(10)
+                raise ServiceError('busy')
+            release.set()
+            return 'ok'
+
+        self.assertEqual('ok', self.policy.call('b2_get_file_info', fcn))
+
+    def test_no_hedge_without_free_thread(self):
+        self.policy = HedgingPolicy(min_samples=5, min_delay=0.001, max_threads=1)
+        self.warm_up()
+        fcn = SlowFirstCall()
+        threading.Timer(0.05, fcn.release.set).start()
+        self.assertEqual(1, self.policy.call('b2_get_file_info', fcn))
+        self.assertEqual(0, self.policy.get_stats()['b2_get_file_info']['hedges'])
+
+    def test_runs_inline_when_pool_is_busy(self):
+        self.policy = HedgingPolicy(min_samples=5, min_delay=0.001, max_threads=1)
+        self.warm_up()
+        self.policy.thread_slots.acquire()
+        caller = threading.current_thread()
+        threads = []
+        self.policy.call('b2_get_file_info', lambda: threads.append(threading.current_thread()))
+        self.assertEqual([caller], threads)
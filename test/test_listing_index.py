@@ -0,0 +1,154 @@
+######################################################################
+#
+# File: test_listing_index.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import os
+import unittest
+
+import six
+
+from b2.account_info import StubAccountInfo
+from b2.api import B2Api
+from b2.exception import PrefixNotIndexed
+from b2.listing_index import ListingIndex, literal_prefix
+from b2.raw_simulator import RawSimulator
+from b2.sync import B2Folder
+from b2.utils import TempDir
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLiteralPrefix(unittest.TestCase):
+    def test_literal_prefix(self):
+        self.assertEqual('a/b', literal_prefix('a/b'))
+        self.assertEqual('a/', literal_prefix('a/*.txt'))
+        self.assertEqual('a/', literal_prefix('a/[xy]'))
+        self.assertEqual('', literal_prefix('?'))
+
+
+class TestListingIndex(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.index = ListingIndex(':memory:', clock=self.clock)
+        self.simulator = RawSimulator()
+        self.api = B2Api(StubAccountInfo(), raw_api=self.simulator, listing_index=self.index)
+        self.api.authorize_account('production', 'my-account', 'good-app-key')
+        self.bucket = self.api.create_bucket('my-bucket', 'allPublic')
+        for file_name in ['a.txt', 'b/c.txt', 'b/d.jpg', 'b/e/f.txt']:
+            self.bucket.upload_bytes(six.b('hello'), file_name)
+        self.simulator.list_file_versions = mock.Mock(wraps=self.simulator.list_file_versions)
+
+    def test_not_indexed(self):
+        try:
+            list(self.index.ls(self.bucket.id_))
+            self.fail('should have raised PrefixNotIndexed')
+        except PrefixNotIndexed:
+            pass
+
+    def test_ls_matches_bucket(self):
+        self.index.refresh(self.bucket)
+        self.bucket.hide_file('a.txt')
+        self.bucket.upload_bytes(six.b('hello again'), 'b/c.txt')
+        for show_versions in [False, True]:
+            for recursive in [False, True]:
+                for folder in ['', 'b']:
+                    self.assertEqual(
+                        self._ls_names(self.bucket.ls(folder, show_versions, recursive=recursive)),
+                        self._ls_names(
+                            self.index.ls(self.bucket.id_, folder, show_versions, recursive)
+                        )
+                    )
+
+    def test_read_and_written_in_pages(self):
+        self.index.PAGE_SIZE = 2
+        self.bucket.hide_file('a.txt')
+        self.bucket.upload_bytes(six.b('hello again'), 'b/c.txt')
+        self.bucket.upload_bytes(six.b('hello again'), 'b/c.txt')
+        self.index.refresh(self.bucket)
+        deleted = self.bucket.upload_bytes(six.b('bye'), 'b/g.txt')
+        self.index.refresh(self.bucket)
+        self.api.delete_file_version(deleted.id_, 'b/g.txt')
+        self.index.add_file_version(self.bucket.id_, deleted)  # stale, until the next refresh
+        self.clock.now += 1
+        self.index.refresh(self.bucket)
+        for show_versions in [False, True]:
+            listed = []
+            for (file_version_info, _) in self.index.ls(
+                self.bucket.id_, '', show_versions, recursive=True
+            ):
+                self.assertFalse(self.index.lock.locked())
+                listed.append((file_version_info, None))
+            self.assertEqual(
+                self._ls_names(self.bucket.ls('', show_versions, recursive=True)),
+                self._ls_names(listed)
+            )
+
+    def test_delete_is_written_through(self):
+        self.index.refresh(self.bucket)
+        file_version_info = self.index.find(self.bucket.id_, 'a.txt')[0]
+        self.api.delete_file_version(file_version_info.id_, 'a.txt')
+        self.assertEqual([], self.index.find(self.bucket.id_, 'a.txt'))
+
+    def test_find(self):
+        self.index.refresh(self.bucket)
+        self.assertEqual(
+            ['b/c.txt', 'b/e/f.txt'],
+            [f.file_name for f in self.index.find(self.bucket.id_, 'b/*.txt')]
+        )
+
+    def test_du(self):
+        self.index.refresh(self.bucket)
+        self.bucket.upload_bytes(six.b('hello again'), 'b/c.txt')
+        self.assertEqual((3, 21), self.index.du(self.bucket.id_, 'b'))
+        self.assertEqual((4, 26), self.index.du(self.bucket.id_, 'b', show_versions=True))
+
+    def test_sub_folder(self):
+        self.index.refresh(self.bucket, 'b/e')
+        self.assertEqual((1, 5), self.index.du(self.bucket.id_, 'b/e'))
+        try:
+            self.index.du(self.bucket.id_, 'b')
+            self.fail('should have raised PrefixNotIndexed')
+        except PrefixNotIndexed:
+            pass
+
+    def test_refresh_if_stale(self):
+        self.index.refresh_if_stale(self.bucket, 'b', 60)
+        self.index.refresh_if_stale(self.bucket, 'b/e', 60)
+        self.assertEqual(1, self.simulator.list_file_versions.call_count)
+        self.clock.now += 61
+        self.index.refresh_if_stale(self.bucket, 'b/e', 60)
+        self.assertEqual(2, self.simulator.list_file_versions.call_count)
+
+    def test_b2_folder(self):
+        folder = B2Folder('my-bucket', 'b', self.api, max_index_age_seconds=60)
+        names = [f.name for f in folder.all_files()]
+        self.assertEqual(['c.txt', 'd.jpg', 'e/f.txt'], names)
+        self.assertEqual(names, [f.name for f in folder.all_files()])
+        self.assertEqual(1, self.simulator.list_file_versions.call_count)
+
+    def test_persistent(self):
+        with TempDir() as temp_dir:
+            db_path = os.path.join(temp_dir, 'index.db')
+            ListingIndex(db_path).refresh(self.bucket)
+            index = ListingIndex(db_path)
+            self.assertEqual((4, 20), index.du(self.bucket.id_))
+
+    def _ls_names(self, listing):
+        return [(info.id_, info.file_name, folder_name) for (info, folder_name) in listing]
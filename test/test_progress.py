@@ -0,0 +1,162 @@
+######################################################################
+#
+# File: test/test_progress.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import time
+import unittest
+
+import six
+
+from b2.exception import TransferStalled
+from b2.progress import (
+    AbstractProgressListener, ProgressSampler, SampledProgressListener, StallDetector,
+    StreamWithProgress
+)
+
+
+class RecordingProgressListener(AbstractProgressListener):
+    def __init__(self):
+        self.history = []
+        self.closed = False
+
+    def set_total_bytes(self, total_byte_count):
+        self.history.append('%d:' % (total_byte_count,))
+
+    def bytes_completed(self, byte_count):
+        self.history.append(str(byte_count))
+
+    def close(self):
+        self.closed = True
+
+
+class TestSampledProgressListener(unittest.TestCase):
+    def setUp(self):
+        self.listener = RecordingProgressListener()
+        self.sampler = ProgressSampler(interval=3600)  # never samples during a test
+        self.sampled = SampledProgressListener(self.listener, self.sampler)
+
+    def test_reports_only_latest_count(self):
+        self.sampled.set_total_bytes(100)
+        self.sampled.bytes_completed(10)
+        self.sampled.bytes_completed(20)
+        self.sampled.sample()
+        self.sampled.bytes_completed(30)
+        self.sampled.close()
+        self.assertEqual(['100:', '20', '30'], self.listener.history)
+        self.assertTrue(self.listener.closed)
+
+    def test_never_goes_backwards(self):
+        self.sampled.set_total_bytes(100)
+        self.sampled.bytes_completed(50)
+        self.sampled.sample()
+        self.sampled.bytes_completed(0)  # retry
+        self.sampled.sample()
+        self.sampled.bytes_completed(100)
+        self.sampled.finish()
+        self.assertEqual(['100:', '50', '100'], self.listener.history)
+        self.assertFalse(self.listener.closed)
+        self.assertEqual(set(), self.sampler.sampled)
+
+
+class TestProgressSampler(unittest.TestCase):
+    def test_samples_in_background(self):
+        listener = RecordingProgressListener()
+        sampled = SampledProgressListener(listener, ProgressSampler(interval=0.01))
+        sampled.set_total_bytes(100)
+        sampled.bytes_completed(42)
+        deadline = time.time() + 5
+        while listener.history == ['100:'] and time.time() < deadline:
+            time.sleep(0.01)
+        sampled.close()
+        self.assertEqual(['100:', '42'], listener.history)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStallDetector(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sampler = ProgressSampler(interval=3600)
+        self.detector = StallDetector(100, 10, self.sampler, clock=self.clock)
+        self.aborted = []
+        self.detector.add_abort_callback(lambda: self.aborted.append(True))
+
+    def run_for(self, seconds, bytes_per_second):
+        for _ in range(seconds):
+            self.clock.now += 1
+            self.detector.bytes_transferred(bytes_per_second)
+            self.detector.sample()
+
+    def test_fast_transfer_is_not_stalled(self):
+        self.run_for(30, 1000)
+        self.assertFalse(self.detector.is_stalled())
+
+    def test_slow_transfer_is_stalled(self):
+        self.run_for(5, 1000)
+        try:
+            self.run_for(20, 10)
+            self.fail('should have raised TransferStalled')
+        except TransferStalled:
+            pass
+        self.assertTrue(self.detector.is_stalled())
+        self.assertEqual([True], self.aborted)
+
+    def test_not_started_until_first_bytes(self):
+        self.clock.now += 100
+        self.detector.sample()
+        self.assertFalse(self.detector.is_stalled())
+        self.assertEqual(set(), self.sampler.sampled)
+        self.detector.bytes_transferred(1000)
+        self.assertEqual(set([self.detector]), self.sampler.sampled)
+        self.detector.finish()
+        self.assertEqual(set(), self.sampler.sampled)
+
+    def test_idle_time_does_not_count(self):
+        self.detector.bytes_transferred(1000)
+        for _ in range(30):
+            self.clock.now += 1
+            self.detector.add_idle_time(1)
+            self.detector.sample()
+        self.assertFalse(self.detector.is_stalled())
+
+    def test_paused_time_does_not_count(self):
+        self.detector.bytes_transferred(1000)
+        self.detector.pause()
+        for _ in range(30):
+            self.clock.now += 1
+            self.detector.sample()
+        self.assertFalse(self.detector.is_stalled())
+        self.detector.resume()
+        self.assertEqual(30, self.detector.idle_seconds)
+        self.run_for(5, 1000)
+        self.assertFalse(self.detector.is_stalled())
+
+    def test_stream_reports_throttle_time_as_idle(self):
+        clock = self.clock
+
+        def throttle(byte_count):
+            clock.now += 5
+            return 5
+
+        stream = StreamWithProgress(
+            six.BytesIO(six.b('x') * 100),
+            RecordingProgressListener(),
+            throttle=throttle,
+            stall_detector=self.detector
+        )
+        for _ in range(10):
+            stream.read(10)
+            self.detector.sample()
+        self.assertFalse(self.detector.is_stalled())
@@ -0,0 +1,110 @@
+######################################################################
+#
+# File: test_random_access_file.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import io
+import unittest
+
+import six
+
+from b2.account_info import StubAccountInfo
+from b2.api import B2Api
+from b2.raw_simulator import RawSimulator
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestRandomAccessFile(unittest.TestCase):
+    def setUp(self):
+        self.simulator = RawSimulator()
+        self.api = B2Api(StubAccountInfo(), raw_api=self.simulator)
+        self.api.authorize_account('production', 'my-account', 'good-app-key')
+        self.bucket = self.api.create_bucket('my-bucket', 'allPublic')
+        self.data = six.b('').join(six.b('%04d' % (i,)) for i in range(250))  # 1000 bytes
+        self.file_id = self.bucket.upload_bytes(self.data, 'file1').id_
+        self.simulator.download_file_range_by_id = mock.Mock(
+            wraps=self.simulator.download_file_range_by_id
+        )
+        self.simulator.get_file_info = mock.Mock(wraps=self.simulator.get_file_info)
+
+    def _open(self, **kwargs):
+        return self.api.open_file_by_id(self.file_id, block_size=100, **kwargs)
+
+    def test_footer_is_one_request(self):
+        f = self._open()
+        f.seek(-8, io.SEEK_END)
+        self.assertEqual(six.b('02480249'), f.read())
+        self.assertEqual(1, self.simulator.download_file_range_by_id.call_count)
+        self.assertEqual(0, self.simulator.get_file_info.call_count)
+
+    def test_read_everything_in_pieces(self):
+        f = self._open(readahead_blocks=3)
+        pieces = []
+        while True:
+            piece = f.read(37)
+            if not piece:
+                break
+            pieces.append(piece)
+        self.assertEqual(self.data, six.b('').join(pieces))
+        self.assertEqual(1000, f.tell())
+        self.assertEqual(1000, f.get_stats()['bytes_fetched'])
+
+    def test_read_spanning_blocks_is_one_request(self):
+        f = self._open(readahead_blocks=0)
+        f.seek(150)
+        self.assertEqual(self.data[150:470], f.read(320))
+        self.assertEqual(1, self.simulator.download_file_range_by_id.call_count)
+
+    def test_blocks_are_cached(self):
+        f = self._open(readahead_blocks=0)
+        f.seek(500)
+        f.read(10)
+        f.seek(520)
+        f.read(10)
+        f.seek(500)
+        self.assertEqual(self.data[500:510], f.read(10))
+        self.assertEqual(1, self.simulator.download_file_range_by_id.call_count)
+
+    def test_least_recently_used_block_is_dropped(self):
+        f = self._open(readahead_blocks=0, max_cached_blocks=2)
+        for offset in [0, 100, 0, 200, 0, 100]:
+            f.seek(offset)
+            f.read(1)
+        # 0, 100 and 200 fetched; 100 dropped for 200, and fetched again
+        self.assertEqual(4, self.simulator.download_file_range_by_id.call_count)
+
+    def test_random_reads_do_not_read_ahead(self):
+        f = self._open(readahead_blocks=3)
+        for offset in [900, 100, 500]:
+            f.seek(offset)
+            f.read(1)
+        self.assertEqual(3, f.get_stats()['requests'])
+
+    def test_size_is_looked_up(self):
+        self.api.file_info_cache.clear()
+        f = self._open()
+        self.assertEqual(1000, f.size)
+        self.assertEqual(1, self.simulator.get_file_info.call_count)
+
+    def test_buffered_reader(self):
+        f = io.BufferedReader(self._open(), buffer_size=64)
+        f.seek(990)
+        self.assertEqual(self.data[990:], f.read())
+
+    def test_closed(self):
+        f = self._open()
+        f.close()
+        try:
+            f.read(1)
+            self.fail('should have raised ValueError')
+        except ValueError:
+            pass
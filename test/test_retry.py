@@ -0,0 +1,132 @@
+######################################################################
+#
+# File: test/test_retry.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import random
+import threading
+import time
+import unittest
+
+from b2.account_info import StubAccountInfo
+from b2.api import B2Api
+from b2.exception import ServiceError, TooManyRequests
+from b2.raw_simulator import RawSimulator
+from b2.retry import RetryBudget, RetryPolicy
+from b2.utils import sleep_unless_shutting_down
+
+try:
+    import unittest.mock as mock
+except:
+    import mock
+
+
+class TestRetryBudget(unittest.TestCase):
+    def setUp(self):
+        self.policy = RetryPolicy(base_delay=0, max_delay=0)
+
+    def _call(self, fails_before_success, max_attempts=5):
+        """
+        Runs one call that fails the given number of times before it
+        works, and returns whether it worked.
+        """
+        retry_state = self.policy.start('test', max_attempts)
+        for _ in range(fails_before_success):
+            if not retry_state.failed(ServiceError('busy')):
+                return False
+        retry_state.succeeded()
+        return True
+
+    def test_steady_error_rate_never_exhausts(self):
+        rand = random.Random(1)
+        for error_rate in [0.01, 0.02, 0.05]:
+            for _ in range(20000):
+                fails = 0
+                while rand.random() < error_rate:
+                    fails += 1
+                self.assertTrue(self._call(fails))
+
+    def test_every_call_failing_once(self):
+        for _ in range(1000):
+            self.assertTrue(self._call(1))
+        self.assertEqual(1.0, self.policy.retry_budget.get_token_ratio_left())
+
+    def test_outage_exhausts(self):
+        results = [self._call(100) for _ in range(100)]
+        self.assertFalse(any(results))
+        # Half of the tokens are kept, so the retries stop.
+        self.assertTrue(0.5 < self.policy.retry_budget.get_token_ratio_left() <= 0.51)
+        # Successes earn retries back.
+        for _ in range(20):
+            self._call(0)
+        self.assertTrue(self._call(1))
+
+    def test_last_try_is_not_charged(self):
+        retry_state = self.policy.start('test', 1)
+        self.assertFalse(retry_state.failed(ServiceError('busy')))
+        self.assertEqual(1.0, self.policy.retry_budget.get_token_ratio_left())
+
+    def test_scales_with_thread_pool(self):
+        api = B2Api(StubAccountInfo(), raw_api=RawSimulator())
+        api.set_thread_pool_size(64)
+        self.assertEqual(640, api.retry_policy.retry_budget.max_tokens)
+        api.set_thread_pool_size(2)
+        self.assertEqual(RetryBudget.DEFAULT_MAX_TOKENS, api.retry_policy.retry_budget.max_tokens)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.delays = []
+        # always picks the longest delay, so the waits are predictable
+        self.policy = RetryPolicy(
+            random_uniform=lambda low, high: high, sleep=self.delays.append
+        )
+
+    def test_delays_grow(self):
+        retry_state = self.policy.start('test', 5)
+        for _ in range(4):
+            retry_state.failed(ServiceError('busy'))
+        self.assertEqual([3.0, 9.0, 27.0, 60.0], self.delays)
+
+    def test_call_can_cap_delay(self):
+        retry_state = self.policy.start('upload_file', 5, max_delay=0.5)
+        for _ in range(4):
+            retry_state.failed(ServiceError('busy'))
+        self.assertEqual([0.5, 0.5, 0.5, 0.5], self.delays)
+
+    def test_retry_after_beats_cap(self):
+        error = TooManyRequests()
+        error.retry_after_seconds = 5
+        retry_state = self.policy.start('upload_file', 5, max_delay=0.5)
+        retry_state.failed(error)
+        self.assertEqual([5], self.delays)
+
+
+class TestSleepUnlessShuttingDown(unittest.TestCase):
+    def test_sleeps(self):
+        with mock.patch('b2.utils._shutdown_event', threading.Event()):
+            start = time.time()
+            sleep_unless_shutting_down(0.05)
+            self.assertTrue(0.04 < time.time() - start)
+
+    def test_shutdown_interrupts(self):
+        event = threading.Event()
+        threading.Timer(0.05, event.set).start()
+        with mock.patch('b2.utils._shutdown_event', event):
+            start = time.time()
+            # no assertRaises until 2.7
+            try:
+                sleep_unless_shutting_down(60)
+                self.fail('should have raised KeyboardInterrupt')
+            except KeyboardInterrupt:
+                pass
+            self.assertTrue(time.time() - start < 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+######################################################################
+#
+# File: test/test_session.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import threading
+import time
+import unittest
+
+from b2.account_info import InMemoryAccountInfo
+from b2.exception import InvalidAuthToken, ServiceError
+from b2.session import B2Session
+
+
+class FakeApi(object):
+    """
+    Stands in for B2Api.  Each authorization makes a new token.
+    """
+
+    def __init__(self):
+        self.account_info = InMemoryAccountInfo()
+        self.authorize_count = 0
+        self.authorize_error = None
+        self.session = None
+        self._authorize()
+
+    def authorize_automatically(self):
+        time.sleep(0.05)  # give the other threads time to pile up
+        if self.authorize_error is not None:
+            raise self.authorize_error
+        self._authorize()
+        return True
+
+    def _authorize(self):
+        self.authorize_count += 1
+        self.account_info.set_auth_data(
+            'account-id', 'token-%d' % (self.authorize_count,), 'http://api', 'http://download',
+            100, 'app-key', 'production'
+        )
+        if self.session is not None:
+            self.session.auth_token_changed()
+
+
+class FakeRawApi(object):
+    """
+    Accepts only one token, which the test sets.
+    """
+
+    def __init__(self):
+        self.valid_token = 'token-1'
+
+    def get_file_info(self, api_url, account_auth_token, file_id):
+        if account_auth_token != self.valid_token:
+            raise InvalidAuthToken('expired', 'expired_auth_token')
+        return dict(fileId=file_id, token=account_auth_token)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestReauthorization(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeApi()
+        self.raw_api = FakeRawApi()
+        self.clock = FakeClock()
+        self.session = B2Session(self.api, self.raw_api, clock=self.clock)
+        self.api.session = self.session
+
+    def test_one_thread_reauthorizes(self):
+        self.raw_api.valid_token = 'token-2'  # token-1 has expired
+        results = []
+
+        def call():
+            results.append(self.session.get_file_info('file-id')['token'])
+
+        threads = [threading.Thread(target=call) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['token-2'] * 10, results)
+        self.assertEqual(2, self.api.authorize_count)
+        self.assertEqual(1, self.session.reauthorization_count)
+
+    def test_refresh_before_expiring(self):
+        self.session.set_refresh_after_seconds(3600)
+
+        # the age of the stored token isn't known, so it's replaced right away
+        self.raw_api.valid_token = 'token-2'
+        self.assertEqual('token-2', self.session.get_file_info('file-id')['token'])
+
+        self.clock.now += 3599
+        self.assertEqual('token-2', self.session.get_file_info('file-id')['token'])
+        self.assertEqual(2, self.api.authorize_count)
+
+        self.clock.now += 1
+        self.raw_api.valid_token = 'token-3'
+        self.assertEqual('token-3', self.session.get_file_info('file-id')['token'])
+        self.assertEqual(3, self.api.authorize_count)
+
+    def test_failed_refresh_keeps_old_token(self):
+        self.session.set_refresh_after_seconds(3600)
+        self.api.authorize_error = ServiceError('busy')
+        self.assertEqual('token-1', self.session.get_file_info('file-id')['token'])
+        self.clock.now += B2Session.REFRESH_RETRY_SECONDS - 1
+        self.assertEqual('token-1', self.session.get_file_info('file-id')['token'])
+        self.api.authorize_error = None
+        self.clock.now += 1
+        self.raw_api.valid_token = 'token-2'
+        self.assertEqual('token-2', self.session.get_file_info('file-id')['token'])
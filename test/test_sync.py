@@ -11,12 +11,17 @@
 from __future__ import print_function
 
 import os
+import threading
 import unittest
 
 import six
 
+from b2.account_info import StubAccountInfo
+from b2.api import B2Api
+from b2.download_dest import DownloadDestBytes
 from b2.exception import CommandError, DestFileNewer
-from b2.sync import File, FileVersion, AbstractFolder, LocalFolder, make_folder_sync_actions, parse_sync_folder, zip_folders
+from b2.raw_simulator import RawSimulator
+from b2.sync import File, FileVersion, AbstractFolder, LocalFolder, SyncReport, make_folder_sync_actions, parse_sync_folder, sync_folders, zip_folders, zip_many_folders
 from b2.utils import TempDir
 
 try:
@@ -60,6 +65,7 @@ class FakeFolder(AbstractFolder):
     def __init__(self, f_type, files):
         self.f_type = f_type
         self.files = files
+        self.bucket = None
 
     def all_files(self):
         return iter(self.files)
@@ -128,6 +134,83 @@ class TestZipFolders(unittest.TestCase):
         )
 
 
+class TestZipManyFolders(unittest.TestCase):
+    def test_three(self):
+        file_a1 = File("a.txt", [FileVersion("a", "a", 100, "upload", 10)])
+        file_a2 = File("c.txt", [FileVersion("c", "c", 100, "upload", 10)])
+        file_b1 = File("a.txt", [FileVersion("b", "b", 200, "upload", 10)])
+        file_b2 = File("b.txt", [FileVersion("d", "d", 200, "upload", 10)])
+        file_c1 = File("c.txt", [FileVersion("e", "e", 300, "upload", 10)])
+        source = FakeFolder('local', [file_a1, file_a2])
+        dests = [FakeFolder('b2', [file_b1, file_b2]), FakeFolder('b2', [file_c1])]
+        self.assertEqual(
+            [
+                (file_a1, [file_b1, None]), (None, [file_b2, None]), (file_a2, [None, file_c1])
+            ], list(zip_many_folders(source, dests))
+        )
+
+class FakeSampler(object):
+    def add(self, item):
+        pass
+
+    def remove(self, item):
+        pass
+
+
+class TestSyncReport(unittest.TestCase):
+    def _make_report(self, **kwargs):
+        self.stdout = six.StringIO()
+        return SyncReport(self.stdout, True, sampler=FakeSampler(), **kwargs)
+
+    def test_counts_from_many_threads(self):
+        report = self._make_report()
+
+        def work():
+            for _ in six.moves.range(100):
+                report.update_compare(1)
+                report.update_transfer(1, 10)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(400, report.compare_count)
+        self.assertEqual(400, report.transfer_files)
+        self.assertEqual(4000, report.transfer_bytes)
+
+    def test_lines_printed_in_blocks(self):
+        report = self._make_report()
+        report.FLUSH_LINE_COUNT = 3
+        report.print_completion('upload a')
+        report.print_completion('upload b')
+        self.assertEqual('', self.stdout.getvalue())
+        report.print_completion('upload c')
+        self.assertEqual('upload a\nupload b\nupload c\n', self.stdout.getvalue())
+        report.print_completion('upload d')
+        report.close()
+        self.assertEqual('upload a\nupload b\nupload c\nupload d\n', self.stdout.getvalue())
+
+    def test_log_file(self):
+        log_file = six.StringIO()
+        report = self._make_report(log_file=log_file)
+        report.print_completion('upload a')
+        report.error('oops')
+        report.close()
+        self.assertEqual('upload a\noops\n', log_file.getvalue())
+        self.assertEqual('oops\n', self.stdout.getvalue())
+
+    def test_summary_only(self):
+        report = self._make_report(summary_only=True)
+        report.update_compare(3)
+        report.print_completion('upload a')
+        report.update_transfer(1, 2048)
+        report.close()
+        output = self.stdout.getvalue()
+        self.assertNotIn('upload a', output)
+        self.assertTrue(output.startswith('compared: 3 files   updated: 1 files   2.05 kB'), output)
+
+
 class FakeArgs(object):
     """
     Can be passed to sync code to simulate command-line options.
@@ -184,14 +267,6 @@ class TestMakeSyncActions(unittest.TestCase):
     def setUp(self):
         self.reporter = MagicMock()
 
-    def test_illegal_b2_to_b2(self):
-        b2_folder = FakeFolder('b2', [])
-        try:
-            list(make_folder_sync_actions(b2_folder, b2_folder, FakeArgs(), 0, self.reporter))
-            self.fail('should have raised NotImplementedError')
-        except NotImplementedError:
-            pass
-
     def test_illegal_local_to_local(self):
         local_folder = FakeFolder('local', [])
         try:
@@ -396,8 +471,35 @@ class TestMakeSyncActions(unittest.TestCase):
         actions = ['b2_download(folder/a.txt, id_a_100, /dir/a.txt, 100)']
         self._check_b2_to_local(src_file, dst_file, FakeArgs(replaceNewer=True), actions)
 
+    # b2 to b2
+
+    def test_not_there_b2_to_b2(self):
+        src_file = b2_file('a.txt', 100)
+        actions = ['b2_copy(folder/a.txt, id_a_100, folder/a.txt, 100)']
+        self._check_b2_to_b2(src_file, None, FakeArgs(), actions)
+
+    def test_newer_b2_to_b2_delete_old_versions(self):
+        src_file = b2_file('a.txt', 200)
+        dst_file = b2_file('a.txt', 100)
+        actions = [
+            'b2_copy(folder/a.txt, id_a_200, folder/a.txt, 200)',
+            'b2_delete(folder/a.txt, id_a_100, (old version))'
+        ]
+        self._check_b2_to_b2(src_file, dst_file, FakeArgs(delete=True), actions)
+
+    def test_same_b2_to_b2(self):
+        self._check_b2_to_b2(b2_file('a.txt', 100), b2_file('a.txt', 100), FakeArgs(), [])
+
+    def test_delete_hide_b2_to_b2(self):
+        dst_file = b2_file('a.txt', 100)
+        actions = ['b2_hide(folder/a.txt)']
+        self._check_b2_to_b2(None, dst_file, FakeArgs(keepDays=1000), actions)
+
     # helper methods
 
+    def _check_b2_to_b2(self, src_file, dst_file, args, expected_actions):
+        self._check_one_file('b2', src_file, 'b2', dst_file, args, expected_actions)
+
     def _check_local_to_b2(self, src_file, dst_file, args, expected_actions):
         self._check_one_file('local', src_file, 'b2', dst_file, args, expected_actions)
 
@@ -418,5 +520,118 @@ class TestMakeSyncActions(unittest.TestCase):
         self.assertEqual(expected_actions, [str(a) for a in actions])
 
 
+class TestB2ToB2Sync(unittest.TestCase):
+    def setUp(self):
+        self.simulator = RawSimulator()
+        self.api = B2Api(StubAccountInfo(), raw_api=self.simulator)
+        self.api.authorize_account('production', 'my-account', 'good-app-key')
+        self.source_bucket = self.api.create_bucket('source', 'allPrivate')
+        self.dest_bucket = self.api.create_bucket('dest', 'allPrivate')
+
+    def test_sync(self):
+        small = six.b('hello world')
+        large = six.b('').join(six.b('%05d' % (i,)) for i in range(200))  # 5 parts
+        self.source_bucket.upload_bytes(
+            small, 'a/small', file_infos={'src_last_modified_millis': '1000', 'color': 'blue'}
+        )
+        self.source_bucket.upload_bytes(
+            large, 'a/large', file_infos={'src_last_modified_millis': '2000'}
+        )
+        self.dest_bucket.upload_bytes(
+            small, 'b/small', file_infos={'src_last_modified_millis': '1000'}
+        )
+        self.dest_bucket.upload_bytes(
+            small, 'b/extra', file_infos={'src_last_modified_millis': '1000'}
+        )
+        source = parse_sync_folder('b2://source/a', self.api)
+        dest = parse_sync_folder('b2://dest/b', self.api)
+        stdout = six.StringIO()
+        sync_folders(source, dest, FakeArgs(delete=True), TODAY, stdout, True, 2)
+
+        lines = sorted(stdout.getvalue().splitlines())
+        self.assertEqual(['copy   large', 'delete extra '], lines)
+        names = [
+            (info.file_name, info.file_info['src_last_modified_millis'])
+            for (info, _) in self.dest_bucket.ls('b', recursive=True)
+        ]
+        self.assertEqual([('b/large', '2000'), ('b/small', '1000')], names)
+        download = DownloadDestBytes()
+        self.dest_bucket.download_file_by_name('b/large', download)
+        self.assertEqual(large, download.bytes_io.getvalue())
+
+
+
+class TestFanOutSync(unittest.TestCase):
+    def setUp(self):
+        self.apis = []
+        self.buckets = []
+        for bucket_name in ['bucket-one', 'bucket-two']:
+            api = B2Api(StubAccountInfo(), raw_api=RawSimulator())
+            api.authorize_account('production', 'my-account', 'good-app-key')
+            self.apis.append(api)
+            self.buckets.append(api.create_bucket(bucket_name, 'allPrivate'))
+
+    def _names(self, bucket):
+        return [info.file_name for (info, _) in bucket.ls('b', recursive=True)]
+
+    def test_sync(self):
+        with TempDir() as d:
+            write_file(os.path.join(d, 'new'), six.b('new data'))
+            write_file(os.path.join(d, 'old'), six.b('old data'))
+            os.utime(os.path.join(d, 'old'), (1, 1))
+            self.buckets[0].upload_bytes(
+                six.b('old data'), 'b/old', file_infos={'src_last_modified_millis': '1000'}
+            )
+            self.buckets[1].upload_bytes(
+                six.b('extra'), 'b/extra', file_infos={'src_last_modified_millis': '1000'}
+            )
+            source = parse_sync_folder(d, self.apis[0])
+            dest_1 = parse_sync_folder('b2://bucket-one/b', self.apis[0])
+            dest_2 = parse_sync_folder('b2://bucket-two/b', self.apis[1])
+            stdout = six.StringIO()
+            sync_folders(
+                source,
+                dest_1,
+                FakeArgs(delete=True),
+                TODAY,
+                stdout,
+                True,
+                2,
+                extra_dest_folders=[dest_2]
+            )
+
+        lines = sorted(stdout.getvalue().splitlines())
+        self.assertEqual(
+            [
+                'delete extra ', 'upload new to bucket-one', 'upload new to bucket-two',
+                'upload old to bucket-two'
+            ], lines
+        )
+        self.assertEqual(['b/new', 'b/old'], self._names(self.buckets[0]))
+        self.assertEqual(['b/new', 'b/old'], self._names(self.buckets[1]))
+        download = DownloadDestBytes()
+        self.buckets[1].download_file_by_name('b/new', download)
+        self.assertEqual(six.b('new data'), download.bytes_io.getvalue())
+
+    def test_b2_source_not_supported(self):
+        source = parse_sync_folder('b2://bucket-one/a', self.apis[0])
+        dest_1 = parse_sync_folder('b2://bucket-one/b', self.apis[0])
+        dest_2 = parse_sync_folder('b2://bucket-two/b', self.apis[1])
+        try:
+            sync_folders(
+                source,
+                dest_1,
+                FakeArgs(),
+                TODAY,
+                six.StringIO(),
+                True,
+                2,
+                extra_dest_folders=[dest_2]
+            )
+            self.fail('should have raised NotImplementedError')
+        except NotImplementedError:
+            pass
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+######################################################################
+#
+# File: test/test_upload_health.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import unittest
+
+from b2.upload_health import UploadHealthTracker
+
+FAST = 'https://pod-1.example.com/b2api/v1/b2_upload_file/bucket/a'
+SLOW = 'https://pod-2.example.com/b2api/v1/b2_upload_file/bucket/b'
+OTHER = 'https://pod-3.example.com/b2api/v1/b2_upload_file/bucket/c'
+NEW = 'https://pod-4.example.com/b2api/v1/b2_upload_file/bucket/d'
+
+
+class TestUploadHealthTracker(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.tracker = UploadHealthTracker(clock=lambda: self.now)
+
+    def _record(self, url, count, seconds):
+        for _ in range(count):
+            self.tracker.record_success(url, 1000000, seconds)
+
+    def test_failures_make_pod_unhealthy(self):
+        self.tracker.record_failure(FAST)
+        self.assertTrue(self.tracker.is_healthy(FAST))
+        self.tracker.record_failure(FAST)
+        self.assertFalse(self.tracker.is_healthy(FAST))
+        self.assertTrue(self.tracker.is_healthy(SLOW))
+
+    def test_failures_are_forgotten(self):
+        self.tracker.record_failure(FAST)
+        self.tracker.record_failure(FAST)
+        self.now += self.tracker.window_seconds + 1
+        self.assertTrue(self.tracker.is_healthy(FAST))
+        self.assertEqual({}, self.tracker.get_stats())
+
+    def test_slow_pod_is_unhealthy(self):
+        self._record(FAST, 3, 1.0)
+        self._record(OTHER, 3, 1.0)
+        self._record(SLOW, 3, 10.0)
+        self.assertTrue(self.tracker.is_healthy(FAST))
+        self.assertFalse(self.tracker.is_healthy(SLOW))
+
+    def test_small_uploads_do_not_count_toward_throughput(self):
+        # Every pod is healthy; pod 1 just happens to get the small files.
+        for _ in range(3):
+            self.tracker.record_success(FAST, 1000, 0.1)
+            self.tracker.record_success(FAST, 10000000, 2.0)
+            self.tracker.record_success(FAST, 1000, 0.1)
+            self.tracker.record_success(OTHER, 10000000, 2.0)
+            self.tracker.record_success(SLOW, 10000000, 2.5)
+        for url in [FAST, OTHER, SLOW]:
+            self.assertTrue(self.tracker.is_healthy(url))
+        self.assertEqual(5000000.0, self.tracker.get_stats()['pod-1.example.com']['throughput'])
+
+    def test_choose_best(self):
+        self._record(FAST, 3, 1.0)
+        self._record(SLOW, 3, 2.0)
+        self.assertEqual(FAST, self.tracker.choose_best([SLOW, FAST]))
+        self.assertEqual(NEW, self.tracker.choose_best([SLOW, NEW]))
+
+    def test_stats(self):
+        self._record(FAST, 1, 2.0)
+        self.assertEqual(
+            {
+                'pod-1.example.com':
+                    dict(latency=2.0, throughput=500000.0, samples=1, recent_failures=0)
+            }, self.tracker.get_stats()
+        )
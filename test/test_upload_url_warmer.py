@@ -0,0 +1,86 @@
+######################################################################
+#
+# File: test/test_upload_url_warmer.py
+#
+# Copyright 2016 Backblaze Inc. All Rights Reserved.
+#
+# License https://www.backblaze.com/using_b2_code.html
+#
+######################################################################
+
+import threading
+import unittest
+
+from b2.exception import ServiceError
+from b2.upload_url_warmer import UploadUrlWarmer
+
+
+class FakeFetcher(object):
+    def __init__(self, errors=0):
+        self.errors = errors
+        self.pool = []
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            if self.errors:
+                self.errors -= 1
+                raise ServiceError('busy')
+            self.pool.append('url-%d' % (len(self.pool),))
+
+
+class TestUploadUrlWarmer(unittest.TestCase):
+    def test_warm_up(self):
+        fetcher = FakeFetcher()
+        warmer = UploadUrlWarmer(fetcher, 4)
+        warmer.warm_up(wait=True)
+        self.assertEqual(4, len(fetcher.pool))
+        self.assertEqual(dict(fetched=4, failed=0, refills=0), warmer.get_stats())
+        warmer.stop()
+
+    def test_failures_are_counted(self):
+        fetcher = FakeFetcher(errors=1)
+        warmer = UploadUrlWarmer(fetcher, 2)
+        warmer.warm_up(wait=True)
+        self.assertEqual(1, len(fetcher.pool))
+        self.assertEqual(dict(fetched=1, failed=1, refills=0), warmer.get_stats())
+        warmer.stop()
+
+    def test_top_up_and_refill(self):
+        fetcher = FakeFetcher()
+        warmer = UploadUrlWarmer(fetcher, 3)
+        for future in warmer.top_up(2):
+            future.result()
+        self.assertEqual(2, len(fetcher.pool))
+        for future in warmer.refill():
+            future.result()
+        warmer.stop()
+        self.assertEqual(5, len(fetcher.pool))
+
+    def test_concurrent_refills_join(self):
+        release = threading.Event()
+        fetcher = FakeFetcher()
+        warmer = UploadUrlWarmer(lambda: release.wait() and fetcher(), 3)
+        emptied = []
+        first = warmer.refill(lambda: emptied.append(1))
+        second = warmer.refill(lambda: emptied.append(2))
+        self.assertEqual(first, second)
+        release.set()
+        for future in second:
+            future.result()
+        self.assertEqual([1], emptied)
+        self.assertEqual(3, len(fetcher.pool))
+        # Once it's done, a new one can start.
+        for future in warmer.refill():
+            future.result()
+        warmer.stop()
+        self.assertEqual(6, len(fetcher.pool))
+        self.assertEqual(2, warmer.get_stats()['refills'])
+
+    def test_nothing_after_stop(self):
+        fetcher = FakeFetcher()
+        warmer = UploadUrlWarmer(fetcher, 3)
+        warmer.stop()
+        self.assertEqual([], warmer.top_up(1))
+        warmer.warm_up(wait=True)
+        self.assertEqual([], fetcher.pool)